@@ -1,11 +1,48 @@
 """Agentic RAG orchestrator with tool selection and iteration."""
 
-from typing import Dict, List, Optional
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional
 from dataclasses import dataclass
-from openai import OpenAI
-from agentic.tools import search_transcripts, query_diagnostics
+from agentic.tools import search_transcripts, query_diagnostics, transcript_filters
+from agentic.completion_cache import cached_chat
+from agentic.router import ROUTER_MIN_CONFIDENCE, record_llm_routing, record_lookup, route, router_stats
+from rag_utils import SEARCH_MODE, get_client
+from diagnostics.tabular import format_table, to_table
 import os
 
+# Schema notes and conventions shared by the SQL generation and planner prompts.
+_SQL_GUIDE = """Available tables/views:
+- v_results: view with visit_id, visit_datetime, pet_name, species, test_name, analyte_code, analyte_name, value_num, value_text, unit, flag
+- visits: visit_id, pet_id, visit_datetime, chief_complaint, notes
+- pets: pet_id, name, species, breed
+- tests: test_id, visit_id, test_name, specimen_type
+
+CRITICAL SCHEMA UNDERSTANDING:
+- test_name = test panel name like 'CBC', 'Chemistry Panel', 'Urinalysis'
+- analyte_code = individual lab value code like 'BUN', 'CREA', 'WBC', 'ALT', 'HCT', 'PLT', 'NEU'
+- analyte_name = full name like 'Blood Urea Nitrogen', 'Creatinine', 'White Blood Cell Count'
+- For questions about BUN, Creatinine, WBC, ALT, etc. → filter by analyte_code, NOT test_name
+- For questions about CBC panel, Chemistry panel → filter by test_name
+- Common analyte codes: BUN, CREA (Creatinine), WBC, RBC, HCT, HGB, PLT, NEU, LYM, ALT, ALP, GLU, TP, ALB, GLOB, NA, K, CL
+
+Important:
+- For "most recent", "latest", "last visit" queries, use ORDER BY visit_datetime DESC LIMIT 1
+- Filter by pet_name using WHERE pet_name = 'Daisy' (or other pet name from the question)
+- Filter by test_name using WHERE test_name = 'CBC' (for entire test panels)
+- Filter by analyte_code using WHERE analyte_code = 'BUN' (for specific lab values like BUN, CREA, WBC)
+- Use v_results view when querying test results - it has all the data you need
+- Always include LIMIT 50 (or smaller if appropriate)
+
+Examples:
+- "most recent CBC for Daisy" → SELECT * FROM v_results WHERE pet_name = 'Daisy' AND test_name = 'CBC' ORDER BY visit_datetime DESC LIMIT 50
+- "BUN and Creatinine for Daisy" → SELECT * FROM v_results WHERE pet_name = 'Daisy' AND analyte_code IN ('BUN', 'CREA') ORDER BY visit_datetime DESC LIMIT 50
+- "abnormal results for Daisy" → SELECT * FROM v_results WHERE pet_name = 'Daisy' AND flag IN ('H', 'L') ORDER BY visit_datetime DESC LIMIT 50
+"""
+
+_PLANNER_TOOLS = ("SQL_ONLY", "DOCS_ONLY", "BOTH")
+
 
 @dataclass
 class AgenticResponse:
@@ -15,6 +52,9 @@ class AgenticResponse:
     trace: List[Dict]
     confidence: str
     confidence_reason: str
+    # Set when config["stream"] is true: yields the answer text as it is
+    # generated; final_answer is filled in once it has been consumed.
+    answer_stream: Optional[Iterator[str]] = None
 
 
 def run_agentic_chat(
@@ -35,18 +75,41 @@ def run_agentic_chat(
         config: Configuration dict with:
             - model: OpenAI model name
             - top_k: Number of chunks to retrieve
+            - search_mode: Transcript retrieval mode (vector/hybrid/lexical/prefilter)
+            - parallel_tools: Run SQL and transcript search concurrently when
+              both are selected (default True); when False they run in
+              sequence. The transcript filters come from the question and
+              the router's entities, never from SQL rows, so both ways
+              return the same evidence
+            - router: Route obvious questions with local rules, without a
+              model call (default True)
+            - router_min_confidence: Router confidence needed to skip the
+              model (default AGENTIC_ROUTER_MIN_CONFIDENCE or 0.7)
+            - planner: Decide clarification, tools and SQL in one structured
+              call (default True); False uses the separate prompts
             - max_tool_calls: Maximum tool calls (default 3)
             - sql_max_rows: Max rows for SQL queries (default 50)
+            - completion_cache: Reuse cached completions for identical
+              requests (default True); False always calls the model
+            - stream: Stream the final answer (default False); the response
+              is returned as soon as the tools have run, with evidence,
+              trace and confidence set and the answer in answer_stream
     
     Returns:
         AgenticResponse with answer, evidence, trace, and confidence
     """
+    turn_start = time.perf_counter()
     model = config.get("model", "gpt-4o")
     top_k = config.get("top_k", 4)
+    search_mode = config.get("search_mode", SEARCH_MODE)
+    parallel_tools = config.get("parallel_tools", True)
+    use_planner = config.get("planner", True)
+    use_router = config.get("router", True)
+    stream = config.get("stream", False)
     max_tool_calls = config.get("max_tool_calls", 3)
     sql_max_rows = config.get("sql_max_rows", 50)
     
-    client = OpenAI()
+    client = cached_chat(get_client(), enabled=config.get("completion_cache", True))
     trace = []
     evidence = {
         "retrieved_chunks": [],
@@ -54,42 +117,51 @@ def run_agentic_chat(
         "sql_results": []
     }
     
-    # Step 0: Check if clarification is needed
-    clarification_prompt = f"""You are a veterinary clinic assistant for demo purposes only.
-
-The user asked: "{user_msg}"
-
-Do you need clarification to answer this question? 
-- If the question mentions a pet name (like "Daisy") and asks about test results, lab values, or visits → PROCEED (you can query the database)
-- If the question mentions "most recent", "latest", "last visit", "actual values", "what are the values" → PROCEED (you can use SQL to find data)
-- If the question asks "what did the vet say" or "what are the actual values" → PROCEED (you can search transcript and/or query database)
-- If the question asks to correlate, compare, or check if results support something → PROCEED (you can use both tools)
-- Only ask for clarification if the question is completely unclear AND missing a pet name AND you cannot infer what to search for
-
-IMPORTANT: If a pet name is mentioned and the question asks for data or information, you should PROCEED. You can query the database or search transcripts to find the information.
-
-Respond with ONLY one of:
-- "NEEDS_CLARIFICATION: [your clarifying question]" (only if truly necessary - pet name missing AND question is unclear)
-- "PROCEED: [brief reason why you can proceed]"
-"""
+    # Step 0: Route obvious questions (pet names, analyte codes, intent
+    # keywords) locally; otherwise plan the turn with one structured call
+    # (proceed/clarify, tools, optional SQL), falling back to the separate
+    # prompts if it cannot be parsed
+    plan = None
+    routed = None
+    if use_router:
+        router_start = time.perf_counter()
+        routed = route(user_msg, sqlite_path,
+                       min_confidence=config.get("router_min_confidence", ROUTER_MIN_CONFIDENCE))
+        router_ms = (time.perf_counter() - router_start) * 1000
+        saved_ms = record_lookup(routed["hit"])
+        trace.append({
+            "step": "router",
+            **routed,
+            "router_ms": round(router_ms, 2),
+            "estimated_saved_ms": round(saved_ms, 1),
+            "hit_rate": round(router_stats()["hit_rate"], 3)
+        })
+        if routed["hit"]:
+            plan = {"action": "proceed", "tools": routed["tools"], "reason": "local router"}
     
-    clarification_resp = client.chat.completions.create(
-        model=model,
-        messages=[{"role": "user", "content": clarification_prompt}],
-        temperature=0.2,
-        max_tokens=150
-    )
-    clarification_text = clarification_resp.choices[0].message.content.strip()
+    llm_routing_start = time.perf_counter()
+    if plan is None and use_planner:
+        plan, plan_raw = _plan_turn(client, model, user_msg)
+        if plan is not None:
+            trace.append({"step": "planner", **plan})
+        else:
+            trace.append({"step": "planner", "fallback": True, "raw": plan_raw})
     
-    trace.append({
-        "step": "clarification_check",
-        "decision": clarification_text
-    })
+    if plan is not None:
+        clarification = plan["question"] if plan["action"] == "clarify" else None
+    else:
+        clarification_text = _check_clarification(client, model, user_msg)
+        trace.append({
+            "step": "clarification_check",
+            "decision": clarification_text
+        })
+        clarification = None
+        if clarification_text.startswith("NEEDS_CLARIFICATION:"):
+            clarification = clarification_text.replace("NEEDS_CLARIFICATION:", "").strip()
     
-    if clarification_text.startswith("NEEDS_CLARIFICATION:"):
-        question = clarification_text.replace("NEEDS_CLARIFICATION:", "").strip()
+    if clarification is not None:
         return AgenticResponse(
-            final_answer=f"I need a bit more information to help you: {question}",
+            final_answer=f"I need a bit more information to help you: {clarification}",
             evidence=evidence,
             trace=trace,
             confidence="Low",
@@ -97,37 +169,18 @@ Respond with ONLY one of:
         )
     
     # Step 1: Determine which tools to use
-    tool_selection_prompt = f"""You are a veterinary clinic assistant for demo purposes only.
-
-The user asked: "{user_msg}"
-
-You have two tools available:
-1. search_transcripts - Search visit transcripts/conversations
-2. query_diagnostics - Query lab test results and diagnostic data
-
-Based on the question, which tool(s) should you use FIRST?
-- If question mentions "lab values / test results / abnormal / ALT / WBC / last visit results" AND asks ONLY for data → use SQL (query_diagnostics) first
-- If question mentions "what did the vet say / symptoms / advice / discharge instructions" AND asks ONLY about transcript → use docs (search_transcripts) first
-- If question asks to "correlate", "compare", "support", "do results support", "vet's assessment", or needs BOTH transcript AND lab data → use BOTH
-
-Respond with ONLY one of:
-- "SQL_ONLY"
-- "DOCS_ONLY"
-- "BOTH"
-"""
-    
-    tool_resp = client.chat.completions.create(
-        model=model,
-        messages=[{"role": "user", "content": tool_selection_prompt}],
-        temperature=0.2,
-        max_tokens=50
-    )
-    tool_choice = tool_resp.choices[0].message.content.strip()
-    
-    trace.append({
-        "step": "tool_selection",
-        "choice": tool_choice
-    })
+    planned_sql = None
+    if plan is not None:
+        tool_choice = plan["tools"]
+        planned_sql = plan.get("sql")
+    else:
+        tool_choice = _select_tools(client, model, user_msg)
+        trace.append({
+            "step": "tool_selection",
+            "choice": tool_choice
+        })
+    if not (routed and routed["hit"]):
+        record_llm_routing((time.perf_counter() - llm_routing_start) * 1000)
     
     # Step 2: Execute tools (up to max_tool_calls iterations)
     tool_calls_made = 0
@@ -139,98 +192,45 @@ Respond with ONLY one of:
         
         # Determine what to do in this iteration
         if iteration == 0:
-            # First iteration: use the selected tool(s)
-            if "SQL" in tool_choice or "BOTH" in tool_choice:
-                # Generate SQL query
-                sql_prompt = f"""You are a veterinary clinic assistant. Generate a SQL query to answer: "{user_msg}"
-
-Available tables/views:
-- v_results: view with visit_id, visit_datetime, pet_name, species, test_name, analyte_code, analyte_name, value_num, value_text, unit, flag
-- visits: visit_id, pet_id, visit_datetime, chief_complaint, notes
-- pets: pet_id, name, species, breed
-- tests: test_id, visit_id, test_name, specimen_type
-
-CRITICAL SCHEMA UNDERSTANDING:
-- test_name = test panel name like 'CBC', 'Chemistry Panel', 'Urinalysis'
-- analyte_code = individual lab value code like 'BUN', 'CREA', 'WBC', 'ALT', 'HCT', 'PLT', 'NEU'
-- analyte_name = full name like 'Blood Urea Nitrogen', 'Creatinine', 'White Blood Cell Count'
-- For questions about BUN, Creatinine, WBC, ALT, etc. → filter by analyte_code, NOT test_name
-- For questions about CBC panel, Chemistry panel → filter by test_name
-- Common analyte codes: BUN, CREA (Creatinine), WBC, RBC, HCT, HGB, PLT, NEU, LYM, ALT, ALP, GLU, TP, ALB, GLOB, NA, K, CL
-
-Important:
-- For "most recent", "latest", "last visit" queries, use ORDER BY visit_datetime DESC LIMIT 1
-- Filter by pet_name using WHERE pet_name = 'Daisy' (or other pet name from the question)
-- Filter by test_name using WHERE test_name = 'CBC' (for entire test panels)
-- Filter by analyte_code using WHERE analyte_code = 'BUN' (for specific lab values like BUN, CREA, WBC)
-- Use v_results view when querying test results - it has all the data you need
-- Always include LIMIT 50 (or smaller if appropriate)
-
-Examples:
-- "most recent CBC for Daisy" → SELECT * FROM v_results WHERE pet_name = 'Daisy' AND test_name = 'CBC' ORDER BY visit_datetime DESC LIMIT 50
-- "BUN and Creatinine for Daisy" → SELECT * FROM v_results WHERE pet_name = 'Daisy' AND analyte_code IN ('BUN', 'CREA') ORDER BY visit_datetime DESC LIMIT 50
-- "abnormal results for Daisy" → SELECT * FROM v_results WHERE pet_name = 'Daisy' AND flag IN ('H', 'L') ORDER BY visit_datetime DESC LIMIT 50
-
-Generate ONLY a valid SQL SELECT query. Do not include explanations, just the SQL query.
-"""
-                sql_resp = client.chat.completions.create(
-                    model=model,
-                    messages=[{"role": "user", "content": sql_prompt}],
-                    temperature=0.2,
-                    max_tokens=200
-                )
-                sql_query = sql_resp.choices[0].message.content.strip()
-                # Clean up SQL (remove markdown code blocks if present)
-                if sql_query.startswith("```"):
-                    sql_query = sql_query.split("```")[1]
-                    if sql_query.startswith("sql"):
-                        sql_query = sql_query[3:].strip()
-                sql_query = sql_query.rstrip(";").strip()
-                
-                trace.append({
-                    "step": f"iteration_{iteration}_sql_generation",
-                    "sql": sql_query
-                })
-                
-                sql_result = query_diagnostics(sql_query, max_rows=sql_max_rows)
-                evidence["sql_queries"].append(sql_query)
-                if sql_result["error"]:
-                    all_context.append(f"SQL Error: {sql_result['error']}")
-                else:
-                    # Format SQL results for context
-                    if sql_result["rows"]:
-                        preview_rows = sql_result["rows"][:10]  # First 10 rows for context
-                        evidence["sql_results"].append({
-                            "query": sql_query,
-                            "columns": sql_result["columns"],
-                            "row_count": sql_result["row_count"],
-                            "preview": preview_rows
-                        })
-                        context_text = f"Lab Results:\nColumns: {', '.join(sql_result['columns'])}\n"
-                        context_text += f"Total rows: {sql_result['row_count']}\n"
-                        context_text += "Sample rows:\n"
-                        for row in preview_rows:
-                            context_text += str(row) + "\n"
-                        all_context.append(context_text)
-                    else:
-                        all_context.append("SQL query returned no results.")
-                
-                tool_calls_made += 1
+            # First iteration: use the selected tool(s). The SQL and transcript
+            # branches are independent, so with BOTH they run concurrently and
+            # their trace entries, evidence and context are merged afterwards
+            # in a fixed order (SQL, then transcripts).
+            run_sql = "SQL" in tool_choice or "BOTH" in tool_choice
+            run_docs = "DOCS" in tool_choice or "BOTH" in tool_choice
+            concurrent = run_sql and run_docs and parallel_tools
+            entities = {"pet_name": routed["pets"]} if routed else None
+            branches = {}
+            wall_start = time.perf_counter()
+            if concurrent:
+                with ThreadPoolExecutor(max_workers=2) as pool:
+                    sql_future = pool.submit(_run_sql_branch, client, model, user_msg, sql_max_rows, iteration, planned_sql)
+                    docs_future = pool.submit(_run_docs_branch, user_msg, top_k, rag_store_path, search_mode, entities, iteration)
+                    branches["sql"] = sql_future.result()
+                    branches["docs"] = docs_future.result()
+            else:
+                if run_sql:
+                    branches["sql"] = _run_sql_branch(client, model, user_msg, sql_max_rows, iteration, planned_sql)
+                if run_docs:
+                    branches["docs"] = _run_docs_branch(user_msg, top_k, rag_store_path, search_mode, entities, iteration)
             
-            if "DOCS" in tool_choice or "BOTH" in tool_choice:
-                # Search transcripts
-                docs_result = search_transcripts(user_msg, top_k=top_k, store_path=rag_store_path)
-                evidence["retrieved_chunks"].extend(docs_result["chunks"])
-                
-                if docs_result["chunks"]:
-                    context_text = "Visit Transcript Excerpts:\n"
-                    for chunk in docs_result["chunks"]:
-                        context_text += f"[{chunk['chunk_id']}] From {chunk['source_doc']} (score: {chunk['score']:.3f}):\n{chunk['text']}\n\n"
-                    all_context.append(context_text)
-                else:
-                    all_context.append("No relevant transcript excerpts found.")
-                
+            for name in ("sql", "docs"):
+                if name not in branches:
+                    continue
+                branch = branches[name]
+                trace.extend(branch["trace"])
+                for key, items in branch["evidence"].items():
+                    evidence[key].extend(items)
+                all_context.append(branch["context"])
                 tool_calls_made += 1
+            
+            if branches:
+                trace.append({
+                    "step": f"iteration_{iteration}_tool_timings",
+                    "concurrent": concurrent,
+                    "branch_ms": {name: round(b["elapsed_ms"], 1) for name, b in branches.items()},
+                    "wall_ms": round((time.perf_counter() - wall_start) * 1000, 1)
+                })
         else:
             # Subsequent iterations: check if we need to refine
             if not all_context or (len(evidence["retrieved_chunks"]) == 0 and len(evidence["sql_results"]) == 0):
@@ -243,32 +243,29 @@ Previous SQL query returned no results. Try a different approach.
 Generate a SQL SELECT query using v_results view or other tables.
 Always include LIMIT 50. Just the SQL, no explanations.
 """
-                    sql_resp = client.chat.completions.create(
+                    sql_text = client.complete(
+                        "sql_refine",
                         model=model,
                         messages=[{"role": "user", "content": sql_prompt}],
                         temperature=0.3,
                         max_tokens=200
                     )
-                    sql_query = sql_resp.choices[0].message.content.strip()
-                    if sql_query.startswith("```"):
-                        sql_query = sql_query.split("```")[1]
-                        if sql_query.startswith("sql"):
-                            sql_query = sql_query[3:].strip()
-                    sql_query = sql_query.rstrip(";").strip()
+                    sql_query = _clean_sql(sql_text.strip())
                     
                     sql_result = query_diagnostics(sql_query, max_rows=sql_max_rows)
                     evidence["sql_queries"].append(sql_query)
+                    if sql_result.get("rejected"):
+                        trace.append(_rejection_entry(iteration, sql_query, sql_result))
                     if not sql_result["error"] and sql_result["rows"]:
-                        preview_rows = sql_result["rows"][:10]
+                        preview_rows = to_table(sql_result["columns"], sql_result["rows"][:10])["rows"]
                         evidence["sql_results"].append({
                             "query": sql_query,
                             "columns": sql_result["columns"],
                             "row_count": sql_result["row_count"],
                             "preview": preview_rows
                         })
-                        context_text = f"Lab Results (refined query):\n"
-                        for row in preview_rows:
-                            context_text += str(row) + "\n"
+                        context_text = "Lab Results (refined query):\n"
+                        context_text += format_table(sql_result["columns"], preview_rows, total_rows=sql_result["row_count"])
                         all_context.append(context_text)
                 
                 tool_calls_made += 1
@@ -299,14 +296,8 @@ Do not invent lab values or test results.
     for msg in chat_history[-3:]:
         messages.append(msg)
     
-    answer_resp = client.chat.completions.create(
-        model=model,
-        messages=messages,
-        temperature=0.2
-    )
-    final_answer = answer_resp.choices[0].message.content
-    
-    # Determine confidence
+    # Determine confidence (from the evidence alone, so it is known before
+    # the answer is generated)
     has_docs = len(evidence["retrieved_chunks"]) > 0
     has_sql = len(evidence["sql_results"]) > 0 and any(r["row_count"] > 0 for r in evidence["sql_results"])
     
@@ -327,10 +318,297 @@ Do not invent lab values or test results.
         "has_sql": has_sql
     })
     
-    return AgenticResponse(
-        final_answer=final_answer,
+    response = AgenticResponse(
+        final_answer="",
         evidence=evidence,
         trace=trace,
         confidence=confidence,
         confidence_reason=confidence_reason
     )
+    tools_ms = (time.perf_counter() - turn_start) * 1000
+    if stream:
+        response.answer_stream = _stream_answer(client, model, messages, response, turn_start, tools_ms)
+        return response
+    
+    response.final_answer = client.complete(
+        "answer",
+        model=model,
+        messages=messages,
+        temperature=0.2
+    )
+    total_ms = (time.perf_counter() - turn_start) * 1000
+    trace.append({
+        "step": "answer_timing",
+        "streamed": False,
+        "tools_ms": round(tools_ms, 1),
+        "first_token_ms": round(total_ms, 1),
+        "total_ms": round(total_ms, 1)
+    })
+    return response
+
+
+def _stream_answer(client, model: str, messages: List[Dict], response: AgenticResponse,
+                   turn_start: float, tools_ms: float) -> Iterator[str]:
+    """Yield the final answer as it streams in, then fill in final_answer and the timing trace entry."""
+    first_token_ms = None
+    parts = []
+    for text in client.stream("answer", model=model, messages=messages, temperature=0.2):
+        if first_token_ms is None:
+            first_token_ms = (time.perf_counter() - turn_start) * 1000
+        parts.append(text)
+        yield text
+    total_ms = (time.perf_counter() - turn_start) * 1000
+    response.final_answer = "".join(parts)
+    response.trace.append({
+        "step": "answer_timing",
+        "streamed": True,
+        "tools_ms": round(tools_ms, 1),
+        "first_token_ms": round(first_token_ms if first_token_ms is not None else total_ms, 1),
+        "total_ms": round(total_ms, 1)
+    })
+
+
+def _check_clarification(client, model: str, user_msg: str) -> str:
+    """Fallback step: ask whether the question needs clarification (PROCEED/NEEDS_CLARIFICATION)."""
+    clarification_prompt = f"""You are a veterinary clinic assistant for demo purposes only.
+
+The user asked: "{user_msg}"
+
+Do you need clarification to answer this question? 
+- If the question mentions a pet name (like "Daisy") and asks about test results, lab values, or visits → PROCEED (you can query the database)
+- If the question mentions "most recent", "latest", "last visit", "actual values", "what are the values" → PROCEED (you can use SQL to find data)
+- If the question asks "what did the vet say" or "what are the actual values" → PROCEED (you can search transcript and/or query database)
+- If the question asks to correlate, compare, or check if results support something → PROCEED (you can use both tools)
+- Only ask for clarification if the question is completely unclear AND missing a pet name AND you cannot infer what to search for
+
+IMPORTANT: If a pet name is mentioned and the question asks for data or information, you should PROCEED. You can query the database or search transcripts to find the information.
+
+Respond with ONLY one of:
+- "NEEDS_CLARIFICATION: [your clarifying question]" (only if truly necessary - pet name missing AND question is unclear)
+- "PROCEED: [brief reason why you can proceed]"
+"""
+    
+    text = client.complete(
+        "clarification",
+        model=model,
+        messages=[{"role": "user", "content": clarification_prompt}],
+        temperature=0.2,
+        max_tokens=150
+    )
+    return text.strip()
+
+
+def _select_tools(client, model: str, user_msg: str) -> str:
+    """Fallback step: choose SQL_ONLY, DOCS_ONLY or BOTH."""
+    tool_selection_prompt = f"""You are a veterinary clinic assistant for demo purposes only.
+
+The user asked: "{user_msg}"
+
+You have two tools available:
+1. search_transcripts - Search visit transcripts/conversations
+2. query_diagnostics - Query lab test results and diagnostic data
+
+Based on the question, which tool(s) should you use FIRST?
+- If question mentions "lab values / test results / abnormal / ALT / WBC / last visit results" AND asks ONLY for data → use SQL (query_diagnostics) first
+- If question mentions "what did the vet say / symptoms / advice / discharge instructions" AND asks ONLY about transcript → use docs (search_transcripts) first
+- If question asks to "correlate", "compare", "support", "do results support", "vet's assessment", or needs BOTH transcript AND lab data → use BOTH
+
+Respond with ONLY one of:
+- "SQL_ONLY"
+- "DOCS_ONLY"
+- "BOTH"
+"""
+    
+    text = client.complete(
+        "tool_selection",
+        model=model,
+        messages=[{"role": "user", "content": tool_selection_prompt}],
+        temperature=0.2,
+        max_tokens=50
+    )
+    return text.strip()
+
+
+def _plan_turn(client, model: str, user_msg: str):
+    """
+    Decide clarification, tools and (optionally) the SQL in a single call.
+    
+    Returns (plan, raw_text); plan is None when the response cannot be parsed
+    into a valid decision, in which case the caller uses the separate prompts.
+    """
+    planner_prompt = f"""You are a veterinary clinic assistant for demo purposes only.
+
+The user asked: "{user_msg}"
+
+Plan how to answer in ONE decision.
+
+1. Clarification: PROCEED if the question names a pet (like "Daisy"), asks about test results, lab values, visits,
+"most recent"/"latest"/"last visit", what the vet said, or asks to correlate/compare/check whether results support
+something. Only ask for clarification if the question is completely unclear AND missing a pet name AND you cannot
+infer what to search for.
+
+2. Tools (only when proceeding):
+- search_transcripts searches visit transcripts/conversations; query_diagnostics queries lab test results
+- "lab values / test results / abnormal / ALT / WBC / last visit results" and ONLY data → "SQL_ONLY"
+- "what did the vet say / symptoms / advice / discharge instructions" and ONLY the transcript → "DOCS_ONLY"
+- "correlate", "compare", "support", "vet's assessment", or needs transcript AND lab data → "BOTH"
+
+3. SQL (only for SQL_ONLY or BOTH): a single read-only SELECT answering the question.
+{_SQL_GUIDE}
+
+Respond with ONLY a JSON object, no markdown:
+{{"action": "proceed" or "clarify", "question": "clarifying question, or null", "tools": "SQL_ONLY" or "DOCS_ONLY" or "BOTH" (null when clarifying), "sql": "SELECT ... or null", "reason": "brief reason"}}
+"""
+    text = client.complete(
+        "planner",
+        model=model,
+        messages=[{"role": "user", "content": planner_prompt}],
+        temperature=0.2,
+        max_tokens=400
+    )
+    raw = text.strip()
+    return _parse_plan(raw), raw
+
+
+def _parse_plan(raw: str) -> Optional[Dict]:
+    """Validate the planner's JSON; None if it is not a usable plan."""
+    text = raw.strip()
+    if text.startswith("```"):
+        text = text.split("```")[1]
+        if text.startswith("json"):
+            text = text[4:]
+    try:
+        data = json.loads(text)
+    except ValueError:
+        return None
+    if not isinstance(data, dict):
+        return None
+    action = str(data.get("action") or "").lower()
+    reason = data.get("reason") or ""
+    if action == "clarify":
+        question = data.get("question")
+        if not isinstance(question, str) or not question.strip():
+            return None
+        return {"action": "clarify", "question": question.strip(), "reason": reason}
+    tools = str(data.get("tools") or "").upper()
+    if action != "proceed" or tools not in _PLANNER_TOOLS:
+        return None
+    plan = {"action": "proceed", "tools": tools, "reason": reason}
+    sql = data.get("sql")
+    if tools != "DOCS_ONLY" and isinstance(sql, str) and sql.strip():
+        plan["sql"] = _clean_sql(sql.strip())
+    return plan
+
+
+def _clean_sql(sql_query: str) -> str:
+    """Strip markdown code fences and a trailing semicolon from generated SQL."""
+    if sql_query.startswith("```"):
+        sql_query = sql_query.split("```")[1]
+        if sql_query.startswith("sql"):
+            sql_query = sql_query[3:].strip()
+    return sql_query.rstrip(";").strip()
+
+
+def _generate_sql(client, model: str, user_msg: str) -> str:
+    """Ask the model for a SQL query answering the question."""
+    sql_prompt = f"""You are a veterinary clinic assistant. Generate a SQL query to answer: "{user_msg}"
+
+{_SQL_GUIDE}
+Generate ONLY a valid SQL SELECT query. Do not include explanations, just the SQL query.
+"""
+    text = client.complete(
+        "sql_generation",
+        model=model,
+        messages=[{"role": "user", "content": sql_prompt}],
+        temperature=0.2,
+        max_tokens=200
+    )
+    return _clean_sql(text.strip())
+
+
+def _run_sql_branch(client, model: str, user_msg: str, sql_max_rows: int, iteration: int,
+                    planned_sql: Optional[str] = None) -> Dict:
+    """Run SQL for the question, generating it unless the planner already did.
+
+    Returns the branch's trace entries, evidence, context text and elapsed
+    time; the caller merges them into the turn.
+    """
+    start = time.perf_counter()
+    sql_query = planned_sql or _generate_sql(client, model, user_msg)
+    trace = [{
+        "step": f"iteration_{iteration}_sql_generation",
+        "sql": sql_query,
+        "source": "planner" if planned_sql else "sql_prompt"
+    }]
+    
+    sql_result = query_diagnostics(sql_query, max_rows=sql_max_rows)
+    trace[0]["cached"] = sql_result.get("cached", False)
+    if sql_result.get("rejected"):
+        trace.append(_rejection_entry(iteration, sql_query, sql_result))
+    evidence = {"sql_queries": [sql_query], "sql_results": []}
+    if sql_result["error"]:
+        context_text = f"SQL Error: {sql_result['error']}"
+    elif sql_result["rows"]:
+        # Format SQL results for context
+        # First 10 rows for context, header once (see diagnostics.tabular)
+        preview_rows = to_table(sql_result["columns"], sql_result["rows"][:10])["rows"]
+        evidence["sql_results"].append({
+            "query": sql_query,
+            "columns": sql_result["columns"],
+            "row_count": sql_result["row_count"],
+            "preview": preview_rows
+        })
+        context_text = f"Lab Results ({sql_result['row_count']} rows):\n"
+        context_text += format_table(sql_result["columns"], preview_rows, total_rows=sql_result["row_count"])
+    else:
+        context_text = "SQL query returned no results."
+    
+    return {
+        "trace": trace,
+        "evidence": evidence,
+        "context": context_text,
+        "elapsed_ms": (time.perf_counter() - start) * 1000
+    }
+
+
+def _rejection_entry(iteration: int, sql_query: str, sql_result: Dict) -> Dict:
+    """Trace entry for a query the SQL governor refused or stopped."""
+    return {
+        "step": f"iteration_{iteration}_sql_rejected",
+        "sql": sql_query,
+        "reason": sql_result["rejected"],
+        "plan": sql_result.get("plan", [])
+    }
+
+
+def _run_docs_branch(user_msg: str, top_k: int, rag_store_path: str, search_mode: str,
+                     entities: Optional[Dict], iteration: int) -> Dict:
+    """Search transcripts for the question; same return shape as _run_sql_branch."""
+    start = time.perf_counter()
+    # Narrow to the pet/visit named in the question if the store has that metadata
+    doc_filters = transcript_filters(user_msg, entities, store_path=rag_store_path)
+    docs_result = search_transcripts(user_msg, top_k=top_k, store_path=rag_store_path,
+                                     filters=doc_filters, mode=search_mode)
+    if doc_filters and not docs_result["chunks"]:
+        docs_result = search_transcripts(user_msg, top_k=top_k, store_path=rag_store_path, mode=search_mode)
+    trace = [{
+        "step": f"iteration_{iteration}_docs_search",
+        "mode": search_mode,
+        "filters": doc_filters,
+        "filtered": bool(docs_result["filters"]),
+        "chunks": docs_result["count"]
+    }]
+    
+    if docs_result["chunks"]:
+        context_text = "Visit Transcript Excerpts:\n"
+        for chunk in docs_result["chunks"]:
+            context_text += f"[{chunk['chunk_id']}] From {chunk['source_doc']} (score: {chunk['score']:.3f}):\n{chunk['text']}\n\n"
+    else:
+        context_text = "No relevant transcript excerpts found."
+    
+    return {
+        "trace": trace,
+        "evidence": {"retrieved_chunks": docs_result["chunks"]},
+        "context": context_text,
+        "elapsed_ms": (time.perf_counter() - start) * 1000
+    }
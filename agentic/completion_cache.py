@@ -0,0 +1,215 @@
+"""Persistent SQLite cache of chat completions.
+
+The planning, clarification, tool-selection and SQL prompts run at low
+temperature, so the same question gets the same completion; demos and
+regression runs ask the same questions over and over. Completions are keyed
+by the SHA-256 of (model, normalized messages, temperature, max_tokens),
+where normalizing keeps each message's role and collapses whitespace in its
+content. Entries expire ``ttl`` seconds after they were written; every hit
+refreshes ``last_used`` and past ``max_entries`` rows the least recently used
+ones are evicted. Hits and misses are counted per step ("planner",
+"sql_generation", "answer", ...).
+
+``CachedChat`` wraps an OpenAI client; ``complete`` returns the completion
+text and ``stream`` yields it as it arrives (a hit yields the cached text at
+once). Empty completions are never stored, and neither are retry steps
+(``UNCACHED_STEPS``, e.g. "sql_refine" after a failed query): a retry is asked
+because the first answer did not work, so replaying a cached one would repeat
+the failure. Set ``AGENTIC_COMPLETION_CACHE=0`` to bypass the cache
+everywhere, or pass ``enabled=False`` to ``cached_chat`` for a single caller.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+COMPLETION_CACHE_PATH = os.environ.get("AGENTIC_COMPLETION_CACHE_PATH", "completion_cache.db")
+COMPLETION_CACHE_MAX_ENTRIES = int(os.environ.get("AGENTIC_COMPLETION_CACHE_MAX_ENTRIES", "5000"))
+COMPLETION_CACHE_TTL = float(os.environ.get("AGENTIC_COMPLETION_CACHE_TTL", str(7 * 24 * 3600)))
+COMPLETION_CACHE_ENABLED = os.environ.get("AGENTIC_COMPLETION_CACHE", "1") != "0"
+# Steps that always call the model.
+UNCACHED_STEPS = frozenset({"sql_refine"})
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS completions (
+  key        TEXT PRIMARY KEY,
+  step       TEXT NOT NULL,
+  model      TEXT NOT NULL,
+  response   TEXT NOT NULL,
+  created_at REAL NOT NULL,
+  last_used  INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_completions_last_used ON completions(last_used);
+"""
+
+
+def completion_key(model: str, messages: List[Dict], temperature: Optional[float] = None,
+                   max_tokens: Optional[int] = None) -> str:
+    """Cache key for a request: SHA-256 of model, normalized messages, temperature and max_tokens."""
+    normalized = [[m.get("role"), " ".join(str(m.get("content") or "").split())] for m in messages]
+    payload = json.dumps([model, normalized, temperature, max_tokens], separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class CompletionCache:
+    """SQLite-backed TTL + LRU cache of completion texts with per-step hit/miss counters."""
+
+    def __init__(self, path: str = COMPLETION_CACHE_PATH, max_entries: int = COMPLETION_CACHE_MAX_ENTRIES,
+                 ttl: float = COMPLETION_CACHE_TTL):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.steps: Dict[str, Dict[str, int]] = {}
+        self.evictions = 0
+        self.expired = 0
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+
+    def _count(self, step: str, outcome: str) -> None:
+        counts = self.steps.setdefault(step, {"hits": 0, "misses": 0})
+        counts[outcome] += 1
+
+    def get(self, key: str, step: str) -> Optional[str]:
+        """Cached completion text for ``key``, or None if missing or expired."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, created_at FROM completions WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and time.time() - row[1] > self.ttl:
+                self._conn.execute("DELETE FROM completions WHERE key = ?", (key,))
+                self._conn.commit()
+                self.expired += 1
+                row = None
+            if row is None:
+                self._count(step, "misses")
+                return None
+            self._conn.execute("UPDATE completions SET last_used = ? WHERE key = ?", (time.time_ns(), key))
+            self._conn.commit()
+            self._count(step, "hits")
+            return row[0]
+
+    def put(self, key: str, step: str, model: str, response: str) -> None:
+        """Store a completion; empty (or whitespace-only) responses are not cached."""
+        if not response.strip():
+            return
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO completions (key, step, model, response, created_at, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, step, model, response, time.time(), time.time_ns()),
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self) -> None:
+        cursor = self._conn.execute("DELETE FROM completions WHERE created_at < ?", (time.time() - self.ttl,))
+        self.expired += cursor.rowcount
+        count = self._conn.execute("SELECT COUNT(*) FROM completions").fetchone()[0]
+        excess = count - self.max_entries
+        if excess > 0:
+            self._conn.execute(
+                "DELETE FROM completions WHERE key IN "
+                "(SELECT key FROM completions ORDER BY last_used LIMIT ?)",
+                (excess,),
+            )
+            self.evictions += excess
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM completions")
+            self._conn.commit()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM completions").fetchone()[0]
+            steps = {step: dict(counts) for step, counts in self.steps.items()}
+        hits = sum(c["hits"] for c in steps.values())
+        lookups = hits + sum(c["misses"] for c in steps.values())
+        return {
+            "hits": hits,
+            "misses": lookups - hits,
+            "evictions": self.evictions,
+            "expired": self.expired,
+            "entries": entries,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "steps": steps,
+        }
+
+
+_cache: Optional[CompletionCache] = None
+_cache_guard = threading.Lock()
+
+
+def get_completion_cache() -> Optional[CompletionCache]:
+    """The process-wide cache, opened on first use; None when disabled via AGENTIC_COMPLETION_CACHE=0."""
+    global _cache
+    if not COMPLETION_CACHE_ENABLED:
+        return None
+    with _cache_guard:
+        if _cache is None:
+            _cache = CompletionCache()
+        return _cache
+
+
+def completion_cache_stats() -> Dict:
+    """Hit/miss counters (overall and per step) and size of the completion cache (empty if disabled)."""
+    cache = get_completion_cache()
+    return cache.stats() if cache else {}
+
+
+class CachedChat:
+    """Chat completions through the completion cache; ``cache=None`` always calls the model."""
+
+    def __init__(self, client, cache: Optional[CompletionCache] = None):
+        self.client = client
+        self.cache = cache
+
+    def _key(self, step: str, kwargs: Dict) -> Optional[str]:
+        if self.cache is None or step in UNCACHED_STEPS:
+            return None
+        return completion_key(kwargs["model"], kwargs["messages"], kwargs.get("temperature"),
+                              kwargs.get("max_tokens"))
+
+    def complete(self, step: str, **kwargs) -> str:
+        """Completion text for a ``chat.completions.create`` request."""
+        key = self._key(step, kwargs)
+        if key is not None:
+            cached = self.cache.get(key, step)
+            if cached is not None:
+                return cached
+        resp = self.client.chat.completions.create(**kwargs)
+        text = resp.choices[0].message.content or ""
+        if key is not None:
+            self.cache.put(key, step, kwargs["model"], text)
+        return text
+
+    def stream(self, step: str, **kwargs) -> Iterator[str]:
+        """Yield the completion text as it streams in; a cache hit is yielded in one piece."""
+        key = self._key(step, kwargs)
+        if key is not None:
+            cached = self.cache.get(key, step)
+            if cached is not None:
+                yield cached
+                return
+        parts = []
+        for chunk in self.client.chat.completions.create(stream=True, **kwargs):
+            text = chunk.choices[0].delta.content if chunk.choices else None
+            if text:
+                parts.append(text)
+                yield text
+        if key is not None:
+            self.cache.put(key, step, kwargs["model"], "".join(parts))
+
+
+def cached_chat(client, enabled: bool = True) -> CachedChat:
+    """Wrap ``client`` with the process-wide completion cache (bypassed when ``enabled`` is False)."""
+    return CachedChat(client, get_completion_cache() if enabled else None)
@@ -0,0 +1,191 @@
+"""Deterministic fast-path router for obvious agentic questions.
+
+Questions like "ALT for Daisy", "most recent CBC" or "what did the vet say"
+match the rules spelled out in the tool-selection prompt. The router checks
+the question against pet names (``pets``), analyte codes and names
+(``analytes``) and test panel names (``tests``) from the diagnostics database,
+plus intent keywords, and picks the tools without a model call. Only
+confident decisions are used; anything else goes to the LLM planner.
+
+Single intent words ("low", "results", "said", "plan") are weak signals: they
+choose the tools but cannot make a hit on their own, since "Daisy's low
+appetite" is not a lab question. A hit needs a strong signal: a multi-word
+intent phrase ("most recent", "what did the vet say"), an analyte or test
+panel from the database, or an explicit compare cue ("compare", "support").
+
+The vocabulary is read once per database file and reloaded when the file
+changes (inode, mtime, size). Hit counts and the latency saved are kept in
+process-wide counters, see ``router_stats``.
+"""
+
+import os
+import re
+import threading
+from typing import Dict
+
+from diagnostics.db import execute_query, get_db_path
+
+ROUTER_MIN_CONFIDENCE = float(os.environ.get("AGENTIC_ROUTER_MIN_CONFIDENCE", "0.7"))
+
+# Intent phrases, matched case-insensitively on word boundaries.
+DATA_PHRASES = (
+    "lab", "labs", "lab values", "lab results", "test results", "results", "values", "value",
+    "bloodwork", "blood work", "abnormal", "flagged", "high", "low", "levels", "panel",
+    "most recent", "latest", "last visit",
+)
+DOCS_PHRASES = (
+    "what did the vet say", "vet say", "vet said", "doctor say", "said", "symptoms", "symptom",
+    "advice", "advise", "recommend", "recommendation", "discharge", "instructions",
+    "transcript", "conversation", "told", "explain", "plan",
+)
+BOTH_PHRASES = (
+    "correlate", "compare", "support", "supports", "consistent", "assessment", "match",
+    "in line with", "agree",
+)
+
+_WORD_RE = re.compile(r"[A-Za-z0-9][A-Za-z0-9'-]*")
+
+
+def _phrase_re(phrases) -> re.Pattern:
+    alternatives = sorted((re.escape(p) for p in phrases), key=len, reverse=True)
+    return re.compile(r"\b(" + "|".join(alternatives) + r")\b", re.IGNORECASE)
+
+
+_DATA_RE = _phrase_re(DATA_PHRASES)
+_DOCS_RE = _phrase_re(DOCS_PHRASES)
+_BOTH_RE = _phrase_re(BOTH_PHRASES)
+
+_vocab: Dict[str, Dict] = {}
+_lock = threading.Lock()
+_stats = {"lookups": 0, "hits": 0, "saved_ms": 0.0, "llm_routing_ms": None}
+
+
+def _file_signature(path: str):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_ino, st.st_mtime_ns, st.st_size
+
+
+def load_vocabulary(db_path: str = None) -> Dict:
+    """Pet names, analyte codes/names and test names from the diagnostics DB (cached per file version)."""
+    db_path = db_path or get_db_path()
+    signature = _file_signature(db_path)
+    with _lock:
+        cached = _vocab.get(db_path)
+        if cached is not None and cached["signature"] == signature:
+            return cached
+    vocab = {"signature": signature, "pets": [], "analyte_codes": [], "analyte_names": {}, "tests": []}
+    if signature is not None:
+        try:
+            vocab["pets"] = [r["name"] for r in execute_query("SELECT DISTINCT name FROM pets", db_path=db_path)["rows"]]
+            for r in execute_query("SELECT analyte_code, analyte_name FROM analytes", db_path=db_path)["rows"]:
+                vocab["analyte_codes"].append(r["analyte_code"])
+                vocab["analyte_names"][r["analyte_name"].casefold()] = r["analyte_code"]
+            vocab["tests"] = [r["test_name"] for r in execute_query("SELECT DISTINCT test_name FROM tests", db_path=db_path)["rows"]]
+        except Exception:
+            # Missing tables or an unreadable file: route on keywords only.
+            pass
+    with _lock:
+        _vocab[db_path] = vocab
+    return vocab
+
+
+def route(question: str, db_path: str = None, min_confidence: float = ROUTER_MIN_CONFIDENCE) -> Dict:
+    """
+    Pick tools for ``question`` without a model call.
+
+    Returns:
+        {
+            "tools": "SQL_ONLY" | "DOCS_ONLY" | "BOTH" | None,
+            "confidence": 0.0-1.0,
+            "hit": True when a strong signal matched and confidence >= min_confidence,
+            "pets": [...], "analytes": [...], "tests": [...], "signals": [...]
+        }
+    """
+    vocab = load_vocabulary(db_path)
+    words = set(_WORD_RE.findall(question))
+    folded = {re.sub(r"'s$", "", w.casefold()) for w in words}
+    lowered = question.casefold()
+
+    pets = [p for p in vocab["pets"] if p.casefold() in folded]
+    # Codes are matched case-sensitively ("ALT", "K") so ordinary words do not count.
+    analytes = [c for c in vocab["analyte_codes"] if c in words]
+    analytes += [code for name, code in vocab["analyte_names"].items()
+                 if re.search(r"\b" + re.escape(name) + r"\b", lowered) and code not in analytes]
+    tests = [t for t in vocab["tests"] if re.search(r"\b" + re.escape(t.casefold()) + r"\b", lowered)]
+
+    data = sorted({m.casefold() for m in _DATA_RE.findall(question)})
+    docs = sorted({m.casefold() for m in _DOCS_RE.findall(question)})
+    both = sorted({m.casefold() for m in _BOTH_RE.findall(question)})
+    wants_data = bool(data or analytes or tests)
+    phrases = [p for p in data + docs if " " in p]
+    strong = bool(phrases or analytes or tests or both)
+
+    if both or (wants_data and docs):
+        tools = "BOTH"
+    elif wants_data:
+        tools = "SQL_ONLY"
+    elif docs:
+        tools = "DOCS_ONLY"
+    else:
+        tools = None
+
+    confidence = 0.0
+    if tools is not None:
+        # Only single generic words: at most 0.6 even with a pet name
+        confidence = 0.5 if strong else 0.3
+        if pets:
+            confidence += 0.3
+        if analytes or tests:
+            confidence += 0.2
+        if phrases or any(" " in p for p in both):
+            # Multi-word intent phrases ("what did the vet say", "most recent")
+            confidence += 0.2
+        if tools == "BOTH" and not both:
+            # Mixed signals without an explicit "compare/support" cue.
+            confidence -= 0.1
+    confidence = round(min(confidence, 1.0), 2)
+
+    return {
+        "tools": tools,
+        "confidence": confidence,
+        "hit": tools is not None and strong and confidence >= min_confidence,
+        "pets": pets,
+        "analytes": analytes,
+        "tests": tests,
+        "signals": data + docs + both,
+    }
+
+
+def record_llm_routing(elapsed_ms: float) -> None:
+    """Feed the latency of an LLM routing step into the saved-latency estimate."""
+    with _lock:
+        previous = _stats["llm_routing_ms"]
+        _stats["llm_routing_ms"] = elapsed_ms if previous is None else 0.8 * previous + 0.2 * elapsed_ms
+
+
+def record_lookup(hit: bool) -> float:
+    """Count a routing decision; returns the estimated milliseconds saved by a hit."""
+    with _lock:
+        _stats["lookups"] += 1
+        saved = 0.0
+        if hit:
+            _stats["hits"] += 1
+            saved = _stats["llm_routing_ms"] or 0.0
+            _stats["saved_ms"] += saved
+        return saved
+
+
+def router_stats() -> Dict:
+    """Hit rate and total estimated latency saved by the router in this process."""
+    with _lock:
+        lookups = _stats["lookups"]
+        return {
+            "lookups": lookups,
+            "hits": _stats["hits"],
+            "hit_rate": _stats["hits"] / lookups if lookups else 0.0,
+            "saved_ms": _stats["saved_ms"],
+            "llm_routing_ms": _stats["llm_routing_ms"],
+        }
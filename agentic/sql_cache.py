@@ -0,0 +1,132 @@
+"""In-memory cache of diagnostics query results.
+
+The agentic flow re-issues the same SELECTs: the refinement retry, repeated
+"most recent CBC for Daisy" questions, the planner and the SQL prompt writing
+the same query with different spacing. Results are keyed by the database
+path, the normalized SQL (whitespace collapsed, keywords and identifiers
+lowercased outside string literals, trailing semicolon dropped) and
+``max_rows``, and stored with the database's ``data_version`` token. When the
+token changes (another connection committed, ``seed_database`` or
+``clear_database`` ran, the file was replaced) the cache is emptied before
+the lookup. Entries are evicted least recently used once the estimated size
+passes ``max_bytes`` or the count passes ``max_entries``.
+"""
+
+import os
+import re
+import sys
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+SQL_CACHE_ENABLED = os.environ.get("AGENTIC_SQL_CACHE", "1") != "0"
+SQL_CACHE_MAX_ENTRIES = int(os.environ.get("AGENTIC_SQL_CACHE_MAX_ENTRIES", "256"))
+SQL_CACHE_MAX_BYTES = int(os.environ.get("AGENTIC_SQL_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+
+# String literals and quoted identifiers are kept verbatim.
+_QUOTED_RE = re.compile(r"('(?:[^']|'')*'|\"(?:[^\"]|\"\")*\")")
+
+
+def normalize_sql(sql: str) -> str:
+    """Canonical form of a query for cache keys; equivalent spellings map to the same string."""
+    parts = _QUOTED_RE.split(sql.strip().rstrip(";").strip())
+    out = []
+    for i, part in enumerate(parts):
+        if i % 2:
+            out.append(part)
+        else:
+            part = " ".join(part.split()).lower()
+            # No spaces around punctuation: "a , b" and "a,b" are the same query
+            out.append(re.sub(r"\s*([(),=<>])\s*", r"\1", part))
+    return "".join(out)
+
+
+def _result_size(result: Dict) -> int:
+    """Rough bytes held by a result (row dicts plus their values)."""
+    rows = result["rows"]
+    size = sys.getsizeof(rows)
+    for row in rows:
+        size += sys.getsizeof(row)
+        for value in row.values():
+            size += sys.getsizeof(value)
+    return size
+
+
+class ResultCache:
+    """LRU of query results, bounded by entry count and estimated bytes, invalidated by data version."""
+
+    def __init__(self, max_entries: int = SQL_CACHE_MAX_ENTRIES, max_bytes: int = SQL_CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self._versions: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _check_version(self, db_path: str, version: tuple) -> None:
+        if self._versions.get(db_path) != version:
+            stale = [key for key in self._entries if key[0] == db_path]
+            for key in stale:
+                self.bytes -= self._entries.pop(key)[1]
+            if db_path in self._versions and stale:
+                self.invalidations += 1
+            self._versions[db_path] = version
+
+    def get(self, db_path: str, sql: str, max_rows: int, version: tuple) -> Optional[Dict]:
+        """A copy of the cached result, or None."""
+        key = (db_path, normalize_sql(sql), max_rows)
+        with self._lock:
+            self._check_version(db_path, version)
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            result = entry[0]
+        return {**result, "rows": list(result["rows"]), "columns": list(result["columns"])}
+
+    def put(self, db_path: str, sql: str, max_rows: int, version: tuple, result: Dict) -> None:
+        key = (db_path, normalize_sql(sql), max_rows)
+        stored = {**result, "rows": list(result["rows"]), "columns": list(result["columns"])}
+        size = _result_size(stored)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if self._versions.get(db_path) != version:
+                # The data changed while the query ran
+                return
+            if key in self._entries:
+                self.bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (stored, size)
+            self.bytes += size
+            while self._entries and (len(self._entries) > self.max_entries or self.bytes > self.max_bytes):
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.bytes -= evicted
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._versions.clear()
+            self.bytes = 0
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+result_cache = ResultCache()
@@ -0,0 +1,255 @@
+"""Cost guard and execution deadline for model-generated SQL.
+
+``is_safe_sql`` only looks at keywords, so a valid SELECT can still join
+tables without a join condition or scan a large table end to end. Before a
+query runs, ``check_plan`` reads ``EXPLAIN QUERY PLAN`` and estimates what
+each loop costs: a ``SEARCH`` (index lookup) counts as one row, a ``SCAN``
+counts as the table's row estimate, and nested scans in the same SELECT
+multiply (a cartesian or unindexed join). Plans over ``SQL_MAX_SCAN_ROWS`` are
+rejected with a reason. Accepted queries run with a wall-clock deadline
+enforced through SQLite's progress handler, and at most ``max_rows`` rows are
+materialized.
+
+Plan lines name tables by alias. Aliases are resolved from every FROM list
+of the query (comma joins included) and of the views it reads; subqueries
+and CTEs count as one row since their own loops are costed separately, and a
+scanned name that cannot be resolved is assumed to be the largest table.
+Row estimates are exact ``COUNT(*)`` results cached per database version
+(``data_version``), so tables kept up by triggers that delete and re-insert
+rows (``mv_results``) are not overestimated the way ``MAX(rowid)`` would.
+"""
+
+import os
+import re
+import threading
+import time
+from typing import Dict, List, Optional
+
+from diagnostics.db import data_version, fetch_rows, get_db_path, get_pool
+
+SQL_DEADLINE_MS = float(os.environ.get("AGENTIC_SQL_DEADLINE_MS", "2000"))
+SQL_MAX_SCAN_ROWS = int(os.environ.get("AGENTIC_SQL_MAX_SCAN_ROWS", "100000"))
+# SQLite VM instructions between deadline checks.
+_PROGRESS_STEPS = 1000
+
+_QUOTED_RE = re.compile(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"")
+_PAREN_RE = re.compile(r"\([^()]*\)")
+_FROM_CLAUSE_RE = re.compile(
+    r"\bFROM\b(.*?)(?=\b(?:WHERE|GROUP|ORDER|LIMIT|HAVING|UNION|EXCEPT|INTERSECT|WINDOW|SELECT)\b|;|$)",
+    re.IGNORECASE | re.DOTALL,
+)
+_SOURCE_SPLIT_RE = re.compile(r",|\b(?:NATURAL\s+)?(?:(?:LEFT|RIGHT|FULL)\s+)?(?:(?:OUTER|INNER|CROSS)\s+)?JOIN\b",
+                              re.IGNORECASE)
+_CONDITION_RE = re.compile(r"\b(?:ON|USING)\b", re.IGNORECASE)
+_SOURCE_RE = re.compile(r"^\s*([A-Za-z_]\w*)(?:\s+(?:AS\s+)?([A-Za-z_]\w*))?", re.IGNORECASE)
+_SUBQUERY_RE = re.compile(r"^\s*_subquery_(?:\s+(?:AS\s+)?([A-Za-z_]\w*))?", re.IGNORECASE)
+_CTE_RE = re.compile(r"\b([A-Za-z_]\w*)\s+AS\s+(?:NOT\s+)?(?:MATERIALIZED\s+)?_subquery_", re.IGNORECASE)
+_NOT_ALIASES = {
+    "where", "join", "on", "using", "left", "right", "inner", "outer", "cross", "natural", "full",
+    "group", "order", "limit", "having", "union", "except", "intersect", "window", "as", "indexed", "not",
+}
+# Alias of a subquery, CTE or view-free derived table: its own loops are costed separately
+_SUBQUERY = ""
+
+# A lone scan stops after LIMIT rows unless something makes it read the whole table
+_FULL_READ_RE = re.compile(r"\b(?:WHERE|GROUP\s+BY|ORDER\s+BY|HAVING|DISTINCT|UNION|COUNT|SUM|AVG|MIN|MAX|TOTAL)\b",
+                           re.IGNORECASE)
+_LIMIT_RE = re.compile(r"\bLIMIT\s+(\d+)\s*;?\s*$", re.IGNORECASE)
+
+_row_estimates: Dict[str, tuple] = {}
+_estimates_lock = threading.Lock()
+
+
+class QueryRejected(Exception):
+    """A query refused by the governor; ``reason`` says why."""
+
+    def __init__(self, reason: str, plan: Optional[List[str]] = None):
+        super().__init__(reason)
+        self.reason = reason
+        self.plan = plan or []
+
+
+def _table_rows(conn, db_path: str) -> Dict[str, int]:
+    """Row estimate per table (and view alias source), cached until the database changes."""
+    version = data_version(db_path)
+    with _estimates_lock:
+        cached = _row_estimates.get(db_path)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+    rows = {}
+    tables = [r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall()]
+    for table in tables:
+        try:
+            rows[table.lower()] = conn.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0]
+        except Exception:
+            # Virtual tables whose module is not loaded cannot be read
+            rows[table.lower()] = 0
+    with _estimates_lock:
+        _row_estimates[db_path] = (version, rows)
+    return rows
+
+
+def _flatten(sql: str) -> List[str]:
+    """Split a query into its SELECT bodies, each with parenthesized parts removed.
+
+    String literals are blanked, subqueries become ``_subquery_`` in the text
+    around them, and other parenthesized expressions (function calls, ON
+    conditions) are dropped, so FROM lists can be read with plain regexes.
+    """
+    text = _QUOTED_RE.sub("''", sql)
+    bodies = []
+    while True:
+        match = _PAREN_RE.search(text)
+        if match is None:
+            break
+        inner = match.group(0)[1:-1]
+        if re.search(r"\bSELECT\b", inner, re.IGNORECASE):
+            bodies.append(inner)
+            replacement = " _subquery_ "
+        else:
+            replacement = " "
+        text = text[:match.start()] + replacement + text[match.end():]
+    bodies.append(text)
+    return bodies
+
+
+def _sources(sql: str) -> Dict[str, str]:
+    """Alias -> table (or _SUBQUERY) for every FROM list in ``sql``, comma joins included."""
+    aliases = {}
+    for body in _flatten(sql):
+        for cte in _CTE_RE.findall(body):
+            aliases[cte.lower()] = _SUBQUERY
+        for clause in _FROM_CLAUSE_RE.findall(body):
+            for item in _SOURCE_SPLIT_RE.split(clause):
+                item = _CONDITION_RE.split(item, 1)[0]
+                subquery = _SUBQUERY_RE.match(item)
+                if subquery:
+                    if subquery.group(1) and subquery.group(1).lower() not in _NOT_ALIASES:
+                        aliases[subquery.group(1).lower()] = _SUBQUERY
+                    continue
+                match = _SOURCE_RE.match(item)
+                if not match:
+                    continue
+                table, alias = match.group(1).lower(), (match.group(2) or "").lower()
+                aliases.setdefault(table, table)
+                if alias and alias not in _NOT_ALIASES:
+                    aliases[alias] = table
+    return aliases
+
+
+def _aliases(conn, sql: str) -> Dict[str, str]:
+    """Alias -> table for the query and for the views it reads (the plan shows their aliases)."""
+    views = {name.lower(): text for name, text in
+             conn.execute("SELECT name, sql FROM sqlite_master WHERE type = 'view'").fetchall() if text}
+    aliases = _sources(sql)
+    pending = [t for t in set(aliases.values()) if t in views]
+    expanded = set()
+    while pending:
+        view = pending.pop()
+        if view in expanded:
+            continue
+        expanded.add(view)
+        for alias, table in _sources(views[view]).items():
+            aliases.setdefault(alias, table)
+            if table in views:
+                pending.append(table)
+    return aliases
+
+
+def check_plan(conn, sql: str, db_path: str, max_scan_rows: int = SQL_MAX_SCAN_ROWS) -> Dict:
+    """
+    Inspect the query plan; raise QueryRejected for full scans of large
+    tables and cartesian/unindexed joins.
+
+    Returns:
+        {"plan": [...plan lines], "estimated_rows": worst loop cost}
+    """
+    plan = conn.execute(f"EXPLAIN QUERY PLAN {sql}").fetchall()
+    details = [row[3] for row in plan]
+    table_rows = _table_rows(conn, db_path)
+    aliases = _aliases(conn, sql)
+
+    # Materialized subqueries and CTEs are named in the plan itself
+    for detail in details:
+        words = detail.split()
+        if len(words) == 2 and words[0] in ("MATERIALIZE", "CO-ROUTINE"):
+            aliases[words[1].lower()] = _SUBQUERY
+    largest = max(table_rows.values(), default=1)
+
+    # Loops of the same SELECT share a parent id; SQLite nests them in order
+    loops: Dict[int, List[tuple]] = {}
+    for _, parent, _, detail in plan:
+        words = detail.split()
+        if len(words) < 2 or words[0] not in ("SCAN", "SEARCH"):
+            continue
+        name = words[1].lower()
+        table = aliases.get(name, name)
+        if words[0] == "SEARCH" or table == _SUBQUERY or not re.match(r"[a-z_]\w*$", name) or name == "constant":
+            # Index lookups, and scans of subquery results or constant rows
+            rows = 1
+        else:
+            # A name we cannot resolve is assumed to be the largest table
+            rows = table_rows.get(table, largest)
+        loops.setdefault(parent, []).append((words[0], words[1], table or name, rows))
+
+    limit = _LIMIT_RE.search(sql)
+    streams = len(plan) == 1 and limit is not None and not _FULL_READ_RE.search(sql)
+
+    worst = 0
+    for nodes in loops.values():
+        scans = [n for n in nodes if n[0] == "SCAN"]
+        cost = 1
+        for _, _, _, rows in nodes:
+            cost *= max(rows, 1)
+        if streams:
+            # e.g. "SELECT * FROM v_results LIMIT 50" reads only the first rows
+            cost = min(cost, int(limit.group(1)))
+        worst = max(worst, cost)
+        if cost <= max_scan_rows or not scans:
+            continue
+        if len(scans) > 1:
+            joined = " × ".join(f"{table} (~{rows:,} rows)" for _, _, table, rows in scans)
+            raise QueryRejected(f"cartesian or unindexed join: {joined}; join on indexed keys or filter first", details)
+        _, _, table, rows = scans[0]
+        raise QueryRejected(f"full scan of {table} (~{rows:,} rows); filter on an indexed column "
+                            f"(e.g. pet_name, visit_id, analyte_code)", details)
+    return {"plan": details, "estimated_rows": worst}
+
+
+def run_governed(sql: str, max_rows: int, db_path: str = None, deadline_ms: float = SQL_DEADLINE_MS,
+                 max_scan_rows: int = SQL_MAX_SCAN_ROWS) -> Dict:
+    """
+    Plan-check and run a SELECT with a deadline, materializing at most max_rows rows.
+
+    Returns the execute_query result shape plus "truncated", "elapsed_ms" and
+    "plan"; raises QueryRejected when the plan or the deadline is exceeded.
+    """
+    if db_path is None:
+        db_path = get_db_path()
+    with get_pool(db_path).connection() as conn:
+        checked = check_plan(conn, sql, db_path, max_scan_rows=max_scan_rows)
+        start = time.perf_counter()
+        deadline = start + deadline_ms / 1000
+        conn.set_progress_handler(lambda: time.perf_counter() > deadline, _PROGRESS_STEPS)
+        cursor = conn.cursor()
+        try:
+            cursor.execute(sql)
+            columns = [description[0] for description in cursor.description] if cursor.description else []
+            rows = [row for batch in fetch_rows(cursor, max_rows + 1) for row in batch]
+        except Exception as e:
+            if time.perf_counter() > deadline and "interrupt" in str(e).lower():
+                raise QueryRejected(f"exceeded the {deadline_ms:.0f} ms deadline", checked["plan"])
+            raise
+        finally:
+            cursor.close()
+            conn.set_progress_handler(None, 0)
+    truncated = len(rows) > max_rows
+    rows = rows[:max_rows]
+    return {
+        "columns": columns,
+        "rows": [dict(row) for row in rows],
+        "row_count": len(rows),
+        "truncated": truncated,
+        "elapsed_ms": (time.perf_counter() - start) * 1000,
+        "plan": checked["plan"],
+    }
@@ -1,24 +1,83 @@
 """Agentic tools for search and SQL query."""
 
+import re
 from typing import Dict, List
-from rag_utils import search as rag_search
-from diagnostics.db import execute_query, get_db_path
+from rag_utils import (
+    search as rag_search,
+    search_many as rag_search_many,
+    metadata_values,
+    DEFAULT_STORE_PATH,
+    SEARCH_MODE,
+)
+from diagnostics.db import data_version, get_db_path
 from agentic.sql_safety import is_safe_sql, enforce_limit
+from agentic.sql_cache import SQL_CACHE_ENABLED, result_cache
+from agentic.sql_governor import QueryRejected, run_governed
 
 
-def search_transcripts(query: str, top_k: int = 4, store_path: str = None) -> Dict:
+def transcript_filters(question: str, entities: Dict = None, store_path: str = None) -> Dict:
+    """
+    Metadata filters for search_transcripts inferred from the question.
+    
+    Pet names and visit ids indexed in the store that appear in the question,
+    plus entities already extracted from it (e.g. the router's pets, as
+    {"pet_name": [...]}), become filters. They depend on the question only, so
+    the search returns the same chunks whether it runs before, after or
+    alongside the SQL query. Values the store has never seen are ignored, so a
+    filter never excludes every transcript just because the name is unknown
+    to it.
+    
+    Returns:
+        {"pet_name": [...], "visit_id": [...]} (only non-empty fields)
+    """
+    store_path = store_path or DEFAULT_STORE_PATH
+    words = {w.casefold() for w in re.findall(r"[A-Za-z][\w-]*", question)}
+    filters = {}
+    for field in ("pet_name", "visit_id"):
+        known = {v.casefold(): v for v in metadata_values(field, store_path=store_path)}
+        wanted = [v for key, v in known.items() if key in words]
+        for value in (entities or {}).get(field, []):
+            if value and str(value).casefold() in known:
+                wanted.append(known[str(value).casefold()])
+        if wanted:
+            filters[field] = sorted(set(wanted))
+    return filters
+
+
+def search_transcripts(query: str, top_k: int = 4, store_path: str = None,
+                       sub_queries: List[str] = None, filters: Dict = None,
+                       mode: str = SEARCH_MODE) -> Dict:
     """
     Search transcript documents using RAG.
     
+    When sub_queries are given, the query and all sub-queries are embedded and
+    scored together in one batched search; hits are merged, keeping each
+    chunk's best score, and the top_k overall are returned.
+    
+    filters (e.g. {"pet_name": ["Daisy"]}, see transcript_filters) restrict
+    the search to matching transcripts before any scoring. mode is the
+    rag_utils search mode ("vector", "hybrid", "lexical" or "prefilter").
+    
     Returns:
         {
             "chunks": [
-                {"chunk_id": idx, "text": "...", "score": 0.95, "source_doc": "..."}
+                {"chunk_id": idx, "text": "...", "score": 0.95, "source_doc": "...", "metadata": {...}}
             ],
-            "count": 3
+            "count": 3,
+            "filters": {...}
         }
     """
-    hits = rag_search(query, k=top_k, store_path=store_path)
+    if sub_queries:
+        best = {}
+        for query_hits in rag_search_many([query] + list(sub_queries), k=top_k, store_path=store_path,
+                                          filters=filters, mode=mode):
+            for hit in query_hits:
+                key = (hit["source"], hit["text"])
+                if key not in best or hit["score"] > best[key]["score"]:
+                    best[key] = hit
+        hits = sorted(best.values(), key=lambda h: h["score"], reverse=True)[:top_k]
+    else:
+        hits = rag_search(query, k=top_k, store_path=store_path, filters=filters, mode=mode)
     
     chunks = []
     for idx, hit in enumerate(hits, start=1):
@@ -26,25 +85,35 @@ def search_transcripts(query: str, top_k: int = 4, store_path: str = None) -> Di
             "chunk_id": idx,
             "text": hit["text"],
             "score": hit["score"],
-            "source_doc": hit["source"]
+            "source_doc": hit["source"],
+            "metadata": hit["metadata"]
         })
     
     return {
         "chunks": chunks,
-        "count": len(chunks)
+        "count": len(chunks),
+        "filters": filters or {}
     }
 
 
-def query_diagnostics(sql: str, max_rows: int = 50) -> Dict:
+def query_diagnostics(sql: str, max_rows: int = 50, use_cache: bool = SQL_CACHE_ENABLED) -> Dict:
     """
     Execute a read-only SQL query against the diagnostics database.
     
+    The query plan is checked and execution is bounded by a deadline and
+    max_rows (see agentic.sql_governor). Results are cached by normalized SQL
+    and max_rows until the database changes (see agentic.sql_cache);
+    use_cache=False always runs the query.
+    
     Returns:
         {
             "columns": [...],
             "rows": [...],
             "row_count": 3,
-            "error": None or error message
+            "error": None or error message,
+            "rejected": reason, when the governor refused or stopped the query,
+            "truncated": True when more than max_rows rows matched,
+            "cached": True when served from the result cache
         }
     """
     # Safety check
@@ -60,10 +129,30 @@ def query_diagnostics(sql: str, max_rows: int = 50) -> Dict:
     # Enforce LIMIT
     sql_safe = enforce_limit(sql, max_rows=max_rows)
     
+    db_path = get_db_path()
+    version = data_version(db_path) if use_cache else None
+    if use_cache:
+        cached = result_cache.get(db_path, sql_safe, max_rows, version)
+        if cached is not None:
+            cached["cached"] = True
+            return cached
+    
     try:
-        result = execute_query(sql_safe)
+        result = run_governed(sql_safe, max_rows=max_rows, db_path=db_path)
         result["error"] = None
+        if use_cache:
+            result_cache.put(db_path, sql_safe, max_rows, version, result)
+        result["cached"] = False
         return result
+    except QueryRejected as e:
+        return {
+            "columns": [],
+            "rows": [],
+            "row_count": 0,
+            "error": f"Query rejected: {e.reason}",
+            "rejected": e.reason,
+            "plan": e.plan
+        }
     except Exception as e:
         return {
             "columns": [],
@@ -71,3 +160,8 @@ def query_diagnostics(sql: str, max_rows: int = 50) -> Dict:
             "row_count": 0,
             "error": str(e)
         }
+
+
+def sql_cache_stats() -> Dict:
+    """Hit/miss, eviction and invalidation counters of the query_diagnostics result cache."""
+    return result_cache.stats()
@@ -1,13 +1,16 @@
 
 import os
+import time
+import codecs
 import streamlit as st
-from openai import OpenAI
-from rag_utils import add_document_to_store, search, load_store, clear_store
+from rag_utils import get_client, reindex_document, search, store_count, clear_store, store_cache_stats, embedding_cache_stats, DEFAULT_STORE_PATH, SEARCH_MODES, SEARCH_MODE
 from agentic.agentic import run_agentic_chat
-from diagnostics.db import init_db, get_db_path
+from agentic.completion_cache import cached_chat, completion_cache_stats
+from agentic.tools import sql_cache_stats
+from diagnostics.db import init_db, get_db_path, pool_stats
 from diagnostics.queries import get_visit_summary, get_visit_tests, get_abnormal_results, get_test_results
 from diagnostics.seed import seed_database, clear_database
-import pandas as pd
+from diagnostics.tabular import to_dataframe
 
 st.set_page_config(page_title="Pet Care Coach - RAG Demo", page_icon="🐾", layout="wide")
 st.title("🐾 Pet Care Coach — RAG Demo")
@@ -15,11 +18,25 @@ st.caption("Compare Model-only, Classic RAG, and Agentic Context modes.")
 
 if "OPENAI_API_KEY" not in os.environ:
     st.warning("Set the OPENAI_API_KEY environment variable before running. e.g., export OPENAI_API_KEY=sk-...")
-client = OpenAI()
+client = get_client()
 
 # Initialize diagnostics database
 init_db()
 
+
+def stream_completion(messages, timing, start):
+    """Yield answer text as the model streams it, recording time to first token and total time (since ``start``) in ``timing``."""
+    for text in llm.stream("answer", model=model, messages=messages, temperature=0.2):
+        if "first_token_ms" not in timing:
+            timing["first_token_ms"] = (time.perf_counter() - start) * 1000
+        yield text
+    timing["total_ms"] = (time.perf_counter() - start) * 1000
+    timing.setdefault("first_token_ms", timing["total_ms"])
+
+
+def timing_caption(timing):
+    return f"First token {timing['first_token_ms'] / 1000:.2f}s · total {timing['total_ms'] / 1000:.2f}s"
+
 with st.sidebar:
     st.header("Mode Selection")
     mode = st.radio(
@@ -31,13 +48,35 @@ with st.sidebar:
     st.divider()
     st.header("Settings")
     top_k = st.slider("Top-k chunks", 1, 8, 4)
+    search_mode = st.selectbox(
+        "Retrieval",
+        SEARCH_MODES,
+        index=SEARCH_MODES.index(SEARCH_MODE),
+        help="vector: embeddings only; hybrid: BM25 + vector (rank fusion); lexical: BM25 only; prefilter: vectors scored for top BM25 matches"
+    )
     model = st.text_input("Chat model", value=os.environ.get("CHAT_MODEL", "gpt-4o"))
+    use_completion_cache = st.checkbox(
+        "Cache completions",
+        value=True,
+        help="Reuse stored completions for identical requests (same model, messages, temperature and max tokens)"
+    )
+    completion_stats = completion_cache_stats()
+    if completion_stats:
+        st.caption(
+            f"Completion cache: {completion_stats['hits']} hits / {completion_stats['misses']} misses "
+            f"({completion_stats['entries']} stored)"
+        )
+    llm = cached_chat(client, enabled=use_completion_cache)
     
     st.divider()
     st.subheader("Document store")
-    store_path = os.environ.get("RAG_STORE_PATH", "rag_store.json")
-    store = load_store(store_path)
-    st.write(f"Chunks indexed: **{len(store['chunks'])}**")
+    store_path = DEFAULT_STORE_PATH
+    st.write(f"Chunks indexed: **{store_count(store_path)}**")
+    cache_stats = store_cache_stats()
+    st.caption(f"Store cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses")
+    embed_stats = embedding_cache_stats()
+    if embed_stats:
+        st.caption(f"Embedding cache: {embed_stats['hit_rate']:.0%} hit rate, {embed_stats['entries']} entries")
     if st.button("Clear document store"):
         clear_store(store_path)
         if "processed_files" in st.session_state:
@@ -62,19 +101,34 @@ with st.sidebar:
         
         # Only process if we haven't processed these files before
         if file_ids not in st.session_state.processed_files:
-            total = 0
+            total = {"chunks": 0, "added": 0, "unchanged": 0, "removed": 0, "rewritten": 0}
             for f in files:
-                content = f.read().decode("utf-8", errors="ignore")
-                total += add_document_to_store(f.name, content, store_path=store_path)
+                # Decode and chunk the upload incrementally instead of reading it whole
+                pieces = codecs.iterdecode(iter(lambda: f.read(64 * 1024), b""), "utf-8", errors="ignore")
+                # Re-uploading an edited file only embeds the chunks that changed
+                result = reindex_document(f.name, pieces, store_path=store_path)
+                for key in total:
+                    total[key] += result[key]
             
             # Mark these files as processed
             st.session_state.processed_files.add(file_ids)
             # Store success message in session state to show after rerun
-            st.session_state.upload_success = f"Indexed {total} chunks from {len(files)} file(s)."
+            st.session_state.upload_success = (
+                f"Indexed {total['chunks']} chunks from {len(files)} file(s): "
+                f"{total['added']} new, {total['unchanged']} unchanged, {total['removed']} removed."
+            )
+            if total["rewritten"]:
+                st.session_state.upload_success += f" {total['rewritten']} re-tagged with updated metadata."
             st.rerun()
     
     st.divider()
     st.subheader("Diagnostics Database")
+    db_pool = pool_stats()
+    if db_pool:
+        st.caption(f"Connection pool: {db_pool['created']} opened / {db_pool['reused']} reused ({db_pool['idle']} idle)")
+    query_cache = sql_cache_stats()
+    if query_cache["hits"] or query_cache["misses"]:
+        st.caption(f"Query cache: {query_cache['hits']} hits / {query_cache['misses']} misses")
     if st.button("Load Seed Data", help="Load demo data for Daisy the dog"):
         try:
             seed_database()
@@ -111,25 +165,25 @@ if show_diagnostics:
             
             # Tests
             st.subheader("Tests Performed")
-            tests = get_visit_tests(selected_visit)
+            tests = get_visit_tests(selected_visit, columnar=True)
             if tests["rows"]:
-                st.dataframe(pd.DataFrame(tests["rows"]), use_container_width=True)
+                st.dataframe(to_dataframe(tests["columns"], tests["rows"]), use_container_width=True)
             else:
                 st.info("No tests found for this visit.")
             
             # Abnormal results
             st.subheader("Abnormal Results")
-            abnormal = get_abnormal_results(selected_visit)
+            abnormal = get_abnormal_results(selected_visit, columnar=True)
             if abnormal["rows"]:
-                st.dataframe(pd.DataFrame(abnormal["rows"]), use_container_width=True)
+                st.dataframe(to_dataframe(abnormal["columns"], abnormal["rows"]), use_container_width=True)
             else:
                 st.info("No abnormal results found.")
             
             # All results
             st.subheader("All Results")
-            all_results = get_test_results(selected_visit)
+            all_results = get_test_results(selected_visit, columnar=True)
             if all_results["rows"]:
-                st.dataframe(pd.DataFrame(all_results["rows"]), use_container_width=True)
+                st.dataframe(to_dataframe(all_results["columns"], all_results["rows"]), use_container_width=True)
             else:
                 st.info("No results found.")
     else:
@@ -140,10 +194,14 @@ if "messages" not in st.session_state:
     st.session_state.messages = []
 if "agentic_responses" not in st.session_state:
     st.session_state.agentic_responses = {}
+if "turn_timings" not in st.session_state:
+    st.session_state.turn_timings = {}
 
 for idx, msg in enumerate(st.session_state.messages):
     with st.chat_message(msg["role"]):
         st.markdown(msg["content"])
+        if idx in st.session_state.turn_timings:
+            st.caption(timing_caption(st.session_state.turn_timings[idx]))
         
         # Show "How I answered" for assistant messages in agentic mode
         if msg["role"] == "assistant" and idx in st.session_state.agentic_responses:
@@ -167,7 +225,7 @@ for idx, msg in enumerate(st.session_state.messages):
                             sql_result = resp_data["evidence"]["sql_results"][sql_idx - 1]
                             st.write(f"Returned {sql_result['row_count']} rows")
                             if sql_result["preview"]:
-                                st.dataframe(pd.DataFrame(sql_result["preview"]), use_container_width=True)
+                                st.dataframe(to_dataframe(sql_result["columns"], sql_result["preview"]), use_container_width=True)
                 
                 st.write("**Trace:**")
                 st.json(resp_data["trace"])
@@ -179,61 +237,65 @@ if prompt:
         st.markdown(prompt)
 
     with st.chat_message("assistant"):
-        with st.spinner("Thinking..."):
-            if mode == "Model-only (No RAG)":
-                # Model-only mode
-                system_prompt = "You are a concise, helpful assistant. Answer based on your general knowledge."
-                messages = [{"role": "system", "content": system_prompt}]
-                history_tail = st.session_state.messages[-4:]
-                for m in history_tail:
-                    messages.append({"role": m["role"], "content": m["content"]})
-                messages.append({"role": "user", "content": prompt})
-                
-                resp = client.chat.completions.create(model=model, messages=messages, temperature=0.2)
-                answer = resp.choices[0].message.content
-                st.markdown(answer)
-                
-            elif mode == "Classic RAG (Transcript)":
-                # Classic RAG mode
-                context_blocks, citations = [], []
-                hits = search(prompt, k=top_k, store_path=store_path)
-                if hits:
-                    for idx, h in enumerate(hits, start=1):
-                        context_blocks.append(f"[{idx}] source: {h['source']}\n{h['text']}")
-                        citations.append(f"[{idx}] {h['source']} (score {h['score']:.3f})")
-                else:
-                    citations.append("_No documents in store or no matches._")
+        # Answers stream in as they are generated; the spinner only covers
+        # retrieval and tool calls that happen before the first token
+        timing = {}
+        turn_start = time.perf_counter()
+        if mode == "Model-only (No RAG)":
+            # Model-only mode
+            system_prompt = "You are a concise, helpful assistant. Answer based on your general knowledge."
+            messages = [{"role": "system", "content": system_prompt}]
+            history_tail = st.session_state.messages[-4:]
+            for m in history_tail:
+                messages.append({"role": m["role"], "content": m["content"]})
+            messages.append({"role": "user", "content": prompt})
+            
+            answer = st.write_stream(stream_completion(messages, timing, turn_start))
+            
+        elif mode == "Classic RAG (Transcript)":
+            # Classic RAG mode
+            context_blocks, citations = [], []
+            with st.spinner("Searching transcripts..."):
+                hits = search(prompt, k=top_k, store_path=store_path, mode=search_mode)
+            if hits:
+                for idx, h in enumerate(hits, start=1):
+                    context_blocks.append(f"[{idx}] source: {h['source']}\n{h['text']}")
+                    citations.append(f"[{idx}] {h['source']} (score {h['score']:.3f})")
+            else:
+                citations.append("_No documents in store or no matches._")
 
-                system_prompt = (
-                    "You are a concise, helpful assistant.\n"
-                    "If RAG context is provided, ground your answer primarily in that context and reference sources like [1], [2].\n"
-                    "If the context is irrelevant or insufficient, say so explicitly before answering from general knowledge.\n"
-                )
+            system_prompt = (
+                "You are a concise, helpful assistant.\n"
+                "If RAG context is provided, ground your answer primarily in that context and reference sources like [1], [2].\n"
+                "If the context is irrelevant or insufficient, say so explicitly before answering from general knowledge.\n"
+            )
 
-                messages = [{"role": "system", "content": system_prompt}]
-                if context_blocks:
-                    messages.append({"role": "user", "content": "RAG context:\n" + "\n\n".join(context_blocks)})
-                history_tail = st.session_state.messages[-4:]
-                for m in history_tail:
-                    messages.append({"role": m["role"], "content": m["content"]})
-                messages.append({"role": "user", "content": prompt})
+            messages = [{"role": "system", "content": system_prompt}]
+            if context_blocks:
+                messages.append({"role": "user", "content": "RAG context:\n" + "\n\n".join(context_blocks)})
+            history_tail = st.session_state.messages[-4:]
+            for m in history_tail:
+                messages.append({"role": m["role"], "content": m["content"]})
+            messages.append({"role": "user", "content": prompt})
 
-                resp = client.chat.completions.create(model=model, messages=messages, temperature=0.2)
-                answer = resp.choices[0].message.content
-                st.markdown(answer)
-                
-                with st.expander("Show retrieved sources"):
-                    st.markdown("\n".join(f"- {c}" for c in citations))
-                    
-            elif mode == "Agentic Context (Transcript + Diagnostics)":
-                # Agentic mode
-                config = {
-                    "model": model,
-                    "top_k": top_k,
-                    "max_tool_calls": 3,
-                    "sql_max_rows": 50
-                }
+            answer = st.write_stream(stream_completion(messages, timing, turn_start))
+            
+            with st.expander("Show retrieved sources"):
+                st.markdown("\n".join(f"- {c}" for c in citations))
                 
+        elif mode == "Agentic Context (Transcript + Diagnostics)":
+            # Agentic mode
+            config = {
+                "model": model,
+                "top_k": top_k,
+                "search_mode": search_mode,
+                "max_tool_calls": 3,
+                "sql_max_rows": 50,
+                "completion_cache": use_completion_cache,
+                "stream": True
+            }
+            
+            with st.spinner("Gathering evidence..."):
                 agentic_resp = run_agentic_chat(
                     user_msg=prompt,
                     chat_history=st.session_state.messages[-4:],
@@ -241,41 +303,52 @@ if prompt:
                     sqlite_path=get_db_path(),
                     config=config
                 )
+            
+            if agentic_resp.answer_stream is not None:
+                st.write_stream(agentic_resp.answer_stream)
+            else:
+                # Clarification questions are returned without a model call
+                st.markdown(agentic_resp.final_answer)
+            answer = agentic_resp.final_answer
+            for entry in agentic_resp.trace:
+                if entry["step"] == "answer_timing":
+                    timing = {"first_token_ms": entry["first_token_ms"], "total_ms": entry["total_ms"]}
+            
+            # Store response data for "How I answered" panel
+            response_idx = len(st.session_state.messages)
+            st.session_state.agentic_responses[response_idx] = {
+                "evidence": agentic_resp.evidence,
+                "trace": agentic_resp.trace,
+                "confidence": agentic_resp.confidence,
+                "confidence_reason": agentic_resp.confidence_reason
+            }
+            
+            with st.expander("🔍 How I answered"):
+                st.write(f"**Mode:** Agentic Context")
+                st.write(f"**Confidence:** {agentic_resp.confidence} - {agentic_resp.confidence_reason}")
                 
-                answer = agentic_resp.final_answer
-                st.markdown(answer)
+                if agentic_resp.evidence["retrieved_chunks"]:
+                    st.write("**Retrieved Transcript Chunks:**")
+                    for chunk in agentic_resp.evidence["retrieved_chunks"]:
+                        st.write(f"- [{chunk['chunk_id']}] {chunk['source_doc']} (score: {chunk['score']:.3f})")
+                        with st.expander(f"View chunk {chunk['chunk_id']}"):
+                            st.text(chunk["text"])
                 
-                # Store response data for "How I answered" panel
-                response_idx = len(st.session_state.messages)
-                st.session_state.agentic_responses[response_idx] = {
-                    "evidence": agentic_resp.evidence,
-                    "trace": agentic_resp.trace,
-                    "confidence": agentic_resp.confidence,
-                    "confidence_reason": agentic_resp.confidence_reason
-                }
+                if agentic_resp.evidence["sql_queries"]:
+                    st.write("**SQL Queries Executed:**")
+                    for sql_idx, sql_query in enumerate(agentic_resp.evidence["sql_queries"], 1):
+                        st.code(sql_query, language="sql")
+                        if sql_idx <= len(agentic_resp.evidence["sql_results"]):
+                            sql_result = agentic_resp.evidence["sql_results"][sql_idx - 1]
+                            st.write(f"Returned {sql_result['row_count']} rows")
+                            if sql_result["preview"]:
+                                st.dataframe(to_dataframe(sql_result["columns"], sql_result["preview"]), use_container_width=True)
                 
-                with st.expander("🔍 How I answered"):
-                    st.write(f"**Mode:** Agentic Context")
-                    st.write(f"**Confidence:** {agentic_resp.confidence} - {agentic_resp.confidence_reason}")
-                    
-                    if agentic_resp.evidence["retrieved_chunks"]:
-                        st.write("**Retrieved Transcript Chunks:**")
-                        for chunk in agentic_resp.evidence["retrieved_chunks"]:
-                            st.write(f"- [{chunk['chunk_id']}] {chunk['source_doc']} (score: {chunk['score']:.3f})")
-                            with st.expander(f"View chunk {chunk['chunk_id']}"):
-                                st.text(chunk["text"])
-                    
-                    if agentic_resp.evidence["sql_queries"]:
-                        st.write("**SQL Queries Executed:**")
-                        for sql_idx, sql_query in enumerate(agentic_resp.evidence["sql_queries"], 1):
-                            st.code(sql_query, language="sql")
-                            if sql_idx <= len(agentic_resp.evidence["sql_results"]):
-                                sql_result = agentic_resp.evidence["sql_results"][sql_idx - 1]
-                                st.write(f"Returned {sql_result['row_count']} rows")
-                                if sql_result["preview"]:
-                                    st.dataframe(pd.DataFrame(sql_result["preview"]), use_container_width=True)
-                    
-                    st.write("**Trace:**")
-                    st.json(agentic_resp.trace)
+                st.write("**Trace:**")
+                st.json(agentic_resp.trace)
+    
+        if timing:
+            st.caption(timing_caption(timing))
+            st.session_state.turn_timings[len(st.session_state.messages)] = timing
     
     st.session_state.messages.append({"role": "assistant", "content": answer})
@@ -1,10 +1,50 @@
-"""Database initialization and management for diagnostics database."""
+"""Database initialization and management for diagnostics database.
+
+Read queries go through a per-path pool of reusable connections instead of
+opening (and re-initializing) a connection per query. Pooled connections are
+read-only (``PRAGMA query_only``) and memory-map the file; the schema is
+applied once per process per database file. Writers (``seed_database``,
+``clear_database``) keep using their own connections from ``get_connection``.
+``stream_query`` reads results ``fetchmany`` batch by batch up to a row
+budget, and ``execute_query(..., columnar=True)`` returns the header once and
+rows as tuples (see ``diagnostics.tabular``) instead of one dict per row.
+
+``v_results`` reads ``mv_results``, a materialized copy of the five-table
+join (``v_results_live``) that triggers on the base tables keep in sync and
+that is indexed for the common ``pet_name``/``analyte_code``/``test_name`` +
+``visit_datetime`` filters. Databases created before it existed are migrated
+by ``init_db`` (tracked with ``PRAGMA user_version``), or explicitly with::
+
+    python -m diagnostics.db migrate
+"""
 
 import os
 import sqlite3
+import threading
+from contextlib import contextmanager
 from pathlib import Path
+from typing import Dict, Iterator, List, Optional
 
 DIAGNOSTICS_DB_PATH = os.environ.get("DIAGNOSTICS_DB_PATH", "diagnostics/diagnostics.db")
+# Idle read connections kept per database file.
+DIAGNOSTICS_POOL_SIZE = int(os.environ.get("DIAGNOSTICS_POOL_SIZE", "8"))
+DIAGNOSTICS_MMAP_SIZE = int(os.environ.get("DIAGNOSTICS_MMAP_SIZE", str(256 * 1024 * 1024)))
+# Page cache per connection, in KiB.
+DIAGNOSTICS_CACHE_KB = int(os.environ.get("DIAGNOSTICS_CACHE_KB", "16384"))
+# Rows fetched per fetchmany() call when streaming results.
+DIAGNOSTICS_FETCH_BATCH = int(os.environ.get("DIAGNOSTICS_FETCH_BATCH", "256"))
+# Whether v_results of a newly created or migrated database reads mv_results
+# (1) or computes the join on every read (0); set_materialized_results changes it later.
+MATERIALIZED_RESULTS = os.environ.get("DIAGNOSTICS_MATERIALIZED_RESULTS", "1") != "0"
+# Bumped when schema.sql gains objects that existing databases need.
+# 1: indexes, v_results_live, mv_results and its triggers.
+SCHEMA_VERSION = 1
+
+_RESULT_COLUMNS = ("visit_id, visit_datetime, pet_name, species, test_id, test_name, analyte_code, "
+                   "analyte_name, value_num, value_text, unit, flag")
+
+_initialized: Dict[str, tuple] = {}
+_init_lock = threading.Lock()
 
 
 def get_db_path():
@@ -12,66 +52,341 @@ def get_db_path():
     return DIAGNOSTICS_DB_PATH
 
 
+def _file_id(db_path: str):
+    try:
+        st = os.stat(db_path)
+    except FileNotFoundError:
+        return None
+    return st.st_dev, st.st_ino
+
+
 def init_db(db_path: str = None):
-    """Initialize the database with schema if it doesn't exist."""
+    """Initialize the database with schema if it doesn't exist (checked once per process per file)."""
     if db_path is None:
         db_path = get_db_path()
-    
-    # Ensure directory exists
-    Path(db_path).parent.mkdir(parents=True, exist_ok=True)
-    
-    # Check if database already exists and has tables
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    
-    try:
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='owners'")
-        if cursor.fetchone():
-            # Database already initialized
-            conn.close()
+    key = os.path.abspath(db_path)
+    file_id = _file_id(db_path)
+    if file_id is not None and _initialized.get(key) == file_id:
+        return
+
+    with _init_lock:
+        file_id = _file_id(db_path)
+        if file_id is not None and _initialized.get(key) == file_id:
             return
-    except:
-        pass
-    
-    # Read and execute schema
-    schema_path = Path(__file__).parent / "schema.sql"
-    if schema_path.exists():
-        with open(schema_path, "r", encoding="utf-8") as f:
-            schema_sql = f.read()
-        cursor.executescript(schema_sql)
+
+        # Ensure directory exists
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+
+        conn = sqlite3.connect(db_path)
+        cursor = conn.cursor()
+
+        # Check if database already exists and has tables
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='owners'")
+        exists = cursor.fetchone() is not None
+        version = cursor.execute("PRAGMA user_version").fetchone()[0]
+        # A database at the current version is only read, never written
+        if not exists or version < SCHEMA_VERSION:
+            if not exists:
+                try:
+                    # WAL lets pooled readers run alongside a writer
+                    cursor.execute("PRAGMA journal_mode=WAL")
+                except:
+                    pass
+            # Every statement in schema.sql is idempotent, so an older database
+            # only gains the objects it is missing
+            schema_path = Path(__file__).parent / "schema.sql"
+            if schema_path.exists():
+                with open(schema_path, "r", encoding="utf-8") as f:
+                    schema_sql = f.read()
+                cursor.executescript(schema_sql)
+                if exists:
+                    _rebuild_materialized(cursor)
+                # The configured default applies once; from then on the view
+                # definition stored in the database is the setting
+                _set_results_view(cursor, MATERIALIZED_RESULTS)
+                cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            conn.commit()
+        conn.close()
+        _initialized[key] = _file_id(db_path)
+
+
+def _rebuild_materialized(cursor) -> int:
+    cursor.execute("DELETE FROM mv_results")
+    cursor.execute("INSERT INTO mv_results SELECT * FROM v_results_live")
+    return cursor.execute("SELECT COUNT(*) FROM mv_results").fetchone()[0]
+
+
+def _set_results_view(cursor, materialized: bool) -> None:
+    """Point v_results at mv_results or at the live join, if it does not already."""
+    source = "mv_results" if materialized else "v_results_live"
+    row = cursor.execute("SELECT sql FROM sqlite_master WHERE type='view' AND name='v_results'").fetchone()
+    if row and row[0].rstrip().rstrip(";").endswith(f"FROM {source}"):
+        return
+    cursor.execute("DROP VIEW IF EXISTS v_results")
+    cursor.execute(f"CREATE VIEW v_results AS SELECT {_RESULT_COLUMNS} FROM {source}")
+
+
+def rebuild_materialized_results(db_path: str = None) -> int:
+    """Recompute mv_results from the base tables; returns its row count."""
+    conn = get_connection(db_path)
+    try:
+        count = _rebuild_materialized(conn.cursor())
         conn.commit()
-    
-    conn.close()
+        return count
+    finally:
+        conn.close()
+
+
+def set_materialized_results(enabled: bool, db_path: str = None) -> None:
+    """Switch v_results between mv_results and the live join; the choice is stored in the database."""
+    conn = get_connection(db_path)
+    try:
+        _set_results_view(conn.cursor(), enabled)
+        conn.commit()
+    finally:
+        conn.close()
 
 
 def get_connection(db_path: str = None):
-    """Get a connection to the diagnostics database."""
+    """Get a new (writable) connection to the diagnostics database."""
     if db_path is None:
         db_path = get_db_path()
-    
+
     # Ensure database is initialized
     init_db(db_path)
-    
+
     return sqlite3.connect(db_path)
 
 
-def execute_query(sql: str, params: tuple = None, db_path: str = None):
-    """Execute a SELECT query and return results."""
-    conn = get_connection(db_path)
-    conn.row_factory = sqlite3.Row  # Return rows as dict-like objects
-    cursor = conn.cursor()
-    
-    try:
-        if params:
-            cursor.execute(sql, params)
-        else:
-            cursor.execute(sql)
-        rows = cursor.fetchall()
-        columns = [description[0] for description in cursor.description] if cursor.description else []
-        return {
-            "columns": columns,
-            "rows": [dict(row) for row in rows],
-            "row_count": len(rows)
-        }
-    finally:
-        conn.close()
+class ConnectionPool:
+    """Thread-safe pool of read-only connections to one database file."""
+
+    def __init__(self, db_path: str, size: int = DIAGNOSTICS_POOL_SIZE):
+        self.db_path = db_path
+        self.size = size
+        self.file_id = _file_id(db_path)
+        self._idle = []
+        self._lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+        self.closed = 0
+        self.in_use = 0
+        self.peak_in_use = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        conn.row_factory = sqlite3.Row  # Return rows as dict-like objects
+        conn.execute("PRAGMA query_only = ON")
+        conn.execute(f"PRAGMA mmap_size = {DIAGNOSTICS_MMAP_SIZE}")
+        conn.execute(f"PRAGMA cache_size = {-DIAGNOSTICS_CACHE_KB}")
+        return conn
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection; it goes back to the pool (or is closed when the pool is full)."""
+        with self._lock:
+            conn = self._idle.pop() if self._idle else None
+            if conn is not None:
+                self.reused += 1
+            self.in_use += 1
+            self.peak_in_use = max(self.peak_in_use, self.in_use)
+        if conn is None:
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._lock:
+                    self.in_use -= 1
+                raise
+            with self._lock:
+                self.created += 1
+        try:
+            yield conn
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            with self._lock:
+                self.in_use -= 1
+                keep = len(self._idle) < self.size
+                if keep:
+                    self._idle.append(conn)
+                else:
+                    self.closed += 1
+            if not keep:
+                conn.close()
+
+    def close(self) -> None:
+        """Close the idle connections."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+            self.closed += len(idle)
+        for conn in idle:
+            conn.close()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            borrowed = self.created + self.reused
+            return {
+                "path": self.db_path,
+                "size": self.size,
+                "idle": len(self._idle),
+                "in_use": self.in_use,
+                "peak_in_use": self.peak_in_use,
+                "created": self.created,
+                "reused": self.reused,
+                "closed": self.closed,
+                "reuse_rate": self.reused / borrowed if borrowed else 0.0,
+            }
+
+
+_pools: Dict[str, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_path: str = None) -> ConnectionPool:
+    """The read pool for ``db_path``, created (and the schema applied) on first use.
+
+    A pool whose file was replaced (different inode, e.g. deleted and
+    recreated) is discarded so no connection keeps reading the old file.
+    """
+    if db_path is None:
+        db_path = get_db_path()
+    init_db(db_path)
+    key = os.path.abspath(db_path)
+    file_id = _file_id(db_path)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is not None and pool.file_id != file_id:
+            pool.close()
+            pool = None
+        if pool is None:
+            pool = _pools[key] = ConnectionPool(db_path)
+        return pool
+
+
+def pool_stats(db_path: str = None) -> Dict:
+    """Connection reuse counters of the read pool for ``db_path`` (empty before first use)."""
+    key = os.path.abspath(db_path or get_db_path())
+    with _pools_lock:
+        pool = _pools.get(key)
+    return pool.stats() if pool else {}
+
+
+# Per file: (file identity, connection used only to read PRAGMA data_version)
+_probes: Dict[str, tuple] = {}
+_write_generations: Dict[str, int] = {}
+_version_lock = threading.Lock()
+
+
+def notify_write(db_path: str = None) -> None:
+    """Record that this process changed the database (seed, clear or any other writer)."""
+    key = os.path.abspath(db_path or get_db_path())
+    with _version_lock:
+        _write_generations[key] = _write_generations.get(key, 0) + 1
+
+
+def data_version(db_path: str = None) -> tuple:
+    """A token that changes whenever the database content may have changed.
+
+    Combines the file identity (a replaced file), ``PRAGMA data_version`` on a
+    dedicated connection (it changes when any other connection, in this or
+    another process, commits) and the in-process writer generation from
+    ``notify_write``.
+    """
+    if db_path is None:
+        db_path = get_db_path()
+    key = os.path.abspath(db_path)
+    file_id = _file_id(db_path)
+    with _version_lock:
+        probe_file, probe = _probes.get(key, (None, None))
+        if probe is not None and probe_file != file_id:
+            probe.close()
+            probe = None
+        if probe is None and file_id is not None:
+            probe = sqlite3.connect(db_path, check_same_thread=False)
+            _probes[key] = (file_id, probe)
+        version = probe.execute("PRAGMA data_version").fetchone()[0] if probe is not None else None
+        return file_id, version, _write_generations.get(key, 0)
+
+
+def fetch_rows(cursor, max_rows: Optional[int] = None, batch_size: int = DIAGNOSTICS_FETCH_BATCH) -> Iterator[List]:
+    """Yield batches of rows from an executed cursor, stopping once max_rows rows were read."""
+    remaining = max_rows
+    while remaining is None or remaining > 0:
+        size = batch_size if remaining is None else min(batch_size, remaining)
+        batch = cursor.fetchmany(size)
+        if not batch:
+            return
+        if remaining is not None:
+            remaining -= len(batch)
+        yield batch
+
+
+@contextmanager
+def stream_query(sql: str, params: tuple = None, db_path: str = None, max_rows: Optional[int] = None,
+                 batch_size: int = DIAGNOSTICS_FETCH_BATCH):
+    """
+    Run a SELECT on a pooled connection and yield (columns, batches).
+
+    ``batches`` iterates lists of row tuples, ``batch_size`` at a time, and
+    stops after ``max_rows`` rows; only one batch is held in memory. The
+    connection goes back to the pool when the block exits.
+
+    Example:
+        with stream_query("SELECT * FROM v_results", max_rows=1000) as (columns, batches):
+            for batch in batches:
+                ...
+    """
+    with get_pool(db_path).connection() as conn:
+        cursor = conn.cursor()
+        try:
+            if params:
+                cursor.execute(sql, params)
+            else:
+                cursor.execute(sql)
+            columns = [description[0] for description in cursor.description] if cursor.description else []
+            batches = ([tuple(row) for row in batch] for batch in fetch_rows(cursor, max_rows, batch_size))
+            yield columns, batches
+        finally:
+            cursor.close()
+
+
+def execute_query(sql: str, params: tuple = None, db_path: str = None, max_rows: Optional[int] = None,
+                  columnar: bool = False):
+    """
+    Execute a SELECT query and return results.
+
+    With max_rows, at most that many rows are read and "truncated" says
+    whether more matched. With columnar=True, "rows" holds value tuples in
+    "columns" order instead of dicts.
+    """
+    budget = max_rows + 1 if max_rows is not None else None
+    rows = []
+    with stream_query(sql, params, db_path=db_path, max_rows=budget) as (columns, batches):
+        for batch in batches:
+            rows.extend(batch)
+    truncated = max_rows is not None and len(rows) > max_rows
+    if truncated:
+        rows = rows[:max_rows]
+    return {
+        "columns": columns,
+        "rows": rows if columnar else [dict(zip(columns, row)) for row in rows],
+        "row_count": len(rows),
+        "truncated": truncated
+    }
+
+
+if __name__ == "__main__":
+    import sys
+    command = sys.argv[1] if len(sys.argv) > 1 else ""
+    if command == "migrate":
+        init_db()
+        print(f"✓ Schema at version {SCHEMA_VERSION}: {get_db_path()}")
+    elif command == "rebuild":
+        print(f"✓ Rebuilt mv_results: {rebuild_materialized_results()} rows")
+    elif command == "materialized" and len(sys.argv) > 2 and sys.argv[2] in ("on", "off"):
+        set_materialized_results(sys.argv[2] == "on")
+        print(f"✓ v_results now reads {'mv_results' if sys.argv[2] == 'on' else 'v_results_live'}")
+    else:
+        print("usage: python -m diagnostics.db migrate | rebuild | materialized on|off")
+        sys.exit(1)
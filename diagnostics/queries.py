@@ -1,4 +1,8 @@
-"""Helper queries for diagnostics viewer."""
+"""Helper queries for diagnostics viewer.
+
+``columnar=True`` returns rows as value tuples with the header once (see
+``diagnostics.tabular``), which is what the viewer's dataframes consume.
+"""
 
 from diagnostics.db import execute_query
 
@@ -20,7 +24,7 @@ def get_visit_summary(limit: int = 20):
     return execute_query(sql, (limit,))
 
 
-def get_visit_tests(visit_id: str):
+def get_visit_tests(visit_id: str, columnar: bool = False):
     """Get all tests for a specific visit."""
     sql = """
     SELECT 
@@ -34,10 +38,10 @@ def get_visit_tests(visit_id: str):
     WHERE visit_id = ?
     ORDER BY ordered_datetime
     """
-    return execute_query(sql, (visit_id,))
+    return execute_query(sql, (visit_id,), columnar=columnar)
 
 
-def get_abnormal_results(visit_id: str):
+def get_abnormal_results(visit_id: str, columnar: bool = False):
     """Get abnormal results (H or L flags) for a visit."""
     sql = """
     SELECT 
@@ -54,10 +58,10 @@ def get_abnormal_results(visit_id: str):
     ORDER BY test_name, analyte_code
     LIMIT 50
     """
-    return execute_query(sql, (visit_id,))
+    return execute_query(sql, (visit_id,), columnar=columnar)
 
 
-def get_test_results(visit_id: str, test_name: str = None):
+def get_test_results(visit_id: str, test_name: str = None, columnar: bool = False):
     """Get all results for a visit, optionally filtered by test name."""
     if test_name:
         sql = """
@@ -74,7 +78,7 @@ def get_test_results(visit_id: str, test_name: str = None):
         ORDER BY analyte_code
         LIMIT 50
         """
-        return execute_query(sql, (visit_id, test_name))
+        return execute_query(sql, (visit_id, test_name), columnar=columnar)
     else:
         sql = """
         SELECT 
@@ -90,4 +94,4 @@ def get_test_results(visit_id: str, test_name: str = None):
         ORDER BY test_name, analyte_code
         LIMIT 50
         """
-        return execute_query(sql, (visit_id,))
+        return execute_query(sql, (visit_id,), columnar=columnar)
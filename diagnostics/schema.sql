@@ -69,14 +69,26 @@ CREATE TABLE IF NOT EXISTS test_results (
   comment         TEXT
 );
 
--- Helpful views (optional) for easier reporting / NL queries
-CREATE VIEW IF NOT EXISTS v_results AS
+-- --- Indexes for the joins and the common pet / date filters ---
+CREATE INDEX IF NOT EXISTS idx_pets_name ON pets(name);
+CREATE INDEX IF NOT EXISTS idx_visits_pet_datetime ON visits(pet_id, visit_datetime);
+CREATE INDEX IF NOT EXISTS idx_visits_datetime ON visits(visit_datetime);
+CREATE INDEX IF NOT EXISTS idx_tests_visit ON tests(visit_id);
+CREATE INDEX IF NOT EXISTS idx_test_results_test ON test_results(test_id);
+CREATE INDEX IF NOT EXISTS idx_test_results_analyte ON test_results(analyte_id);
+CREATE INDEX IF NOT EXISTS idx_reference_ranges_analyte ON reference_ranges(analyte_id, species);
+
+-- Results joined across tests, visits, pets and analytes (computed on every read)
+CREATE VIEW IF NOT EXISTS v_results_live AS
 SELECT
+  r.result_id,
+  t.test_id,
   v.visit_id,
+  p.pet_id,
+  a.analyte_id,
   v.visit_datetime,
   p.name AS pet_name,
   p.species,
-  t.test_id,
   t.test_name,
   a.analyte_code,
   a.analyte_name,
@@ -89,3 +101,93 @@ JOIN tests t     ON t.test_id = r.test_id
 JOIN visits v    ON v.visit_id = t.visit_id
 JOIN pets p      ON p.pet_id = v.pet_id
 JOIN analytes a  ON a.analyte_id = r.analyte_id;
+
+-- Materialized copy of v_results_live (same columns, same order), kept in
+-- sync by the triggers below: every write to a base table re-derives the
+-- affected rows
+CREATE TABLE IF NOT EXISTS mv_results (
+  result_id       TEXT PRIMARY KEY,
+  test_id         TEXT NOT NULL,
+  visit_id        TEXT NOT NULL,
+  pet_id          TEXT NOT NULL,
+  analyte_id      TEXT NOT NULL,
+  visit_datetime  TEXT NOT NULL,
+  pet_name        TEXT NOT NULL,
+  species         TEXT NOT NULL,
+  test_name       TEXT NOT NULL,
+  analyte_code    TEXT NOT NULL,
+  analyte_name    TEXT NOT NULL,
+  value_num       REAL,
+  value_text      TEXT,
+  unit            TEXT NOT NULL,
+  flag            TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_mv_results_pet_analyte ON mv_results(pet_name, analyte_code, visit_datetime);
+CREATE INDEX IF NOT EXISTS idx_mv_results_pet_test ON mv_results(pet_name, test_name, visit_datetime);
+CREATE INDEX IF NOT EXISTS idx_mv_results_test ON mv_results(test_id);
+CREATE INDEX IF NOT EXISTS idx_mv_results_visit ON mv_results(visit_id);
+CREATE INDEX IF NOT EXISTS idx_mv_results_pet_id ON mv_results(pet_id);
+CREATE INDEX IF NOT EXISTS idx_mv_results_analyte_id ON mv_results(analyte_id);
+
+CREATE TRIGGER IF NOT EXISTS trg_test_results_mv_insert AFTER INSERT ON test_results BEGIN
+  INSERT OR REPLACE INTO mv_results SELECT * FROM v_results_live WHERE result_id = NEW.result_id;
+END;
+CREATE TRIGGER IF NOT EXISTS trg_test_results_mv_update AFTER UPDATE ON test_results BEGIN
+  DELETE FROM mv_results WHERE result_id = OLD.result_id;
+  INSERT OR REPLACE INTO mv_results SELECT * FROM v_results_live WHERE result_id = NEW.result_id;
+END;
+CREATE TRIGGER IF NOT EXISTS trg_test_results_mv_delete AFTER DELETE ON test_results BEGIN
+  DELETE FROM mv_results WHERE result_id = OLD.result_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_tests_mv_insert AFTER INSERT ON tests BEGIN
+  INSERT OR REPLACE INTO mv_results SELECT * FROM v_results_live WHERE test_id = NEW.test_id;
+END;
+CREATE TRIGGER IF NOT EXISTS trg_tests_mv_update AFTER UPDATE ON tests BEGIN
+  DELETE FROM mv_results WHERE test_id = OLD.test_id;
+  INSERT OR REPLACE INTO mv_results SELECT * FROM v_results_live WHERE test_id = NEW.test_id;
+END;
+CREATE TRIGGER IF NOT EXISTS trg_tests_mv_delete AFTER DELETE ON tests BEGIN
+  DELETE FROM mv_results WHERE test_id = OLD.test_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_visits_mv_insert AFTER INSERT ON visits BEGIN
+  INSERT OR REPLACE INTO mv_results SELECT * FROM v_results_live WHERE visit_id = NEW.visit_id;
+END;
+CREATE TRIGGER IF NOT EXISTS trg_visits_mv_update AFTER UPDATE ON visits BEGIN
+  DELETE FROM mv_results WHERE visit_id = OLD.visit_id;
+  INSERT OR REPLACE INTO mv_results SELECT * FROM v_results_live WHERE visit_id = NEW.visit_id;
+END;
+CREATE TRIGGER IF NOT EXISTS trg_visits_mv_delete AFTER DELETE ON visits BEGIN
+  DELETE FROM mv_results WHERE visit_id = OLD.visit_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_pets_mv_insert AFTER INSERT ON pets BEGIN
+  INSERT OR REPLACE INTO mv_results SELECT * FROM v_results_live WHERE pet_id = NEW.pet_id;
+END;
+CREATE TRIGGER IF NOT EXISTS trg_pets_mv_update AFTER UPDATE ON pets BEGIN
+  DELETE FROM mv_results WHERE pet_id = OLD.pet_id;
+  INSERT OR REPLACE INTO mv_results SELECT * FROM v_results_live WHERE pet_id = NEW.pet_id;
+END;
+CREATE TRIGGER IF NOT EXISTS trg_pets_mv_delete AFTER DELETE ON pets BEGIN
+  DELETE FROM mv_results WHERE pet_id = OLD.pet_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_analytes_mv_insert AFTER INSERT ON analytes BEGIN
+  INSERT OR REPLACE INTO mv_results SELECT * FROM v_results_live WHERE analyte_id = NEW.analyte_id;
+END;
+CREATE TRIGGER IF NOT EXISTS trg_analytes_mv_update AFTER UPDATE ON analytes BEGIN
+  DELETE FROM mv_results WHERE analyte_id = OLD.analyte_id;
+  INSERT OR REPLACE INTO mv_results SELECT * FROM v_results_live WHERE analyte_id = NEW.analyte_id;
+END;
+CREATE TRIGGER IF NOT EXISTS trg_analytes_mv_delete AFTER DELETE ON analytes BEGIN
+  DELETE FROM mv_results WHERE analyte_id = OLD.analyte_id;
+END;
+
+-- Helpful views (optional) for easier reporting / NL queries.
+-- v_results reads the materialized table; init_db points new or migrated
+-- databases at v_results_live when DIAGNOSTICS_MATERIALIZED_RESULTS=0.
+CREATE VIEW IF NOT EXISTS v_results AS
+SELECT visit_id, visit_datetime, pet_name, species, test_id, test_name, analyte_code,
+       analyte_name, value_num, value_text, unit, flag
+FROM mv_results;
@@ -1,14 +1,12 @@
 """Seed the diagnostics database with demo data for Daisy the dog."""
 
-import sqlite3
 from datetime import datetime, timedelta
-from diagnostics.db import get_db_path, init_db
+from diagnostics.db import get_connection, notify_write
 
 
 def seed_database():
     """Seed the database with demo data."""
-    init_db()
-    conn = sqlite3.connect(get_db_path())
+    conn = get_connection()
     cursor = conn.cursor()
     
     try:
@@ -156,6 +154,7 @@ def seed_database():
         """, all_results)
         
         conn.commit()
+        notify_write()
         print("✓ Seed data loaded successfully!")
         print(f"  - Owner: Alex Morgan")
         print(f"  - Pet: Daisy (Dog)")
@@ -173,7 +172,7 @@ def seed_database():
 
 def clear_database():
     """Clear all data from the database (keeps schema)."""
-    conn = sqlite3.connect(get_db_path())
+    conn = get_connection()
     cursor = conn.cursor()
     
     try:
@@ -185,6 +184,7 @@ def clear_database():
         cursor.execute("DELETE FROM reference_ranges")
         cursor.execute("DELETE FROM analytes")
         conn.commit()
+        notify_write()
         print("✓ Database cleared successfully!")
     except Exception as e:
         conn.rollback()
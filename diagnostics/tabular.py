@@ -0,0 +1,87 @@
+"""Compact columnar encoding of query results.
+
+A list of row dicts repeats every column name in every row, and as prompt
+text (``str(row)``) the names, quotes and braces are most of the tokens.
+Results here keep the header once and each row as a tuple of values:
+``to_table`` converts either shape, ``format_table`` renders a table as
+pipe-separated text for prompts (columns that are empty in every row are
+dropped, and columns holding one value in every row are written once above
+the header), and ``to_dataframe`` builds a pandas DataFrame straight from the
+tuples.
+"""
+
+from typing import Dict, List, Optional, Sequence
+
+
+def to_table(columns: Sequence[str], rows: Sequence) -> Dict:
+    """{"columns": [...], "rows": [tuple, ...]} from row dicts or row sequences."""
+    columns = list(columns)
+    values = []
+    for row in rows:
+        if isinstance(row, dict):
+            values.append(tuple(row.get(column) for column in columns))
+        else:
+            values.append(tuple(row))
+    return {"columns": columns, "rows": values}
+
+
+def to_records(columns: Sequence[str], rows: Sequence) -> List[Dict]:
+    """Row dicts from columnar rows (for callers that need name lookups)."""
+    return [dict(zip(columns, row)) for row in rows]
+
+
+def format_value(value) -> str:
+    """Shortest faithful text for a cell: '' for NULL, no trailing '.0', separators escaped."""
+    if value is None:
+        return ""
+    if isinstance(value, float):
+        text = repr(value)
+        return text[:-2] if text.endswith(".0") else text
+    text = str(value)
+    if "|" in text or "\n" in text:
+        text = text.replace("|", "\\|").replace("\n", " ")
+    return text
+
+
+def format_table(columns: Sequence[str], rows: Sequence, total_rows: Optional[int] = None) -> str:
+    """
+    Render rows as compact text for a prompt.
+
+    Example:
+        pet_name=Daisy; visit_id=VISIT001
+        test_name|analyte_code|value_num|unit|flag
+        CBC|WBC|18.5|10^3/μL|H
+        CBC|RBC|5.8|10^6/μL|N
+        (2 of 18 rows)
+    """
+    table = to_table(columns, rows)
+    columns, rows = table["columns"], table["rows"]
+    if not rows:
+        return "|".join(columns)
+
+    keep, constant = [], []
+    for i, column in enumerate(columns):
+        values = {row[i] for row in rows}
+        if values == {None}:
+            continue
+        if len(rows) > 1 and len(values) == 1:
+            constant.append(f"{column}={format_value(rows[0][i])}")
+        else:
+            keep.append(i)
+
+    lines = []
+    if constant:
+        lines.append("; ".join(constant))
+    if keep:
+        lines.append("|".join(columns[i] for i in keep))
+        for row in rows:
+            lines.append("|".join(format_value(row[i]) for i in keep))
+    if total_rows is not None and total_rows > len(rows):
+        lines.append(f"({len(rows)} of {total_rows} rows)")
+    return "\n".join(lines)
+
+
+def to_dataframe(columns: Sequence[str], rows: Sequence):
+    """pandas DataFrame from columnar (or dict) rows."""
+    import pandas as pd
+    return pd.DataFrame(to_table(columns, rows)["rows"], columns=list(columns))
@@ -0,0 +1 @@
+"""Vector store and retrieval internals used by rag_utils."""
@@ -0,0 +1,275 @@
+"""Optional IVF (inverted file) approximate nearest-neighbor index.
+
+The index partitions the unit-normalized store vectors into ``nlist`` clusters
+with spherical k-means. A query is compared against the cluster centroids and
+only the vectors in the ``nprobe`` closest clusters are scored, so cost grows
+with ``nprobe / nlist`` of the store instead of all of it. Raising ``nprobe``
+trades latency for recall; ``nprobe == nlist`` is exact.
+
+The index stores chunk ids, not row positions, so it survives segment
+compaction. Ids that are no longer live are skipped, and live chunks the index
+does not know yet are always scored exactly, so results never silently miss
+new data.
+
+``ivf.npz`` inside the store directory holds the trained centroids and the ids
+assigned at build time. Chunks added later are assigned per segment, like the
+BM25 postings: when a store is loaded for search, segments without a
+``segments/seg-NNNNNN.ivf.npz`` file get their unindexed ids assigned to the
+nearest centroids once and the file is written. An upload therefore never
+rewrites ``ivf.npz``; compaction removes the merged segments' files and the
+next load assigns whatever the new segment holds that the build did not.
+Segment files carry the build number of the centroids they were assigned to
+and are ignored after a rebuild::
+
+    python -m rag.ann build [store_path] [nlist]
+    python -m rag.ann recall [store_path] [k] [nprobe]
+"""
+
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from rag.index import VectorIndex, as_matrix, normalize_rows, top_k_indices
+from rag.store import SEGMENTS_DIR, open_embeddings, read_manifest, read_segment_chunks, read_store, store_lock
+
+ANN_FILE = "ivf.npz"
+ANN_EXT = "ivf.npz"
+DEFAULT_NPROBE = int(os.environ.get("RAG_ANN_NPROBE", "8"))
+KMEANS_ITERATIONS = 10
+# Train on at most this many points per cluster; the rest are only assigned.
+TRAIN_POINTS_PER_LIST = 256
+_ASSIGN_BATCH = 8192
+
+
+def default_nlist(n: int) -> int:
+    return int(max(1, min(4096, round(np.sqrt(n)))))
+
+
+class IVFIndex:
+    """Cluster centroids plus the chunk ids assigned to each cluster."""
+
+    def __init__(self, centroids: np.ndarray, lists: List[np.ndarray], build: int = 0):
+        self.centroids = np.asarray(centroids, dtype=np.float32)
+        self.lists = lists
+        self.build = build
+
+    @property
+    def nlist(self) -> int:
+        return self.centroids.shape[0]
+
+    def __len__(self) -> int:
+        return sum(len(ids) for ids in self.lists)
+
+    @classmethod
+    def train(cls, vectors: np.ndarray, ids: np.ndarray, nlist: Optional[int] = None, seed: int = 0) -> "IVFIndex":
+        """Cluster ``vectors`` (unit-normalized rows) with spherical k-means."""
+        vectors = as_matrix(vectors)
+        n = vectors.shape[0]
+        if n == 0:
+            raise ValueError("Cannot train an ANN index on an empty store")
+        nlist = min(nlist or default_nlist(n), n)
+        rng = np.random.default_rng(seed)
+        sample_size = min(n, nlist * TRAIN_POINTS_PER_LIST)
+        sample = vectors[np.sort(rng.choice(n, size=sample_size, replace=False))]
+        centroids = sample[rng.choice(sample_size, size=nlist, replace=False)].copy()
+        for _ in range(KMEANS_ITERATIONS):
+            assign = _nearest(sample, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, sample)
+            counts = np.bincount(assign, minlength=nlist)
+            empty = counts == 0
+            if empty.any():
+                # Reseed empty clusters with random points so every list is used.
+                sums[empty] = sample[rng.choice(sample_size, size=int(empty.sum()))]
+            centroids = normalize_rows(sums)
+        index = cls(centroids, [np.zeros(0, dtype=np.int64) for _ in range(nlist)])
+        index.add(vectors, ids)
+        return index
+
+    def add(self, vectors: np.ndarray, ids) -> None:
+        """Assign new vectors to their nearest cluster (incremental insert)."""
+        ids = np.asarray(ids, dtype=np.int64)
+        if ids.size == 0:
+            return
+        self.extend(ids, _nearest(as_matrix(vectors), self.centroids))
+
+    def extend(self, ids: np.ndarray, assign: np.ndarray) -> None:
+        """Append ``ids`` to the lists given by ``assign`` (one list number per id)."""
+        for list_no in np.unique(assign):
+            self.lists[list_no] = np.concatenate([self.lists[list_no], ids[assign == list_no]])
+
+    def probe(self, query: np.ndarray, nprobe: int) -> np.ndarray:
+        """Chunk ids in the ``nprobe`` clusters closest to ``query``."""
+        nprobe = max(1, min(nprobe, self.nlist))
+        lists = top_k_indices(self.centroids @ query, nprobe)
+        return np.concatenate([self.lists[i] for i in lists])
+
+    def indexed_ids(self) -> np.ndarray:
+        return np.concatenate(self.lists) if self.lists else np.zeros(0, dtype=np.int64)
+
+    def save(self, path: str) -> None:
+        offsets = np.cumsum([0] + [len(ids) for ids in self.lists])
+        tmp = path + ".tmp.npz"
+        np.savez(tmp, centroids=self.centroids, ids=self.indexed_ids(), offsets=offsets, build=self.build)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> "IVFIndex":
+        with np.load(path) as data:
+            ids, offsets = data["ids"], data["offsets"]
+            lists = [ids[offsets[i]:offsets[i + 1]].copy() for i in range(len(offsets) - 1)]
+            build = int(data["build"]) if "build" in data.files else 0
+            return cls(data["centroids"], lists, build)
+
+
+def _nearest(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Index of the most similar centroid for each row, computed in batches."""
+    out = np.empty(vectors.shape[0], dtype=np.int64)
+    for start in range(0, vectors.shape[0], _ASSIGN_BATCH):
+        out[start:start + _ASSIGN_BATCH] = np.argmax(vectors[start:start + _ASSIGN_BATCH] @ centroids.T, axis=1)
+    return out
+
+
+def ann_path(store_dir: str) -> str:
+    return os.path.join(store_dir, ANN_FILE)
+
+
+def segment_ann_path(store_dir: str, name: str) -> str:
+    return os.path.join(store_dir, SEGMENTS_DIR, f"{name}.{ANN_EXT}")
+
+
+def _load_segment(store_dir: str, name: str, build: int) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    try:
+        with np.load(segment_ann_path(store_dir, name)) as data:
+            if int(data["build"]) != build:
+                return None
+            return data["ids"], data["lists"]
+    except FileNotFoundError:
+        return None
+
+
+def _assign_segment(store_dir: str, segment: Dict, dim: int, ivf: IVFIndex,
+                    known: np.ndarray) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """Assign a segment's ids the build did not cover and persist them; None if it was compacted away."""
+    name = segment["name"]
+    try:
+        chunks = read_segment_chunks(store_dir, segment)
+        vectors = open_embeddings(os.path.join(store_dir, SEGMENTS_DIR, f"{name}.f32"), segment["rows"], dim)
+    except FileNotFoundError:
+        return None
+    ids = np.asarray([c["id"] for c in chunks], dtype=np.int64)
+    new = ~np.isin(ids, known)
+    if not new.all():
+        ids, vectors = ids[new], vectors[np.flatnonzero(new)]
+    lists = _nearest(vectors, ivf.centroids) if ids.size else np.zeros(0, dtype=np.int64)
+    path = segment_ann_path(store_dir, name)
+    # Unique per writer: two loads may assign the same segment at once
+    tmp = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp.npz"
+    np.savez(tmp, ids=ids, lists=lists, build=ivf.build)
+    os.replace(tmp, path)
+    if not os.path.exists(os.path.join(store_dir, SEGMENTS_DIR, f"{name}.jsonl")):
+        # Compaction removed the segment while we assigned it
+        os.remove(path)
+    return ids, lists
+
+
+def load_ivf(store_dir: str) -> Optional[IVFIndex]:
+    """The built index plus every segment's later assignments, assigning segments that have none yet."""
+    path = ann_path(store_dir)
+    if not os.path.exists(path):
+        return None
+    ivf = IVFIndex.load(path)
+    manifest = read_manifest(store_dir)
+    known = ivf.indexed_ids()
+    for segment in (manifest["segments"] if manifest else []):
+        added = _load_segment(store_dir, segment["name"], ivf.build)
+        if added is None:
+            added = _assign_segment(store_dir, segment, manifest["dim"], ivf, known)
+        if added is not None:
+            ivf.extend(*added)
+    return ivf
+
+
+class IVFSearcher:
+    """An IVF index bound to the live rows of one loaded store."""
+
+    def __init__(self, ivf: IVFIndex, index: VectorIndex, chunk_ids):
+        self.ivf = ivf
+        self.index = index
+        chunk_ids = np.asarray(chunk_ids, dtype=np.int64)
+        self._order = np.argsort(chunk_ids, kind="stable")
+        self._sorted_ids = chunk_ids[self._order]
+        # Live rows the index does not cover yet; always scored exactly.
+        self.unindexed_rows = np.flatnonzero(~np.isin(chunk_ids, ivf.indexed_ids()))
+
+    def _rows_for(self, ids: np.ndarray) -> np.ndarray:
+        if self._sorted_ids.size == 0 or ids.size == 0:
+            return np.zeros(0, dtype=np.int64)
+        pos = np.searchsorted(self._sorted_ids, ids)
+        pos = np.minimum(pos, self._sorted_ids.size - 1)
+        live = self._sorted_ids[pos] == ids
+        return self._order[pos[live]]
+
+    def search(self, query, k: int, nprobe: int = DEFAULT_NPROBE):
+        """Return ``(row indices, scores)`` of the approximate top ``k``, best first."""
+        q = normalize_rows(np.asarray(query, dtype=np.float32))
+        rows = np.concatenate([self._rows_for(self.ivf.probe(q, nprobe)), self.unindexed_rows])
+        if rows.size == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        scores = self.index.vectors[rows] @ q
+        top = top_k_indices(scores, k)
+        return rows[top], scores[top]
+
+
+def build_index(store_dir: str, nlist: Optional[int] = None) -> IVFIndex:
+    """Train an IVF index over the current store and persist it next to the segments.
+
+    Runs under the store lock, so no upload or compaction changes the store
+    between reading it and saving the index.
+    """
+    with store_lock(store_dir):
+        store = read_store(store_dir)
+        vectors = VectorIndex(store["embeddings"], normalized=store["normalized"]).vectors
+        ids = np.asarray([c["id"] for c in store["chunks"]], dtype=np.int64)
+        ivf = IVFIndex.train(vectors, ids, nlist=nlist)
+        ivf.build = time.time_ns()
+        ivf.save(ann_path(store_dir))
+    return ivf
+
+
+def recall_at_k(searcher: IVFSearcher, queries: np.ndarray, k: int, nprobe: int) -> float:
+    """Fraction of the exact top-k that the ANN search returns, averaged over ``queries``."""
+    if len(queries) == 0:
+        return 1.0
+    found = 0
+    expected = 0
+    for q in queries:
+        exact_rows, _ = searcher.index.search(q, k)
+        ann_rows, _ = searcher.search(q, k, nprobe=nprobe)
+        found += len(set(exact_rows.tolist()) & set(ann_rows.tolist()))
+        expected += len(exact_rows)
+    return found / expected if expected else 1.0
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+    import rag_utils
+
+    command = sys.argv[1] if len(sys.argv) > 1 else "build"
+    path = sys.argv[2] if len(sys.argv) > 2 else rag_utils.DEFAULT_STORE_PATH
+    if command == "build":
+        stats = rag_utils.build_ann_index(path, nlist=int(sys.argv[3]) if len(sys.argv) > 3 else None)
+        print(f"✓ Built IVF index: {stats['nlist']} lists over {stats['indexed']} chunks")
+    elif command == "recall":
+        k = int(sys.argv[3]) if len(sys.argv) > 3 else 10
+        nprobe = int(sys.argv[4]) if len(sys.argv) > 4 else DEFAULT_NPROBE
+        start = time.perf_counter()
+        recall = rag_utils.ann_recall(path, k=k, nprobe=nprobe)
+        print(f"recall@{k} with nprobe={nprobe}: {recall:.3f} ({time.perf_counter() - start:.2f}s)")
+    else:
+        print("usage: python -m rag.ann [build|recall] [store_path] ...")
+        sys.exit(1)
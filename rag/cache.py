@@ -0,0 +1,98 @@
+"""Process-wide cache of loaded stores and their search indexes.
+
+Entries are keyed by store directory and validated on every lookup against the
+inode, mtime and size of the manifest and of the optional ANN index file (both
+are atomically replaced on every write) plus an in-process generation counter
+bumped by explicit invalidation. A lookup therefore costs two ``stat`` calls
+unless the store has changed.
+"""
+
+import os
+import threading
+from typing import Dict, Optional, Tuple
+
+from rag import ann
+from rag import store as vector_store
+from rag.index import VectorIndex
+from rag.metadata import MetadataIndex
+
+
+class StoreCache:
+    """Loaded stores and search indexes keyed by path, with hit/miss counters."""
+
+    def __init__(self):
+        self._entries: Dict[str, Dict] = {}
+        self._generations: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def _key(path: str) -> str:
+        return os.path.abspath(vector_store.resolve_store_dir(path))
+
+    @staticmethod
+    def _file_signature(path: str) -> Optional[Tuple]:
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return st.st_ino, st.st_mtime_ns, st.st_size
+
+    def _signature(self, key: str) -> Tuple:
+        return (
+            self._file_signature(os.path.join(key, vector_store.MANIFEST_FILE)),
+            self._file_signature(ann.ann_path(key)),
+            self._generations.get(key, 0),
+        )
+
+    def get(self, path: str) -> Dict:
+        """Return ``{"store", "index", "ann", "metadata"}`` for ``path``, loading it if stale.
+
+        ``ann`` is an ``IVFSearcher`` when an ANN index has been built, else None.
+        ``metadata`` is the ``MetadataIndex`` used to resolve search filters.
+        """
+        vector_store.ensure_migrated(vector_store.resolve_store_dir(path))
+        key = self._key(path)
+        with self._lock:
+            signature = self._signature(key)
+            entry = self._entries.get(key)
+            if entry is not None and entry["signature"] == signature:
+                self.hits += 1
+                return entry
+            self.misses += 1
+            store = vector_store.read_store(path)
+            index = VectorIndex(store["embeddings"], normalized=store["normalized"])
+            ivf = ann.load_ivf(key)
+            entry = {
+                "signature": signature,
+                "store": store,
+                "index": index,
+                "ann": ann.IVFSearcher(ivf, index, [c["id"] for c in store["chunks"]]) if ivf else None,
+                "metadata": MetadataIndex(store["chunks"]),
+            }
+            self._entries[key] = entry
+            return entry
+
+    def invalidate(self, path: Optional[str] = None) -> None:
+        """Drop the cached entry for ``path`` (or every entry when ``path`` is None)."""
+        with self._lock:
+            keys = list(self._entries) if path is None else [self._key(path)]
+            for key in keys:
+                self._generations[key] = self._generations.get(key, 0) + 1
+                if self._entries.pop(key, None) is not None:
+                    self.invalidations += 1
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "entries": len(self._entries),
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+store_cache = StoreCache()
@@ -0,0 +1,106 @@
+"""Streaming, section-aware markdown chunker.
+
+``iter_chunks`` consumes text incrementally (a text file object, or any
+iterable of string pieces) and yields chunks as soon as they are complete, so
+embedding can start before a large transcript has been fully read.
+
+Chunking follows the paragraph rules of the original ``chunk_markdown``:
+paragraphs (separated by blank lines) are packed up to ``target_size``
+characters, a new chunk starts with the last ``overlap`` characters of the
+previous one, and a paragraph longer than ``target_size`` is cut into
+overlapping slices. In addition, a markdown heading always starts a new chunk
+with no overlap carried over, so no chunk spans two sections. Headings inside
+fenced code blocks are ignored.
+
+Chunks are assembled from lists of parts and joined once when emitted, so the
+total work is linear in the input size.
+"""
+
+import re
+from typing import Iterable, Iterator, List, Tuple
+
+HEADING_RE = re.compile(r"#{1,6}(\s|$)")
+FENCE_RE = re.compile(r"(```|~~~)")
+
+
+def iter_lines(pieces: Iterable[str]) -> Iterator[str]:
+    """Re-split arbitrary text pieces into lines (each ending in ``\\n`` except maybe the last)."""
+    pending: List[str] = []
+    for piece in pieces:
+        if "\n" not in piece:
+            if piece:
+                pending.append(piece)
+            continue
+        parts = piece.split("\n")
+        parts[0] = "".join(pending) + parts[0]
+        pending = []
+        for part in parts[:-1]:
+            yield part + "\n"
+        if parts[-1]:
+            pending.append(parts[-1])
+    if pending:
+        yield "".join(pending)
+
+
+def iter_paragraphs(lines: Iterable[str]) -> Iterator[Tuple[str, bool]]:
+    """Yield ``(paragraph, starts_section)`` pairs from markdown lines.
+
+    Paragraphs end at empty lines; a heading line outside a code fence also
+    ends the running paragraph and starts a new section.
+    """
+    para: List[str] = []
+    starts_section = False
+    in_fence = False
+
+    def flush():
+        text = "".join(para).strip()
+        return (text, starts_section) if text else None
+
+    for line in lines:
+        if line == "\n":
+            item = flush()
+            if item:
+                yield item
+            para, starts_section = [], False
+            continue
+        if FENCE_RE.match(line):
+            in_fence = not in_fence
+        elif not in_fence and HEADING_RE.match(line):
+            item = flush()
+            if item:
+                yield item
+            para, starts_section = [], True
+        para.append(line)
+    item = flush()
+    if item:
+        yield item
+
+
+def iter_chunks(stream: Iterable[str], target_size: int = 1000, overlap: int = 150) -> Iterator[str]:
+    """Yield chunks from a text stream as they complete."""
+    parts: List[str] = []
+    length = 0
+    for para, starts_section in iter_paragraphs(iter_lines(stream)):
+        if starts_section and parts:
+            yield "\n\n".join(parts)
+            parts, length = [], 0
+        if length + len(para) + 2 <= target_size:
+            length = length + 2 + len(para) if parts else len(para)
+            parts.append(para)
+        elif parts:
+            current = "\n\n".join(parts)
+            yield current
+            tail = current[-overlap:].lstrip() if overlap > 0 else ""
+            parts = [tail, para] if tail else [para]
+            length = len(tail) + 2 + len(para) if tail else len(para)
+        else:
+            start = 0
+            while start < len(para):
+                end = min(start + target_size, len(para))
+                yield para[start:end]
+                if overlap > 0 and end < len(para):
+                    start = end - overlap
+                else:
+                    start = end
+    if parts:
+        yield "\n\n".join(parts)
@@ -0,0 +1,59 @@
+"""Process-wide OpenAI client shared by embedding, search, agentic and app calls.
+
+Building an ``OpenAI()`` per call means a fresh HTTP connection pool and TLS
+handshake per request. ``get_client`` builds one client on first use, over an
+HTTP connection pool sized for concurrent embedding batches plus chat calls, with
+keep-alive so later requests reuse open connections. Pool size, timeouts and
+keep-alive come from ``OPENAI_*`` environment variables. ``set_client``
+injects another client (a local stub in tests, a pre-configured proxy client)
+for the whole process; ``set_client(None)`` goes back to the default.
+"""
+
+import os
+import threading
+from typing import Optional
+
+from openai import DEFAULT_CONNECTION_LIMITS, DefaultHttpxClient, OpenAI, Timeout
+
+# The pool-limits type of the HTTP library the SDK is built on, taken from the
+# SDK rather than imported, since that library is the SDK's dependency, not ours.
+Limits = type(DEFAULT_CONNECTION_LIMITS)
+
+OPENAI_TIMEOUT = float(os.environ.get("OPENAI_TIMEOUT", "60"))
+OPENAI_CONNECT_TIMEOUT = float(os.environ.get("OPENAI_CONNECT_TIMEOUT", "5"))
+OPENAI_MAX_CONNECTIONS = int(os.environ.get("OPENAI_MAX_CONNECTIONS", "20"))
+OPENAI_KEEPALIVE_CONNECTIONS = int(os.environ.get("OPENAI_KEEPALIVE_CONNECTIONS", "10"))
+OPENAI_KEEPALIVE_EXPIRY = float(os.environ.get("OPENAI_KEEPALIVE_EXPIRY", "60"))
+OPENAI_MAX_RETRIES = int(os.environ.get("OPENAI_MAX_RETRIES", "2"))
+
+_client = None
+_lock = threading.Lock()
+
+
+def build_client() -> OpenAI:
+    """A new client over a pooled keep-alive HTTP connection pool."""
+    http_client = DefaultHttpxClient(
+        limits=Limits(
+            max_connections=OPENAI_MAX_CONNECTIONS,
+            max_keepalive_connections=OPENAI_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY,
+        ),
+        timeout=Timeout(OPENAI_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT),
+    )
+    return OpenAI(http_client=http_client, max_retries=OPENAI_MAX_RETRIES)
+
+
+def get_client():
+    """The shared client, built on first use (thread-safe)."""
+    global _client
+    with _lock:
+        if _client is None:
+            _client = build_client()
+        return _client
+
+
+def set_client(client: Optional[object]) -> None:
+    """Use ``client`` for every caller from now on; None rebuilds the default on next use."""
+    global _client
+    with _lock:
+        _client = client
@@ -0,0 +1,130 @@
+"""Batched, concurrent embedding requests with retry and rate-limit backoff.
+
+Inputs are split into batches bounded by both item count and an estimated
+token budget, a bounded number of batches run concurrently, and transient
+failures (429, 5xx, connection errors) are retried with exponential backoff.
+A 429 pauses every worker, not just the one that hit it, honouring the
+server's ``Retry-After`` when present. The SDK's own retries are turned off
+for these requests so every attempt goes through that logic. Results come
+back in input order.
+"""
+
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional
+
+import openai
+
+MAX_BATCH_ITEMS = int(os.environ.get("RAG_EMBED_BATCH_ITEMS", "256"))
+MAX_BATCH_TOKENS = int(os.environ.get("RAG_EMBED_BATCH_TOKENS", "100000"))
+MAX_CONCURRENCY = int(os.environ.get("RAG_EMBED_CONCURRENCY", "4"))
+MAX_RETRIES = 5
+BASE_BACKOFF_S = 0.5
+MAX_BACKOFF_S = 30.0
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about four characters per token for English text)."""
+    return len(text) // 4 + 1
+
+
+def make_batches(texts: List[str], max_items: int = MAX_BATCH_ITEMS,
+                 max_tokens: int = MAX_BATCH_TOKENS) -> List[range]:
+    """Split ``texts`` into consecutive index ranges within both limits.
+
+    A single text larger than ``max_tokens`` still gets a batch of its own.
+    """
+    batches = []
+    start = 0
+    tokens = 0
+    for i, text in enumerate(texts):
+        t = estimate_tokens(text)
+        if i > start and (i - start >= max_items or tokens + t > max_tokens):
+            batches.append(range(start, i))
+            start, tokens = i, 0
+        tokens += t
+    if start < len(texts):
+        batches.append(range(start, len(texts)))
+    return batches
+
+
+def _is_retryable(exc: Exception) -> bool:
+    if isinstance(exc, (openai.RateLimitError, openai.APIConnectionError)):
+        return True
+    status = getattr(exc, "status_code", None)
+    return isinstance(exc, openai.APIStatusError) and status is not None and status >= 500
+
+
+def _retry_after(exc: Exception) -> Optional[float]:
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    value = headers.get("retry-after")
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+class _RateGate:
+    """Shared pause so one 429 backs off every in-flight worker."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._resume_at = 0.0
+
+    def wait(self) -> None:
+        with self._lock:
+            delay = self._resume_at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def pause(self, seconds: float) -> None:
+        with self._lock:
+            self._resume_at = max(self._resume_at, time.monotonic() + seconds)
+
+
+def _call_with_retry(request: Callable[[], List[List[float]]], gate: _RateGate,
+                     max_retries: int = MAX_RETRIES) -> List[List[float]]:
+    for attempt in range(max_retries + 1):
+        gate.wait()
+        try:
+            return request()
+        except Exception as exc:
+            if attempt == max_retries or not _is_retryable(exc):
+                raise
+            delay = _retry_after(exc)
+            if delay is None:
+                delay = min(MAX_BACKOFF_S, BASE_BACKOFF_S * 2 ** attempt) * (0.5 + random.random() / 2)
+            if isinstance(exc, openai.RateLimitError):
+                gate.pause(delay)
+            else:
+                time.sleep(delay)
+
+
+def embed_batched(client, texts: List[str], model: str,
+                  max_items: int = MAX_BATCH_ITEMS, max_tokens: int = MAX_BATCH_TOKENS,
+                  concurrency: int = MAX_CONCURRENCY) -> List[List[float]]:
+    """Embed ``texts`` with batched, concurrent requests; output order matches input."""
+    if not texts:
+        return []
+    batches = make_batches(texts, max_items=max_items, max_tokens=max_tokens)
+    gate = _RateGate()
+    # Retries happen here (shared 429 pause, Retry-After), not also inside the SDK
+    if hasattr(client, "with_options"):
+        client = client.with_options(max_retries=0)
+
+    def run(batch: range) -> List[List[float]]:
+        def request():
+            resp = client.embeddings.create(model=model, input=[texts[i] for i in batch])
+            return [d.embedding for d in sorted(resp.data, key=lambda d: getattr(d, "index", 0))]
+        return _call_with_retry(request, gate)
+
+    if len(batches) == 1 or concurrency <= 1:
+        results = [run(b) for b in batches]
+    else:
+        with ThreadPoolExecutor(max_workers=min(concurrency, len(batches))) as pool:
+            results = list(pool.map(run, batches))
+    return [emb for batch in results for emb in batch]
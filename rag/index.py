@@ -0,0 +1,195 @@
+"""Exact cosine-similarity search over the store embedding matrix."""
+
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """Return a float32 copy of ``matrix`` with unit-length rows (zero rows stay zero)."""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if matrix.ndim == 1:
+        norm = np.linalg.norm(matrix)
+        return matrix / norm if norm > 0 else matrix.copy()
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return np.divide(matrix, norms, out=np.zeros_like(matrix), where=norms > 0)
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the ``k`` highest scores, best first.
+
+    Uses ``argpartition`` so only the selected ``k`` entries are sorted.
+    """
+    n = scores.shape[0]
+    k = min(k, n)
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64)
+    if k < n:
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(n)
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+
+def top_k_indices_2d(scores: np.ndarray, k: int) -> np.ndarray:
+    """Row-wise ``top_k_indices`` for a (queries x rows) score matrix."""
+    n = scores.shape[1]
+    k = min(k, n)
+    if k <= 0:
+        return np.zeros((scores.shape[0], 0), dtype=np.int64)
+    if k < n:
+        candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        candidates = np.broadcast_to(np.arange(n), scores.shape)
+    picked = np.take_along_axis(scores, candidates, axis=1)
+    order = np.argsort(-picked, axis=1, kind="stable")
+    return np.take_along_axis(candidates, order, axis=1)
+
+
+class SegmentedMatrix:
+    """Rows of several matrices stacked in order, without concatenating them.
+
+    Each part is ``(matrix, rows)``: ``rows`` (sorted positions, or None for
+    all) selects the live rows of that matrix, so memory-mapped segment files
+    stay mapped instead of being copied into one heap array. Row slices, row
+    gathers and ``matrix @ x`` are computed part by part; ``np.asarray``
+    materializes the whole matrix.
+    """
+
+    ndim = 2
+    dtype = np.dtype(np.float32)
+
+    def __init__(self, parts: Sequence[Tuple[np.ndarray, Optional[np.ndarray]]], dim: int):
+        self.parts = [(m, None if r is None else np.asarray(r, dtype=np.int64)) for m, r in parts]
+        sizes = [m.shape[0] if r is None else len(r) for m, r in self.parts]
+        self.offsets = np.concatenate([[0], np.cumsum(sizes, dtype=np.int64)]).astype(np.int64)
+        self.shape = (int(self.offsets[-1]), dim)
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    def _local(self, part: int, positions):
+        rows = self.parts[part][1]
+        return positions if rows is None else rows[positions]
+
+    def _stack(self, pieces: List[np.ndarray]) -> np.ndarray:
+        if not pieces:
+            return np.zeros((0, self.shape[1]), dtype=np.float32)
+        return np.concatenate(pieces)
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            key = int(key) + (self.shape[0] if key < 0 else 0)
+            if not 0 <= key < self.shape[0]:
+                raise IndexError(f"row {key} out of range for {self.shape[0]} rows")
+            part = int(np.searchsorted(self.offsets, key, side="right")) - 1
+            return np.asarray(self.parts[part][0][self._local(part, key - self.offsets[part])])
+        if isinstance(key, slice) and key.step in (None, 1):
+            start, stop, _ = key.indices(self.shape[0])
+            pieces = []
+            for part, (matrix, _rows) in enumerate(self.parts):
+                lo, hi = max(start, self.offsets[part]), min(stop, self.offsets[part + 1])
+                if lo < hi:
+                    local = slice(lo - self.offsets[part], hi - self.offsets[part])
+                    pieces.append(np.asarray(matrix[self._local(part, local)]))
+            return self._stack(pieces)
+        if isinstance(key, slice):
+            key = np.arange(*key.indices(self.shape[0]))
+        key = np.asarray(key)
+        if key.dtype == bool:
+            key = np.flatnonzero(key)
+        key = np.where(key < 0, key + self.shape[0], key).astype(np.int64)
+        owner = np.searchsorted(self.offsets, key, side="right") - 1
+        out = np.empty((key.size, self.shape[1]), dtype=np.float32)
+        for part in np.unique(owner):
+            mask = owner == part
+            out[mask] = self.parts[part][0][self._local(part, key[mask] - self.offsets[part])]
+        return out
+
+    def __matmul__(self, other) -> np.ndarray:
+        other = np.asarray(other, dtype=np.float32)
+        pieces = []
+        for matrix, rows in self.parts:
+            product = np.asarray(matrix @ other)
+            pieces.append(product if rows is None else product[rows])
+        if not pieces:
+            return np.zeros((0,) + other.shape[1:], dtype=np.float32)
+        return np.concatenate(pieces)
+
+    def __array__(self, dtype=None, copy=None) -> np.ndarray:
+        matrix = self._stack([np.asarray(m if r is None else m[r]) for m, r in self.parts])
+        return matrix if dtype is None else matrix.astype(dtype, copy=False)
+
+
+def as_matrix(vectors) -> np.ndarray:
+    """``vectors`` as a float32 matrix, leaving a ``SegmentedMatrix`` unmaterialized."""
+    return vectors if isinstance(vectors, SegmentedMatrix) else np.asarray(vectors, dtype=np.float32)
+
+
+# Upper bound on the (queries x rows) score matrix built at once by search_many.
+_MAX_SCORE_CELLS = 32 * 1024 * 1024
+
+
+class VectorIndex:
+    """Exact search index holding unit-normalized stored vectors.
+
+    Normalization happens once when the index is built, so scoring a query is a
+    single matrix-vector product. Stores written with normalized embeddings are
+    used as-is, without copying the (possibly memory-mapped or segmented) matrix.
+    """
+
+    def __init__(self, embeddings: np.ndarray, normalized: bool = False):
+        if normalized:
+            self.vectors = as_matrix(embeddings)
+        else:
+            self.vectors = normalize_rows(embeddings)
+
+    def __len__(self) -> int:
+        return self.vectors.shape[0]
+
+    @property
+    def dim(self) -> int:
+        return self.vectors.shape[1]
+
+    def _subset(self, rows: Optional[np.ndarray]) -> np.ndarray:
+        return self.vectors if rows is None else np.asarray(self.vectors[rows], dtype=np.float32)
+
+    def scores(self, query: List[float], rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """Cosine similarity of ``query`` against every stored vector (or only ``rows``)."""
+        q = normalize_rows(np.asarray(query, dtype=np.float32))
+        return self._subset(rows) @ q
+
+    def search(self, query: List[float], k: int, rows: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Return ``(indices, scores)`` of the top ``k`` rows, best first.
+
+        With ``rows`` (sorted row positions, e.g. from a metadata filter) only
+        those vectors are read and scored.
+        """
+        if len(self) == 0 or (rows is not None and len(rows) == 0):
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        scores = self.scores(query, rows)
+        idx = top_k_indices(scores, k)
+        return (idx if rows is None else rows[idx]), scores[idx]
+
+    def search_many(self, queries, k: int, rows: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Top ``k`` for several queries with matrix-matrix products.
+
+        Returns ``(indices, scores)`` arrays of shape (queries x k), best first.
+        Queries are processed in blocks so the score matrix stays bounded.
+        ``rows`` restricts scoring to a subset as in ``search``.
+        """
+        q = normalize_rows(np.asarray(queries, dtype=np.float32).reshape(len(queries), -1))
+        vectors = self._subset(rows)
+        n = vectors.shape[0]
+        k = min(k, n)
+        indices = np.zeros((len(q), k), dtype=np.int64)
+        scores = np.zeros((len(q), k), dtype=np.float32)
+        if n == 0 or len(q) == 0:
+            return indices, scores
+        block = max(1, _MAX_SCORE_CELLS // n)
+        for start in range(0, len(q), block):
+            s = (vectors @ q[start:start + block].T).T
+            idx = top_k_indices_2d(s, k)
+            indices[start:start + block] = idx if rows is None else rows[idx]
+            scores[start:start + block] = np.take_along_axis(s, idx, axis=1)
+        return indices, scores
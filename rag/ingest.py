@@ -0,0 +1,237 @@
+"""Bulk-ingest a directory of transcripts into the vector store.
+
+Files are chunked in a process pool, chunks from several files are embedded
+together in large batches, and each batch is appended to the store as one
+segment. Progress is checkpointed so an interrupted run resumes where it
+stopped::
+
+    python -m rag.ingest sample_docs/
+    python -m rag.ingest /data/transcripts --store rag_store --workers 8
+
+The checkpoint (``<store>.ingest.json`` by default) records every ingested
+file with its size and mtime; files that changed since are ingested again.
+Like uploads, re-ingesting a document only embeds chunks whose content hash
+is new for that document and deletes chunks that disappeared; if the
+document's metadata (pet name, visit id, date) changed, all of its chunks are
+written again (their vectors usually come from the embedding cache).
+Documents are identified by their path relative to the directory given
+(``source`` keeps the file name for display), so same-named files in
+different subdirectories never replace each other's chunks.
+Files whose batch was being written when the run stopped are removed from the
+store and re-ingested, so a resume never leaves duplicate chunks.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Tuple
+
+import rag_utils
+from rag import metadata as doc_metadata
+from rag import store as vector_store
+from rag.chunking import iter_chunks
+
+DEFAULT_EXTENSIONS = (".md", ".markdown", ".txt")
+DEFAULT_BATCH_CHUNKS = 512
+
+
+def find_files(root: str, extensions=DEFAULT_EXTENSIONS) -> List[str]:
+    """All matching files under ``root``, in a stable order."""
+    found = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            if name.lower().endswith(extensions):
+                found.append(os.path.join(dirpath, name))
+    return found
+
+
+def document_id(path: str, root: str) -> str:
+    """Store id of a file: its path relative to the ingest root, with '/' separators.
+
+    Two files named ``notes.md`` in different subdirectories are different
+    documents; a file directly under the root keeps its bare name.
+    """
+    return os.path.relpath(os.path.abspath(path), os.path.abspath(root)).replace(os.sep, "/")
+
+
+def chunk_file(path: str) -> Tuple[str, List[str]]:
+    """Worker: stream one file through the chunker."""
+    with open(path, "r", encoding="utf-8", errors="ignore") as f:
+        return path, list(iter_chunks(f))
+
+
+def _file_key(path: str) -> List[int]:
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns]
+
+
+class Checkpoint:
+    """Ingest progress persisted as JSON: finished files and the batch in flight."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.done: Dict[str, List[int]] = {}
+        self.in_flight: List[str] = []
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self.done = data.get("done", {})
+            self.in_flight = data.get("in_flight", [])
+
+    def is_done(self, path: str) -> bool:
+        return self.done.get(os.path.abspath(path)) == _file_key(path)
+
+    def save(self) -> None:
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"done": self.done, "in_flight": self.in_flight}, f)
+        os.replace(tmp, self.path)
+
+    def begin(self, paths: List[str]) -> None:
+        self.in_flight = [os.path.abspath(p) for p in paths]
+        self.save()
+
+    def commit(self, paths: List[str]) -> None:
+        for p in paths:
+            self.done[os.path.abspath(p)] = _file_key(p)
+        self.in_flight = []
+        self.save()
+
+
+def ingest_directory(root: str, store_path: str = rag_utils.DEFAULT_STORE_PATH,
+                     workers: int = None, batch_chunks: int = DEFAULT_BATCH_CHUNKS,
+                     checkpoint_path: str = None, restart: bool = False,
+                     report=print) -> Dict:
+    """Ingest every transcript under ``root``; returns throughput stats."""
+    checkpoint_path = checkpoint_path or vector_store.resolve_store_dir(store_path) + ".ingest.json"
+    if restart and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    checkpoint = Checkpoint(checkpoint_path)
+
+    # A batch that was being appended when the last run stopped may or may
+    # not have reached the store; drop whatever did and ingest it again.
+    if checkpoint.in_flight:
+        for path in checkpoint.in_flight:
+            vector_store.delete_document(store_path, document_id(path, root))
+        checkpoint.in_flight = []
+        checkpoint.save()
+
+    files = find_files(root)
+    pending = [p for p in files if not checkpoint.is_done(p)]
+    report(f"Found {len(files)} files, {len(files) - len(pending)} already ingested, {len(pending)} to go")
+
+    start = time.perf_counter()
+    stats = {"files": 0, "chunks": 0, "unchanged": 0, "removed": 0, "skipped": len(files) - len(pending)}
+    stored = vector_store.list_chunks(store_path)
+    doc_index = vector_store.document_index(stored)
+    doc_meta = {}
+    for c in stored:
+        doc_meta.setdefault(vector_store.chunk_doc_id(c), doc_metadata.chunk_metadata(c))
+    batch_files: List[str] = []
+    batch_rows: List[Dict] = []
+    batch_stale: List[int] = []
+
+    def flush():
+        if not batch_files:
+            return
+        checkpoint.begin(batch_files)
+        if batch_rows:
+            embeddings = rag_utils.embed_texts([r["text"] for r in batch_rows])
+            ids = rag_utils.add_chunks_to_store(batch_rows, embeddings, store_path)
+            for row, chunk_id in zip(batch_rows, ids):
+                doc_index.setdefault(row["doc_id"], {})[row["hash"]] = [chunk_id]
+        if batch_stale:
+            vector_store.delete_chunks(store_path, batch_stale)
+            rag_utils.store_cache.invalidate(store_path)
+        checkpoint.commit(batch_files)
+        stats["files"] += len(batch_files)
+        stats["chunks"] += len(batch_rows)
+        elapsed = max(time.perf_counter() - start, 1e-9)
+        report(
+            f"  {stats['files']}/{len(pending)} files, {stats['chunks']} chunks "
+            f"({stats['files'] / elapsed:.1f} docs/s, {stats['chunks'] / elapsed:.1f} chunks/s)"
+        )
+        batch_files.clear()
+        batch_rows.clear()
+        batch_stale.clear()
+
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # Keep a bounded window of files in flight and consume results in order.
+        window = deque()
+        todo = iter(pending)
+        for path in todo:
+            window.append(pool.submit(chunk_file, path))
+            if len(window) >= workers * 4:
+                break
+        while window:
+            path, chunks = window.popleft().result()
+            nxt = next(todo, None)
+            if nxt is not None:
+                window.append(pool.submit(chunk_file, nxt))
+            doc_id = document_id(path, root)
+            existing = doc_index.get(doc_id, {})
+            meta = doc_metadata.document_metadata(chunks)
+            keep = existing if doc_meta.get(doc_id, meta) == meta else {}
+            doc_meta[doc_id] = meta
+            seen = set()
+            for c in chunks:
+                h = vector_store.content_hash(c)
+                if h in seen:
+                    continue
+                seen.add(h)
+                if h in keep:
+                    stats["unchanged"] += 1
+                else:
+                    batch_rows.append({"text": c, "source": os.path.basename(path), "doc_id": doc_id, "hash": h, **meta})
+            batch_stale.extend(vector_store.stale_chunk_ids(existing, seen if keep else ()))
+            # Chunks re-written for new metadata are not counted as removed
+            stats["removed"] += len(vector_store.stale_chunk_ids(existing, seen))
+            doc_index[doc_id] = {h: ids[:1] for h, ids in keep.items() if h in seen}
+            batch_files.append(path)
+            if len(batch_rows) >= batch_chunks:
+                flush()
+        flush()
+
+    elapsed = max(time.perf_counter() - start, 1e-9)
+    stats["seconds"] = elapsed
+    stats["docs_per_s"] = stats["files"] / elapsed
+    stats["chunks_per_s"] = stats["chunks"] / elapsed
+    return stats
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Bulk-ingest transcripts into the RAG store.")
+    parser.add_argument("directory", help="Directory to walk for .md/.markdown/.txt files")
+    parser.add_argument("--store", default=rag_utils.DEFAULT_STORE_PATH, help="Store path (default: %(default)s)")
+    parser.add_argument("--workers", type=int, default=None, help="Chunking processes (default: CPU count)")
+    parser.add_argument("--batch-chunks", type=int, default=DEFAULT_BATCH_CHUNKS,
+                        help="Chunks embedded and written per batch (default: %(default)s)")
+    parser.add_argument("--checkpoint", default=None, help="Checkpoint file (default: <store>.ingest.json)")
+    parser.add_argument("--restart", action="store_true", help="Ignore any existing checkpoint")
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.directory):
+        print(f"Not a directory: {args.directory}")
+        return 1
+    stats = ingest_directory(
+        args.directory,
+        store_path=args.store,
+        workers=args.workers,
+        batch_chunks=args.batch_chunks,
+        checkpoint_path=args.checkpoint,
+        restart=args.restart,
+    )
+    print(f"✓ Ingested {stats['files']} files ({stats['skipped']} skipped), {stats['chunks']} new chunks "
+          f"({stats['unchanged']} unchanged, {stats['removed']} removed) "
+          f"in {stats['seconds']:.1f}s — {stats['docs_per_s']:.1f} docs/s, {stats['chunks_per_s']:.1f} chunks/s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,294 @@
+"""BM25 inverted index over chunk text, for lexical and hybrid retrieval.
+
+Lab codes ("ALT", "BUN", "CREA") and drug names often embed poorly but are
+matched exactly by terms. The index maps each term to the chunk ids containing
+it with their term frequencies, plus each chunk's length in terms. Like the
+ANN index it stores chunk ids, not row positions, so it survives compaction:
+ids that are no longer live are skipped, and live chunks it does not know yet
+are tokenized when the store is loaded.
+
+Postings are persisted per segment, as ``segments/seg-NNNNNN.bm25.npz`` next
+to the segment they index, and built lazily: when a store is loaded for
+search, segments without a postings file are tokenized once and their file is
+written. An upload therefore writes no lexical data and the next search only
+tokenizes the new segment. Compaction replaces merged segments with a new one
+(whose postings are built without the deleted chunks) and removes the old
+segments' postings files with them. ``python -m rag.lexical build
+[store_path]`` rebuilds every segment's postings.
+
+Search modes built on it (see ``rag_utils.search``): ``lexical`` ranks by BM25
+alone, ``hybrid`` fuses the BM25 and vector rankings with reciprocal-rank
+fusion, and ``prefilter`` scores vectors only for the top BM25 candidates.
+"""
+
+import os
+import re
+import threading
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from rag.index import top_k_indices
+from rag.store import SEGMENTS_DIR, read_manifest, read_segment_chunks, store_lock
+
+LEXICAL_EXT = "bm25.npz"
+BM25_K1 = 1.2
+BM25_B = 0.75
+RRF_K = 60
+# Candidates each ranker contributes to hybrid fusion.
+FUSION_DEPTH = 50
+# BM25 candidates whose vectors are scored in prefilter mode.
+PREFILTER_CANDIDATES = int(os.environ.get("RAG_LEXICAL_CANDIDATES", "200"))
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase alphanumeric terms."""
+    return _TOKEN_RE.findall(text.casefold())
+
+
+class LexicalIndex:
+    """Flat postings ``(term id, chunk id, term frequency)`` plus per-chunk term counts."""
+
+    def __init__(self, vocab: List[str] = None, terms=None, ids=None, tfs=None,
+                 chunk_ids=None, lengths=None):
+        self.vocab = list(vocab or [])
+        self.term_ids = {t: i for i, t in enumerate(self.vocab)}
+        self.terms = np.asarray(terms if terms is not None else [], dtype=np.int64)
+        self.ids = np.asarray(ids if ids is not None else [], dtype=np.int64)
+        self.tfs = np.asarray(tfs if tfs is not None else [], dtype=np.float32)
+        self.chunk_ids = np.asarray(chunk_ids if chunk_ids is not None else [], dtype=np.int64)
+        self.lengths = np.asarray(lengths if lengths is not None else [], dtype=np.float32)
+
+    def __len__(self) -> int:
+        return self.chunk_ids.shape[0]
+
+    def add(self, ids: Iterable[int], texts: Iterable[str]) -> None:
+        """Index new chunks (incremental insert)."""
+        terms, post_ids, tfs, chunk_ids, lengths = [], [], [], [], []
+        for chunk_id, text in zip(ids, texts):
+            counts = Counter(tokenize(text))
+            chunk_ids.append(int(chunk_id))
+            lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                if term not in self.term_ids:
+                    self.term_ids[term] = len(self.vocab)
+                    self.vocab.append(term)
+                terms.append(self.term_ids[term])
+                post_ids.append(int(chunk_id))
+                tfs.append(tf)
+        self.terms = np.concatenate([self.terms, np.asarray(terms, dtype=np.int64)])
+        self.ids = np.concatenate([self.ids, np.asarray(post_ids, dtype=np.int64)])
+        self.tfs = np.concatenate([self.tfs, np.asarray(tfs, dtype=np.float32)])
+        self.chunk_ids = np.concatenate([self.chunk_ids, np.asarray(chunk_ids, dtype=np.int64)])
+        self.lengths = np.concatenate([self.lengths, np.asarray(lengths, dtype=np.float32)])
+
+    def save(self, path: str) -> None:
+        order = np.argsort(self.terms, kind="stable")
+        # Unique per writer: two searches may index the same segment at once
+        tmp = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp.npz"
+        np.savez(
+            tmp,
+            vocab=np.asarray(self.vocab, dtype=str),
+            terms=self.terms[order].astype(np.int32),
+            ids=self.ids[order],
+            tfs=self.tfs[order].astype(np.int32),
+            chunk_ids=self.chunk_ids,
+            lengths=self.lengths.astype(np.int32),
+        )
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> "LexicalIndex":
+        with np.load(path) as data:
+            return cls(data["vocab"].tolist(), data["terms"], data["ids"], data["tfs"],
+                       data["chunk_ids"], data["lengths"])
+
+    @classmethod
+    def concat(cls, indexes: List["LexicalIndex"]) -> "LexicalIndex":
+        """One index over several (e.g. per-segment) indexes, with their vocabularies unified."""
+        merged = cls()
+        parts = {"terms": [], "ids": [], "tfs": [], "chunk_ids": [], "lengths": []}
+        for index in indexes:
+            remap = np.empty(len(index.vocab), dtype=np.int64)
+            for i, term in enumerate(index.vocab):
+                if term not in merged.term_ids:
+                    merged.term_ids[term] = len(merged.vocab)
+                    merged.vocab.append(term)
+                remap[i] = merged.term_ids[term]
+            parts["terms"].append(remap[index.terms])
+            parts["ids"].append(index.ids)
+            parts["tfs"].append(index.tfs)
+            parts["chunk_ids"].append(index.chunk_ids)
+            parts["lengths"].append(index.lengths)
+        for name, arrays in parts.items():
+            if arrays:
+                setattr(merged, name, np.concatenate([getattr(merged, name)] + arrays))
+        return merged
+
+
+def segment_lexical_path(store_dir: str, name: str) -> str:
+    return os.path.join(store_dir, SEGMENTS_DIR, f"{name}.{LEXICAL_EXT}")
+
+
+def _index_segment(store_dir: str, segment: Dict) -> Optional[LexicalIndex]:
+    """Tokenize one segment and persist its postings; None if the segment was compacted away."""
+    try:
+        chunks = read_segment_chunks(store_dir, segment)
+    except FileNotFoundError:
+        return None
+    index = LexicalIndex()
+    index.add([c["id"] for c in chunks], [c["text"] for c in chunks])
+    path = segment_lexical_path(store_dir, segment["name"])
+    index.save(path)
+    if not os.path.exists(os.path.join(store_dir, SEGMENTS_DIR, f"{segment['name']}.jsonl")):
+        # Compaction removed the segment while we indexed it
+        os.remove(path)
+    return index
+
+
+def load_lexical(store_dir: str) -> Optional[LexicalIndex]:
+    """Postings of every segment in the manifest, tokenizing segments that have none yet.
+
+    Segments removed by a concurrent compaction are skipped; the searcher
+    tokenizes any live chunk the result does not cover.
+    """
+    manifest = read_manifest(store_dir)
+    if manifest is None:
+        return None
+    indexes = []
+    for segment in manifest["segments"]:
+        path = segment_lexical_path(store_dir, segment["name"])
+        try:
+            index = LexicalIndex.load(path)
+        except FileNotFoundError:
+            index = _index_segment(store_dir, segment)
+        if index is not None:
+            indexes.append(index)
+    return LexicalIndex.concat(indexes)
+
+
+def build_index(store_dir: str) -> LexicalIndex:
+    """Re-tokenize every segment of a store and persist its postings."""
+    with store_lock(store_dir):
+        manifest = read_manifest(store_dir)
+        indexes = []
+        for segment in (manifest["segments"] if manifest else []):
+            index = _index_segment(store_dir, segment)
+            if index is not None:
+                indexes.append(index)
+    return LexicalIndex.concat(indexes)
+
+
+def get_searcher(entry: Dict, store_dir: str) -> "LexicalSearcher":
+    """The BM25 searcher for a store-cache entry, built on first use."""
+    if "lexical" not in entry:
+        entry["lexical"] = LexicalSearcher(load_lexical(store_dir), entry["store"]["chunks"])
+    return entry["lexical"]
+
+
+def _rows_for(sorted_ids: np.ndarray, order: np.ndarray, ids: np.ndarray) -> np.ndarray:
+    """Row position of each chunk id, or -1 for ids that are not live."""
+    if sorted_ids.size == 0:
+        return np.full(ids.shape, -1, dtype=np.int64)
+    pos = np.minimum(np.searchsorted(sorted_ids, ids), sorted_ids.size - 1)
+    return np.where(sorted_ids[pos] == ids, order[pos], -1)
+
+
+class LexicalSearcher:
+    """BM25 scoring bound to the live rows of one loaded store."""
+
+    def __init__(self, index: Optional[LexicalIndex], chunks: List[Dict]):
+        index = index or LexicalIndex()
+        live_ids = np.asarray([c["id"] for c in chunks], dtype=np.int64)
+        missing = np.flatnonzero(~np.isin(live_ids, index.chunk_ids))
+        if missing.size:
+            # Live chunks the persisted index does not cover yet.
+            index = LexicalIndex(index.vocab, index.terms, index.ids, index.tfs, index.chunk_ids, index.lengths)
+            index.add(live_ids[missing], [chunks[i]["text"] for i in missing])
+        self.term_ids = index.term_ids
+        order = np.argsort(live_ids, kind="stable")
+        sorted_ids = live_ids[order]
+
+        self.lengths = np.zeros(len(chunks), dtype=np.float32)
+        length_rows = _rows_for(sorted_ids, order, index.chunk_ids)
+        self.lengths[length_rows[length_rows >= 0]] = index.lengths[length_rows >= 0]
+        self.avgdl = float(self.lengths.mean()) if len(chunks) and self.lengths.any() else 1.0
+
+        rows = _rows_for(sorted_ids, order, index.ids)
+        live = rows >= 0
+        by_term = np.argsort(index.terms[live], kind="stable")
+        self.rows = rows[live][by_term]
+        self.tfs = index.tfs[live][by_term]
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(index.terms[live], minlength=len(index.vocab)))])
+
+    def __len__(self) -> int:
+        return self.lengths.shape[0]
+
+    def scores(self, query: str, rows: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """``(rows, BM25 scores)`` of the chunks matching at least one query term.
+
+        With ``rows`` (sorted positions, e.g. from a metadata filter) only
+        those chunks are considered.
+        """
+        n = len(self)
+        matched = []
+        for term in dict.fromkeys(tokenize(query)):
+            tid = self.term_ids.get(term)
+            if tid is None:
+                continue
+            hit_rows = self.rows[self.offsets[tid]:self.offsets[tid + 1]]
+            tfs = self.tfs[self.offsets[tid]:self.offsets[tid + 1]]
+            if rows is not None:
+                keep = np.isin(hit_rows, rows)
+                hit_rows, tfs = hit_rows[keep], tfs[keep]
+            if hit_rows.size == 0:
+                continue
+            df = hit_rows.size
+            idf = np.log(1.0 + (n - df + 0.5) / (df + 0.5))
+            norm = tfs + BM25_K1 * (1.0 - BM25_B + BM25_B * self.lengths[hit_rows] / self.avgdl)
+            matched.append((hit_rows, idf * tfs * (BM25_K1 + 1.0) / norm))
+        if not matched:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        all_rows = np.concatenate([r for r, _ in matched])
+        unique, inverse = np.unique(all_rows, return_inverse=True)
+        totals = np.zeros(unique.size, dtype=np.float32)
+        np.add.at(totals, inverse, np.concatenate([s for _, s in matched]).astype(np.float32))
+        return unique, totals
+
+    def search(self, query: str, k: int, rows: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Return ``(row indices, BM25 scores)`` of the top ``k`` chunks, best first."""
+        hit_rows, totals = self.scores(query, rows)
+        top = top_k_indices(totals, k)
+        return hit_rows[top], totals[top]
+
+
+def reciprocal_rank_fusion(rankings: List[np.ndarray], k: int, c: int = RRF_K) -> Tuple[np.ndarray, np.ndarray]:
+    """Fuse ranked row lists: each row scores ``sum(1 / (c + rank))``; returns the top ``k``."""
+    fused: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, row in enumerate(ranking.tolist(), start=1):
+            fused[row] = fused.get(row, 0.0) + 1.0 / (c + rank)
+    if not fused:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+    rows = np.fromiter(fused, dtype=np.int64, count=len(fused))
+    scores = np.fromiter(fused.values(), dtype=np.float32, count=len(fused))
+    top = top_k_indices(scores, k)
+    return rows[top], scores[top]
+
+
+if __name__ == "__main__":
+    import sys
+    import rag_utils
+    from rag.store import resolve_store_dir
+
+    path = sys.argv[2] if len(sys.argv) > 2 else rag_utils.DEFAULT_STORE_PATH
+    if len(sys.argv) > 1 and sys.argv[1] == "build":
+        index = build_index(resolve_store_dir(path))
+        rag_utils.store_cache.invalidate(path)
+        print(f"✓ Built BM25 index: {len(index.vocab)} terms over {len(index)} chunks")
+    else:
+        print("usage: python -m rag.lexical build [store_path]")
+        sys.exit(1)
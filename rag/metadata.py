@@ -0,0 +1,138 @@
+"""Document metadata extracted at ingest and an inverted index for filtering.
+
+Visit transcripts start with a header such as::
+
+    # Veterinary Visit Transcript - Daisy
+    **Patient:** Daisy (Dog, Mixed breed, ...)
+    **Visit ID:** VISIT001
+    **Date:** January 10, 2025
+
+``document_metadata`` pulls the pet name, visit id and document date (as an
+ISO date) out of a document's chunks; every chunk row of the document carries
+the same fields. ``MetadataIndex`` maps each field value to the store rows
+that have it, so a filter resolves to a row subset with a few dictionary
+lookups before any vector is scored.
+"""
+
+import re
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+from rag.store import chunk_doc_id
+
+# Fields copied onto every chunk row of a document.
+DOC_FIELDS = ("pet_name", "visit_id", "doc_date")
+# Fields a search filter may use (plus "date_from"/"date_to" on doc_date).
+FILTER_FIELDS = ("source", "doc_id") + DOC_FIELDS
+
+_PATIENT_RE = re.compile(r"\*\*(?:Patient|Pet)(?: Name)?:\*\*\s*([A-Za-z][\w'-]*)", re.IGNORECASE)
+_TITLE_RE = re.compile(r"^#\s.*\bTranscript\s*[-–—:]\s*([A-Za-z][\w'-]*)", re.IGNORECASE | re.MULTILINE)
+_VISIT_RE = re.compile(r"\*\*Visit(?: ID)?:\*\*\s*([A-Za-z0-9_-]+)|\b(VISIT\d+)\b", re.IGNORECASE)
+_DATE_RE = re.compile(r"\*\*(?:Visit )?Date:\*\*\s*([^\n*]+)", re.IGNORECASE)
+_DATE_FORMATS = ("%Y-%m-%d", "%B %d, %Y", "%b %d, %Y", "%B %d %Y", "%d %B %Y", "%m/%d/%Y")
+
+
+def parse_date(value: str) -> Optional[str]:
+    """ISO date (YYYY-MM-DD) for common written date formats, or None."""
+    value = value.strip().rstrip(".")
+    for fmt in _DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).date().isoformat()
+        except ValueError:
+            continue
+    match = re.match(r"\d{4}-\d{2}-\d{2}", value)
+    return match.group(0) if match else None
+
+
+def update_metadata(metadata: Dict, text: str) -> Dict:
+    """Fill fields still missing from ``metadata`` using one chunk of text (first match wins)."""
+    if "pet_name" not in metadata:
+        match = _PATIENT_RE.search(text) or _TITLE_RE.search(text)
+        if match:
+            metadata["pet_name"] = match.group(1)
+    if "visit_id" not in metadata:
+        match = _VISIT_RE.search(text)
+        if match:
+            metadata["visit_id"] = (match.group(1) or match.group(2)).upper()
+    if "doc_date" not in metadata:
+        match = _DATE_RE.search(text)
+        date = parse_date(match.group(1)) if match else None
+        if date:
+            metadata["doc_date"] = date
+    return metadata
+
+
+def document_metadata(chunks: Iterable[str]) -> Dict:
+    """Metadata for a document from its chunks."""
+    metadata: Dict = {}
+    for text in chunks:
+        update_metadata(metadata, text)
+        if len(metadata) == len(DOC_FIELDS):
+            break
+    return metadata
+
+
+def chunk_metadata(chunk: Dict) -> Dict:
+    """The document metadata fields stored on a chunk row."""
+    return {f: chunk[f] for f in DOC_FIELDS if chunk.get(f)}
+
+
+def _key(value) -> str:
+    return str(value).strip().casefold()
+
+
+class MetadataIndex:
+    """Inverted index ``field -> value -> sorted row positions`` over a loaded store."""
+
+    def __init__(self, chunks: List[Dict]):
+        postings: Dict[str, Dict[str, List[int]]] = {f: {} for f in FILTER_FIELDS}
+        self._labels: Dict[str, Dict[str, str]] = {f: {} for f in FILTER_FIELDS}
+        for row, chunk in enumerate(chunks):
+            for field in FILTER_FIELDS:
+                value = chunk_doc_id(chunk) if field == "doc_id" else chunk.get(field)
+                if value:
+                    key = _key(value)
+                    postings[field].setdefault(key, []).append(row)
+                    self._labels[field].setdefault(key, str(value))
+        self.postings = {
+            field: {value: np.asarray(rows, dtype=np.int64) for value, rows in values.items()}
+            for field, values in postings.items()
+        }
+
+    def values(self, field: str) -> List[str]:
+        """Distinct values of ``field`` in the store, as first written."""
+        return sorted(self._labels[field].values())
+
+    def rows(self, filters: Optional[Dict]) -> Optional[np.ndarray]:
+        """Row positions matching every filter, or None when there is nothing to filter.
+
+        Each filter maps a field to one value or a list of accepted values
+        (case-insensitive). ``date_from``/``date_to`` bound ``doc_date``
+        inclusively with ISO dates.
+        """
+        filters = {f: v for f, v in (filters or {}).items() if v not in (None, "", [])}
+        if not filters:
+            return None
+        result: Optional[np.ndarray] = None
+        date_from = filters.pop("date_from", None)
+        date_to = filters.pop("date_to", None)
+        for field, wanted in filters.items():
+            if field not in self.postings:
+                raise ValueError(f"Unknown filter field {field!r}; expected one of {FILTER_FIELDS}")
+            values = wanted if isinstance(wanted, (list, tuple, set)) else [wanted]
+            result = self._intersect(result, [self.postings[field].get(_key(v)) for v in values])
+        if date_from or date_to:
+            dates = self.postings["doc_date"]
+            result = self._intersect(result, [
+                rows for date, rows in dates.items()
+                if (not date_from or date >= date_from) and (not date_to or date <= date_to)
+            ])
+        return result
+
+    @staticmethod
+    def _intersect(current: Optional[np.ndarray], postings: List[Optional[np.ndarray]]) -> np.ndarray:
+        matched = [p for p in postings if p is not None]
+        rows = np.unique(np.concatenate(matched)) if matched else np.zeros(0, dtype=np.int64)
+        return rows if current is None else np.intersect1d(current, rows, assume_unique=True)
@@ -0,0 +1,536 @@
+"""Binary, append-only segmented vector store.
+
+A store is a directory holding:
+
+- ``manifest.json`` -- format version, embedding dimension, live chunk count,
+  the ordered list of segments and the ids of deleted chunks
+- ``segments/seg-NNNNNN.f32``   -- contiguous row-major float32 matrix
+  (rows x dim) of unit-normalized embeddings
+- ``segments/seg-NNNNNN.jsonl`` -- one JSON object per row with ``id``,
+  ``text``, ``source``, ``doc_id``, ``hash`` (SHA-256 of the text) and any
+  document metadata (``pet_name``, ``visit_id``, ``doc_date``)
+
+Each ingest writes one new segment and then swaps the manifest, so adding a
+document costs I/O proportional to the document, not the store. Readers chain
+the segment memory maps and skip deleted ids. Compaction folds small segments
+together and physically drops deleted rows; it runs explicitly via ``compact_store`` or in a
+background thread via ``schedule_compaction``.
+
+Search indexes may keep per-segment files next to a segment
+(``segments/seg-NNNNNN.<ext>``); they are removed together with it.
+
+Segment matrices are memory-mapped on load. Legacy single-file JSON stores
+(``rag_store.json``) and version 1 single-matrix stores are converted on first
+access.
+"""
+
+import glob
+import hashlib
+import json
+import os
+import shutil
+import threading
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+from rag.index import SegmentedMatrix, normalize_rows
+
+STORE_VERSION = 2
+MANIFEST_FILE = "manifest.json"
+SEGMENTS_DIR = "segments"
+EMBEDDING_DTYPE = np.float32
+
+# Compaction policy: fold once there are more than this many segments, when
+# deleted rows make up this fraction of the store, and treat segments with
+# fewer rows than SMALL_SEGMENT_ROWS as candidates for folding.
+MAX_SEGMENTS = int(os.environ.get("RAG_MAX_SEGMENTS", "8"))
+MAX_DELETED_FRACTION = 0.2
+SMALL_SEGMENT_ROWS = 4096
+
+# Version 1 layout, kept for in-place upgrades.
+_V1_EMBEDDINGS_FILE = "embeddings.f32"
+_V1_CHUNKS_FILE = "chunks.jsonl"
+
+_locks: Dict[str, threading.RLock] = {}
+_locks_guard = threading.Lock()
+_compacting = set()
+
+
+def store_lock(store_dir: str) -> threading.RLock:
+    """In-process lock serializing manifest updates for one store directory."""
+    key = os.path.abspath(store_dir)
+    with _locks_guard:
+        if key not in _locks:
+            _locks[key] = threading.RLock()
+        return _locks[key]
+
+
+def content_hash(text: str) -> str:
+    """Content address of a chunk (hex SHA-256 of its text)."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def chunk_hash(chunk: Dict) -> str:
+    """Stored hash of a chunk row, computed for rows written before hashes existed."""
+    return chunk.get("hash") or content_hash(chunk["text"])
+
+
+def chunk_doc_id(chunk: Dict) -> str:
+    return chunk.get("doc_id") or chunk["source"]
+
+
+def document_index(chunks: Iterable[Dict]) -> Dict[str, Dict[str, List[int]]]:
+    """Map ``doc_id -> content hash -> [chunk ids]`` for the given live chunks."""
+    index: Dict[str, Dict[str, List[int]]] = {}
+    for c in chunks:
+        index.setdefault(chunk_doc_id(c), {}).setdefault(chunk_hash(c), []).append(c["id"])
+    return index
+
+
+def stale_chunk_ids(existing: Dict[str, List[int]], keep_hashes) -> List[int]:
+    """Ids of a document's stored chunks that a new version no longer needs.
+
+    That is every chunk whose hash is not in ``keep_hashes``, plus all but one
+    copy of any hash stored more than once.
+    """
+    stale = []
+    for h, ids in existing.items():
+        stale.extend(ids if h not in keep_hashes else ids[1:])
+    return stale
+
+
+def resolve_store_dir(path: str) -> str:
+    """Map a store path to its directory (``foo.json`` -> ``foo``)."""
+    root, ext = os.path.splitext(path)
+    return root if ext.lower() == ".json" else path
+
+
+def legacy_json_path(store_dir: str) -> str:
+    """Path of the legacy JSON store that migrates into ``store_dir``."""
+    return store_dir + ".json"
+
+
+def empty_store(dim: int = 0) -> Dict:
+    return {
+        "chunks": [],
+        "embeddings": np.zeros((0, dim), dtype=EMBEDDING_DTYPE),
+        "normalized": True,
+    }
+
+
+def _empty_manifest() -> Dict:
+    return {
+        "version": STORE_VERSION,
+        "dtype": "float32",
+        "dim": 0,
+        "count": 0,
+        "normalized": True,
+        "next_id": 0,
+        "next_segment": 0,
+        "segments": [],
+        "deleted": [],
+    }
+
+
+def _write_atomic(path: str, data: bytes) -> None:
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def _segment_path(store_dir: str, name: str, ext: str) -> str:
+    return os.path.join(store_dir, SEGMENTS_DIR, f"{name}.{ext}")
+
+
+def read_manifest(store_dir: str) -> Optional[Dict]:
+    path = os.path.join(store_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _write_manifest(store_dir: str, manifest: Dict) -> None:
+    manifest["count"] = sum(s["rows"] for s in manifest["segments"]) - len(manifest["deleted"])
+    _write_atomic(os.path.join(store_dir, MANIFEST_FILE), json.dumps(manifest).encode("utf-8"))
+
+
+def _write_segment(store_dir: str, manifest: Dict, chunks: List[Dict], embeddings: np.ndarray) -> Dict:
+    """Write a new segment file pair and return its manifest entry (manifest not saved)."""
+    os.makedirs(os.path.join(store_dir, SEGMENTS_DIR), exist_ok=True)
+    name = f"seg-{manifest['next_segment']:06d}"
+    manifest["next_segment"] += 1
+    embeddings = np.ascontiguousarray(embeddings, dtype=EMBEDDING_DTYPE)
+    _write_atomic(_segment_path(store_dir, name, "f32"), embeddings.tobytes())
+    lines = "".join(json.dumps(c, ensure_ascii=False) + "\n" for c in chunks)
+    _write_atomic(_segment_path(store_dir, name, "jsonl"), lines.encode("utf-8"))
+    return {"name": name, "rows": len(chunks)}
+
+
+def _remove_segment_files(store_dir: str, name: str) -> None:
+    """Remove a segment's matrix, chunk rows and any per-segment index files (``name.*``)."""
+    for path in glob.glob(os.path.join(store_dir, SEGMENTS_DIR, glob.escape(name) + ".*")):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def _prepare(chunks: List[Dict], embeddings, normalized: bool) -> np.ndarray:
+    if not normalized:
+        embeddings = normalize_rows(embeddings)
+    embeddings = np.asarray(embeddings, dtype=EMBEDDING_DTYPE)
+    if embeddings.ndim != 2 or embeddings.shape[0] != len(chunks):
+        raise ValueError(
+            f"Got {len(chunks)} chunks but embeddings of shape {embeddings.shape}"
+        )
+    return embeddings
+
+
+def migrate_legacy_json(json_path: str, store_dir: str) -> int:
+    """Convert a legacy ``{"chunks": [{..., "embedding": [...]}]}`` file."""
+    with open(json_path, "r", encoding="utf-8") as f:
+        legacy = json.load(f)
+    items = legacy.get("chunks", [])
+    chunks = [{"text": c["text"], "source": c["source"]} for c in items]
+    if items:
+        embeddings = np.asarray([c["embedding"] for c in items], dtype=EMBEDDING_DTYPE)
+    else:
+        embeddings = np.zeros((0, 0), dtype=EMBEDDING_DTYPE)
+    write_store({"chunks": chunks, "embeddings": embeddings}, store_dir)
+    return len(chunks)
+
+
+def _upgrade_v1(store_dir: str, manifest: Dict) -> None:
+    """Move a version 1 single-matrix store into one segment."""
+    with open(os.path.join(store_dir, _V1_CHUNKS_FILE), "r", encoding="utf-8") as f:
+        chunks = [json.loads(line) for line in f if line.strip()]
+    embeddings = open_embeddings(
+        os.path.join(store_dir, _V1_EMBEDDINGS_FILE), manifest["count"], manifest["dim"]
+    )
+    write_store(
+        {"chunks": chunks, "embeddings": embeddings, "normalized": manifest.get("normalized", False)},
+        store_dir,
+    )
+    for name in (_V1_EMBEDDINGS_FILE, _V1_CHUNKS_FILE):
+        os.remove(os.path.join(store_dir, name))
+
+
+def ensure_migrated(store_dir: str) -> None:
+    """Bring ``store_dir`` to the current layout, importing a legacy JSON store if present."""
+    manifest = read_manifest(store_dir)
+    if manifest is not None and manifest.get("version") == STORE_VERSION:
+        return
+    with store_lock(store_dir):
+        manifest = read_manifest(store_dir)
+        if manifest is None:
+            json_path = legacy_json_path(store_dir)
+            if os.path.isfile(json_path):
+                migrate_legacy_json(json_path, store_dir)
+        elif manifest.get("version") == 1:
+            _upgrade_v1(store_dir, manifest)
+
+
+def count_chunks(path: str) -> int:
+    """Number of live chunks, read from the manifest without touching vectors."""
+    store_dir = resolve_store_dir(path)
+    ensure_migrated(store_dir)
+    manifest = read_manifest(store_dir)
+    return manifest["count"] if manifest else 0
+
+
+def open_embeddings(path: str, rows: int, dim: int) -> np.ndarray:
+    """Memory-map an embedding matrix file read-only."""
+    if rows == 0 or dim == 0:
+        return np.zeros((0, dim), dtype=EMBEDDING_DTYPE)
+    return np.memmap(path, dtype=EMBEDDING_DTYPE, mode="r", shape=(rows, dim))
+
+
+def read_segment_chunks(store_dir: str, segment: Dict) -> List[Dict]:
+    """Chunk rows of one segment (deleted ones included)."""
+    with open(_segment_path(store_dir, segment["name"], "jsonl"), "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _read_segment(store_dir: str, segment: Dict, dim: int):
+    chunks = read_segment_chunks(store_dir, segment)
+    embeddings = open_embeddings(_segment_path(store_dir, segment["name"], "f32"), segment["rows"], dim)
+    return chunks, embeddings
+
+
+def _merge_segments(store_dir: str, manifest: Dict, segments: Iterable[Dict], deleted: set) -> Dict:
+    """Chain segments in order, skipping deleted ids, without copying their matrices."""
+    dim = manifest["dim"]
+    chunks: List[Dict] = []
+    parts = []
+    for segment in segments:
+        seg_chunks, seg_embeddings = _read_segment(store_dir, segment, dim)
+        keep = None
+        if deleted:
+            live = [i for i, c in enumerate(seg_chunks) if c["id"] not in deleted]
+            if len(live) < len(seg_chunks):
+                seg_chunks = [seg_chunks[i] for i in live]
+                keep = np.asarray(live, dtype=np.int64)
+        if seg_chunks:
+            chunks.extend(seg_chunks)
+            parts.append((seg_embeddings, keep))
+    if not parts:
+        embeddings = np.zeros((0, dim), dtype=EMBEDDING_DTYPE)
+    elif len(parts) == 1 and parts[0][1] is None:
+        embeddings = parts[0][0]
+    else:
+        embeddings = SegmentedMatrix(parts, dim)
+    return {"chunks": chunks, "embeddings": embeddings, "normalized": True}
+
+
+def read_store(path: str) -> Dict:
+    """Load live chunks and their embeddings merged across segments.
+
+    A single-segment store returns the memory-mapped matrix itself; multiple
+    segments (or a segment with deleted rows) return a ``SegmentedMatrix`` over
+    the per-segment memory maps, so nothing is concatenated in memory.
+    """
+    store_dir = resolve_store_dir(path)
+    ensure_migrated(store_dir)
+    for attempt in range(3):
+        manifest = read_manifest(store_dir)
+        if manifest is None:
+            return empty_store()
+        try:
+            return _merge_segments(store_dir, manifest, manifest["segments"], set(manifest["deleted"]))
+        except FileNotFoundError:
+            # A compaction swapped the manifest and removed old segments
+            # between our manifest read and the segment reads; try again.
+            if attempt == 2:
+                raise
+
+
+def list_chunks(path: str) -> List[Dict]:
+    """Live chunk metadata (``id``, ``text``, ``source``) without opening any vectors."""
+    store_dir = resolve_store_dir(path)
+    ensure_migrated(store_dir)
+    for attempt in range(3):
+        manifest = read_manifest(store_dir)
+        if manifest is None:
+            return []
+        deleted = set(manifest["deleted"])
+        try:
+            return [
+                c
+                for segment in manifest["segments"]
+                for c in read_segment_chunks(store_dir, segment)
+                if c["id"] not in deleted
+            ]
+        except FileNotFoundError:
+            if attempt == 2:
+                raise
+
+
+def read_embeddings(path: str, ids: List[int]) -> np.ndarray:
+    """Stored (unit-normalized) vectors of the chunks ``ids``, in that order.
+
+    Only the rows of those chunks are read from the segment files.
+    """
+    store_dir = resolve_store_dir(path)
+    ensure_migrated(store_dir)
+    slots = {int(chunk_id): slot for slot, chunk_id in enumerate(ids)}
+    for attempt in range(3):
+        manifest = read_manifest(store_dir)
+        dim = manifest["dim"] if manifest else 0
+        out = np.zeros((len(slots), dim), dtype=EMBEDDING_DTYPE)
+        found = 0
+        try:
+            for segment in (manifest["segments"] if manifest else []):
+                rows, targets = [], []
+                for row, c in enumerate(read_segment_chunks(store_dir, segment)):
+                    if c["id"] in slots:
+                        rows.append(row)
+                        targets.append(slots[c["id"]])
+                if rows:
+                    matrix = open_embeddings(_segment_path(store_dir, segment["name"], "f32"), segment["rows"], dim)
+                    out[targets] = matrix[rows]
+                    found += len(rows)
+                if found == len(slots):
+                    break
+        except FileNotFoundError:
+            if attempt == 2:
+                raise
+            continue
+        if found < len(slots):
+            raise KeyError(f"{len(slots) - found} chunk ids are not in the store")
+        return out
+
+
+def write_store(store: Dict, path: str) -> None:
+    """Replace the whole store with a single segment.
+
+    Embeddings are normalized to unit length on write unless the store says
+    they already are, so search never has to renormalize the stored matrix.
+    """
+    store_dir = resolve_store_dir(path)
+    with store_lock(store_dir):
+        chunks = store["chunks"]
+        embeddings = _prepare(chunks, store["embeddings"], store.get("normalized", False))
+        old = read_manifest(store_dir)
+        manifest = _empty_manifest()
+        if old is not None and old.get("version") == STORE_VERSION:
+            manifest["next_segment"] = old["next_segment"]
+            manifest["next_id"] = old["next_id"]
+        manifest["dim"] = int(embeddings.shape[1])
+        rows = []
+        for c in chunks:
+            rows.append({**c, "id": manifest["next_id"]})
+            manifest["next_id"] += 1
+        os.makedirs(store_dir, exist_ok=True)
+        if rows:
+            manifest["segments"].append(_write_segment(store_dir, manifest, rows, embeddings))
+        _write_manifest(store_dir, manifest)
+        if old is not None and old.get("version") == STORE_VERSION:
+            for segment in old["segments"]:
+                _remove_segment_files(store_dir, segment["name"])
+
+
+def append_chunks(path: str, chunks: List[Dict], embeddings, normalized: bool = False) -> List[int]:
+    """Append chunks as a new segment and return their ids.
+
+    Only the new segment and the manifest are written.
+    """
+    if not chunks:
+        return []
+    store_dir = resolve_store_dir(path)
+    ensure_migrated(store_dir)
+    embeddings = _prepare(chunks, embeddings, normalized)
+    with store_lock(store_dir):
+        manifest = read_manifest(store_dir) or _empty_manifest()
+        dim = int(embeddings.shape[1])
+        if manifest["count"] and manifest["dim"] != dim:
+            raise ValueError(f"Embedding dimension {dim} does not match store dimension {manifest['dim']}")
+        manifest["dim"] = dim
+        ids = list(range(manifest["next_id"], manifest["next_id"] + len(chunks)))
+        manifest["next_id"] += len(chunks)
+        rows = [{**c, "id": i} for c, i in zip(chunks, ids)]
+        os.makedirs(store_dir, exist_ok=True)
+        manifest["segments"].append(_write_segment(store_dir, manifest, rows, embeddings))
+        _write_manifest(store_dir, manifest)
+    return ids
+
+
+def delete_chunks(path: str, ids: Iterable[int]) -> int:
+    """Mark chunk ids as deleted. Rows are dropped from disk on the next compaction."""
+    store_dir = resolve_store_dir(path)
+    ensure_migrated(store_dir)
+    with store_lock(store_dir):
+        manifest = read_manifest(store_dir)
+        if manifest is None:
+            return 0
+        deleted = set(manifest["deleted"])
+        new = set(ids) - deleted
+        if not new:
+            return 0
+        manifest["deleted"] = sorted(deleted | new)
+        _write_manifest(store_dir, manifest)
+    return len(new)
+
+
+def delete_document(path: str, doc_id: str) -> int:
+    """Mark every chunk of document ``doc_id`` as deleted."""
+    return delete_chunks(path, [c["id"] for c in list_chunks(path) if chunk_doc_id(c) == doc_id])
+
+
+def needs_compaction(manifest: Optional[Dict]) -> bool:
+    if not manifest or not manifest["segments"]:
+        return False
+    total = sum(s["rows"] for s in manifest["segments"])
+    if total and len(manifest["deleted"]) / total >= MAX_DELETED_FRACTION:
+        return True
+    return len(manifest["segments"]) > MAX_SEGMENTS
+
+
+def compact_store(path: str, force: bool = False) -> bool:
+    """Fold small segments together and drop deleted rows.
+
+    Segments with deleted rows or fewer than ``SMALL_SEGMENT_ROWS`` rows are
+    merged into one new segment; with ``force`` every segment is merged. The
+    merge itself runs without holding the store lock, so ingests can continue;
+    only the manifest swap is serialized. Returns True if anything changed.
+    """
+    store_dir = resolve_store_dir(path)
+    ensure_migrated(store_dir)
+    lock = store_lock(store_dir)
+    with lock:
+        manifest = read_manifest(store_dir)
+        if manifest is None or (not force and not needs_compaction(manifest)):
+            return False
+    deleted = set(manifest["deleted"])
+    victims = []
+    victim_ids = set()
+    for segment in manifest["segments"]:
+        seg_ids = {c["id"] for c in read_segment_chunks(store_dir, segment)}
+        if force or (seg_ids & deleted) or segment["rows"] < SMALL_SEGMENT_ROWS:
+            victims.append(segment)
+            victim_ids |= seg_ids
+    dropped = victim_ids & deleted
+    if not victims or (len(victims) == 1 and not dropped):
+        return False
+
+    merged = _merge_segments(store_dir, manifest, victims, deleted)
+    with lock:
+        current = read_manifest(store_dir)
+        if current is None:
+            return False
+        current_names = [s["name"] for s in current["segments"]]
+        victim_names = {v["name"] for v in victims}
+        if not victim_names.issubset(current_names):
+            return False  # the store was rewritten meanwhile
+        replacement = []
+        if merged["chunks"]:
+            replacement.append(_write_segment(store_dir, current, merged["chunks"], merged["embeddings"]))
+        segments = []
+        for segment in current["segments"]:
+            if segment["name"] in victim_names:
+                segments.extend(replacement)
+                replacement = []
+            else:
+                segments.append(segment)
+        current["segments"] = segments
+        current["deleted"] = sorted(set(current["deleted"]) - dropped)
+        _write_manifest(store_dir, current)
+    for name in victim_names:
+        _remove_segment_files(store_dir, name)
+    return True
+
+
+def schedule_compaction(path: str) -> Optional[threading.Thread]:
+    """Start a background compaction if the store needs one and none is running."""
+    store_dir = resolve_store_dir(path)
+    key = os.path.abspath(store_dir)
+    if not needs_compaction(read_manifest(store_dir)):
+        return None
+    with _locks_guard:
+        if key in _compacting:
+            return None
+        _compacting.add(key)
+
+    def run():
+        try:
+            compact_store(path)
+        finally:
+            with _locks_guard:
+                _compacting.discard(key)
+
+    thread = threading.Thread(target=run, name=f"compact-{os.path.basename(key)}", daemon=True)
+    thread.start()
+    return thread
+
+
+def delete_store(path: str) -> None:
+    """Remove the store directory and any legacy JSON file it was migrated from."""
+    store_dir = resolve_store_dir(path)
+    with store_lock(store_dir):
+        if os.path.isdir(store_dir):
+            shutil.rmtree(store_dir)
+        json_path = legacy_json_path(store_dir)
+        if os.path.isfile(json_path):
+            os.remove(json_path)
@@ -1,99 +1,359 @@
 
 import os
-import json
-import math
-from typing import List, Dict
-from openai import OpenAI
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, List, Dict
+import numpy as np
+from rag import ann
+from rag import lexical
+from rag import metadata as doc_metadata
+from rag import quantize
+from rag import store as vector_store
+from rag.chunking import iter_chunks
+from rag.index import normalize_rows
+from rag.cache import store_cache
+from rag.client import get_client, set_client
+from rag.embeddings import embed_batched
+from rag.embedding_cache import get_embedding_cache
 
-DEFAULT_STORE_PATH = os.environ.get("RAG_STORE_PATH", "rag_store.json")
-
-def get_client():
-    return OpenAI()
+DEFAULT_STORE_PATH = os.environ.get("RAG_STORE_PATH", "rag_store")
 
 EMBED_MODEL = os.environ.get("EMBED_MODEL", "text-embedding-3-small")
+# Chunks handed to the embedder at a time while a document is still being read.
+STREAM_EMBED_BATCH = 64
+# "vector", "hybrid" (BM25 + vector, rank-fused), "lexical" (BM25 only) or
+# "prefilter" (vectors scored only for the top BM25 candidates).
+SEARCH_MODES = ("vector", "hybrid", "lexical", "prefilter")
+SEARCH_MODE = os.environ.get("RAG_SEARCH_MODE", "vector")
 
 def chunk_markdown(text: str, target_size: int = 1000, overlap: int = 150) -> List[str]:
-    paras = [p.strip() for p in text.split("\n\n") if p.strip()]
-    chunks = []
-    current = ""
-    for p in paras:
-        if len(current) + len(p) + 2 <= target_size:
-            current = (current + "\n\n" + p).strip()
-        else:
-            if current:
-                chunks.append(current)
-                tail = current[-overlap:] if overlap > 0 else ""
-                current = (tail + "\n\n" + p).strip()
-            else:
-                start = 0
-                while start < len(p):
-                    end = min(start + target_size, len(p))
-                    slice_ = p[start:end]
-                    chunks.append(slice_)
-                    if overlap > 0 and end < len(p):
-                        start = end - overlap
-                    else:
-                        start = end
-                current = ""
-    if current:
-        chunks.append(current)
-    return chunks
+    return list(iter_chunks([text], target_size=target_size, overlap=overlap))
 
 def cosine_similarity(a: List[float], b: List[float]) -> float:
-    dot = 0.0
-    na = 0.0
-    nb = 0.0
-    for x, y in zip(a, b):
-        dot += x * y
-        na += x * x
-        nb += y * y
-    if na == 0 or nb == 0:
-        return 0.0
-    return dot / (math.sqrt(na) * math.sqrt(nb))
+    a = normalize_rows(np.asarray(a, dtype=np.float32))
+    b = normalize_rows(np.asarray(b, dtype=np.float32))
+    return float(a @ b)
 
 def load_store(path: str = DEFAULT_STORE_PATH) -> Dict:
-    if os.path.exists(path):
-        with open(path, "r", encoding="utf-8") as f:
-            return json.load(f)
-    return {"chunks": []}
+    """Return {"chunks": [{"id", "text", "source", "doc_id", "hash", "pet_name"?, "visit_id"?, "doc_date"?}, ...], "embeddings": float32 matrix, "normalized": bool}.
+
+    The result comes from the process-wide store cache and is shared between
+    callers; treat it as read-only.
+    """
+    return store_cache.get(path)["store"]
 
 def save_store(store: Dict, path: str = DEFAULT_STORE_PATH) -> None:
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(store, f, ensure_ascii=False)
+    vector_store.write_store(store, path)
+    store_cache.invalidate(path)
+
+def store_cache_stats() -> Dict:
+    """Hit/miss counters of the process-wide store cache."""
+    return store_cache.stats()
+
+def store_count(path: str = DEFAULT_STORE_PATH) -> int:
+    """Number of indexed chunks, read without loading any embeddings."""
+    return vector_store.count_chunks(path)
 
 def clear_store(path: str = DEFAULT_STORE_PATH) -> None:
-    if os.path.exists(path):
-        os.remove(path)
+    vector_store.delete_store(path)
+    store_cache.invalidate(path)
 
 def embed_texts(texts: List[str]):
-    client = get_client()
-    resp = client.embeddings.create(model=EMBED_MODEL, input=texts)
-    return [d.embedding for d in resp.data]
+    """Embed texts in token/count-bounded concurrent batches, retrying transient errors.
+
+    Vectors already in the persistent embedding cache (same model, same text)
+    are reused; only the rest are sent to the API, each distinct text once.
+    """
+    cache = get_embedding_cache()
+    if cache is None:
+        return embed_batched(get_client(), texts, EMBED_MODEL)
+    result = cache.get_many(EMBED_MODEL, texts)
+    missing = list(dict.fromkeys(t for t, v in zip(texts, result) if v is None))
+    if missing:
+        fresh = dict(zip(missing, embed_batched(get_client(), missing, EMBED_MODEL)))
+        cache.put_many(EMBED_MODEL, missing, [fresh[t] for t in missing])
+        result = [v if v is not None else fresh[t] for t, v in zip(texts, result)]
+    return result
+
+def embedding_cache_stats() -> Dict:
+    """Hit/miss counters and size of the persistent embedding cache (empty if disabled)."""
+    cache = get_embedding_cache()
+    return cache.stats() if cache else {}
 
 def add_document_to_store(filename: str, content: str, store_path: str = DEFAULT_STORE_PATH) -> int:
-    store = load_store(store_path)
-    chunks = chunk_markdown(content)
-    if not chunks:
-        return 0
-    embeddings = embed_texts(chunks)
-    for text, emb in zip(chunks, embeddings):
-        store["chunks"].append({
-            "text": text,
-            "source": os.path.basename(filename),
-            "embedding": emb
+    return add_document_stream(filename, [content], store_path=store_path)
+
+def add_document_stream(filename: str, stream: Iterable[str], store_path: str = DEFAULT_STORE_PATH) -> int:
+    """Chunk and index a document read incrementally from ``stream``; returns its chunk count."""
+    return reindex_document(filename, stream, store_path=store_path)["chunks"]
+
+def reindex_document(filename: str, stream: Iterable[str], store_path: str = DEFAULT_STORE_PATH,
+                     doc_id: str = None) -> Dict:
+    """Index a (new or edited) document, touching only chunks that changed.
+
+    Every chunk is addressed by the hash of its text and belongs to the
+    document id ``doc_id``: the file's path relative to the documents root, as
+    ``rag.ingest`` assigns it (a file at the root keeps its bare name). An
+    upload only knows the file name, so by default the document takes the id
+    of the stored document with that file name when exactly one exists, and
+    the bare name otherwise; re-uploading an edited file replaces its chunks
+    wherever it was ingested from. Chunks already stored for this document are
+    kept as-is, only new or changed chunks are embedded and appended, and
+    stored chunks that no longer appear are deleted. Repeated chunks within a
+    document are stored once.
+
+    Every chunk row also carries the document's metadata (pet name, visit id,
+    date) extracted from its header. If that metadata changed, unchanged
+    chunks are re-written with the new metadata and their stored embeddings
+    (counted as "rewritten", not "removed").
+
+    Chunks are sent for embedding in batches while the rest of the stream is
+    still being read.
+    """
+    source = os.path.basename(filename)
+    stored = vector_store.list_chunks(store_path)
+    if doc_id is None:
+        named = {vector_store.chunk_doc_id(c) for c in stored if c.get("source") == source}
+        doc_id = named.pop() if len(named) == 1 else source
+    chunks = {c["id"]: c for c in stored if vector_store.chunk_doc_id(c) == doc_id}
+    existing = vector_store.document_index(chunks.values()).get(doc_id, {})
+    meta, seen, rows, futures, batch = {}, set(), [], [], []
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        for chunk in iter_chunks(stream):
+            doc_metadata.update_metadata(meta, chunk)
+            h = vector_store.content_hash(chunk)
+            if h in seen:
+                continue
+            seen.add(h)
+            if h in existing:
+                continue
+            batch.append({"text": chunk, "source": source, "doc_id": doc_id, "hash": h})
+            if len(batch) >= STREAM_EMBED_BATCH:
+                futures.append(pool.submit(embed_texts, [r["text"] for r in batch]))
+                rows.extend(batch)
+                batch = []
+        if batch:
+            futures.append(pool.submit(embed_texts, [r["text"] for r in batch]))
+            rows.extend(batch)
+        embeddings = [emb for f in futures for emb in f.result()]
+    added = len(rows)
+    stale = vector_store.stale_chunk_ids(existing, seen)
+    removed = len(stale)
+    for row in rows:
+        row.update(meta)
+    if existing and doc_metadata.chunk_metadata(next(iter(chunks.values()))) != meta:
+        # Same text, new metadata: re-append the kept chunks with their stored vectors.
+        kept = [(h, ids[0]) for h, ids in existing.items() if h in seen]
+        vectors = vector_store.read_embeddings(store_path, [chunk_id for _, chunk_id in kept])
+        for (h, chunk_id), vector in zip(kept, vectors):
+            rows.append({"text": chunks[chunk_id]["text"], "source": source, "doc_id": doc_id, "hash": h, **meta})
+            embeddings.append(vector)
+            stale.append(chunk_id)
+    if rows:
+        add_chunks_to_store(rows, embeddings, store_path)
+    if stale:
+        vector_store.delete_chunks(store_path, stale)
+        store_cache.invalidate(store_path)
+        vector_store.schedule_compaction(store_path)
+    return {
+        "chunks": len(seen),
+        "added": added,
+        "unchanged": len(seen) - added,
+        "removed": removed,
+        "rewritten": len(stale) - removed,
+    }
+
+def add_chunks_to_store(rows: List[Dict], embeddings, store_path: str = DEFAULT_STORE_PATH) -> List[int]:
+    """Append pre-embedded chunk rows ({"text", "source", "doc_id", "hash", ...metadata}) as one segment and return their ids."""
+    # Appends one segment; the rest of the store is not rewritten.
+    ids = vector_store.append_chunks(store_path, rows, embeddings)
+    store_cache.invalidate(store_path)
+    vector_store.schedule_compaction(store_path)
+    return ids
+
+def remove_document_from_store(doc_id: str, store_path: str = DEFAULT_STORE_PATH) -> int:
+    """Delete every chunk of the document ``doc_id``. Space is reclaimed by the next compaction."""
+    removed = vector_store.delete_document(store_path, doc_id)
+    store_cache.invalidate(store_path)
+    vector_store.schedule_compaction(store_path)
+    return removed
+
+def compact_store(store_path: str = DEFAULT_STORE_PATH) -> bool:
+    """Merge all segments and drop deleted chunks now."""
+    changed = vector_store.compact_store(store_path, force=True)
+    store_cache.invalidate(store_path)
+    return changed
+
+def build_ann_index(store_path: str = DEFAULT_STORE_PATH, nlist: int = None) -> Dict:
+    """Train and persist an IVF index over the current store; search() uses it from then on."""
+    ivf = ann.build_index(vector_store.resolve_store_dir(store_path), nlist=nlist)
+    store_cache.invalidate(store_path)
+    return {"nlist": ivf.nlist, "indexed": len(ivf)}
+
+def ann_recall(store_path: str = DEFAULT_STORE_PATH, k: int = 10, nprobe: int = ann.DEFAULT_NPROBE,
+               queries: List[str] = None, sample: int = 100) -> float:
+    """recall@k of ANN search against exact search.
+
+    Uses the given query strings, or a random sample of stored chunk vectors.
+    """
+    cached = store_cache.get(store_path)
+    if cached["ann"] is None:
+        raise ValueError("No ANN index for this store; call build_ann_index() first")
+    if queries:
+        vectors = np.asarray(embed_texts(queries), dtype=np.float32)
+    else:
+        vectors = cached["index"].vectors
+        rows = np.random.default_rng(0).choice(len(vectors), size=min(sample, len(vectors)), replace=False)
+        vectors = vectors[np.sort(rows)]
+    return ann.recall_at_k(cached["ann"], vectors, k, nprobe)
+
+def quantization_report(store_path: str = DEFAULT_STORE_PATH, k: int = 10, queries: List[str] = None,
+                        sample: int = 100) -> List[Dict]:
+    """Memory and recall@k of each quantized mode against exact float32 search.
+
+    Uses the given query strings, or a random sample of stored chunk vectors.
+    Returns one row per mode: {"mode", "bytes", "resident_bytes",
+    "float32_bytes", "saved_bytes", "saved_fraction", "recall", "ms_per_query"}.
+    ``bytes`` is the quantized copy; ``resident_bytes`` adds any float32 rows
+    held in the heap rather than memory-mapped, and the saving is measured
+    against it.
+    """
+    cached = store_cache.get(store_path)
+    if queries:
+        vectors = np.asarray(embed_texts(queries), dtype=np.float32)
+    else:
+        vectors = cached["index"].vectors
+        rows = np.random.default_rng(0).choice(len(vectors), size=min(sample, len(vectors)), replace=False)
+        vectors = np.asarray(vectors[np.sort(rows)], dtype=np.float32)
+    report = []
+    for mode in quantize.MODES:
+        quantized = quantize.get_quantized(cached, mode)
+        start = time.perf_counter()
+        for q in vectors:
+            quantized.search(q, k)
+        elapsed = time.perf_counter() - start
+        full = quantized.float32_nbytes
+        resident = quantized.resident_nbytes
+        report.append({
+            "mode": mode,
+            "bytes": quantized.nbytes,
+            "resident_bytes": resident,
+            "float32_bytes": full,
+            "saved_bytes": full - resident,
+            "saved_fraction": (full - resident) / full if full else 0.0,
+            "recall": quantize.recall_at_k(quantized, vectors, k),
+            "ms_per_query": elapsed * 1000 / len(vectors) if len(vectors) else 0.0,
         })
-    save_store(store, store_path)
-    return len(chunks)
+    return report
+
+def search(query: str, k: int = 4, store_path: str = DEFAULT_STORE_PATH,
+           nprobe: int = ann.DEFAULT_NPROBE, exact: bool = False,
+           quantization: str = quantize.QUANTIZE_MODE, filters: Dict = None,
+           mode: str = SEARCH_MODE):
+    """Top-k chunks for ``query``.
 
-def search(query: str, k: int = 4, store_path: str = DEFAULT_STORE_PATH):
-    store = load_store(store_path)
+    Vector scoring uses the ANN index when one has been built (``nprobe``
+    clusters probed). Otherwise, with ``quantization`` set to "float16" or
+    "int8" (default from RAG_QUANTIZE), candidates are picked on the quantized
+    vectors and rescored exactly in float32. ``exact=True`` always scores
+    every float32 vector.
+
+    ``mode`` (default from RAG_SEARCH_MODE) selects the ranking: "vector";
+    "lexical" (BM25 only, no embedding call); "hybrid", where the BM25 and
+    vector rankings are combined with reciprocal-rank fusion and ``score`` is
+    the fused score; or "prefilter", where only the top BM25 candidates are
+    scored against the query vector (falling back to vector search when no
+    query term is indexed).
+
+    ``filters`` (e.g. ``{"pet_name": "Daisy"}``, ``{"visit_id": [...]}``,
+    ``{"date_from": "2025-01-01"}``) are resolved through the metadata index
+    first and only the matching chunks are scored, exactly.
+    """
+    _check_mode(mode)
+    cached = store_cache.get(store_path)
+    store = cached["store"]
     if not store["chunks"]:
         return []
-    client = get_client()
-    q_emb = client.embeddings.create(model=EMBED_MODEL, input=[query]).data[0].embedding
-    scored = []
-    for item in store["chunks"]:
-        score = cosine_similarity(q_emb, item["embedding"])
-        scored.append((score, item))
-    scored.sort(key=lambda x: x[0], reverse=True)
-    return [{"score": float(s), "text": c["text"], "source": c["source"]} for s, c in scored[:k]]
+    rows = cached["metadata"].rows(filters)
+    if rows is not None and len(rows) == 0:
+        return []
+    q_emb = embed_texts([query])[0] if mode != "lexical" else None
+    order, scores = _rank(cached, store_path, query, q_emb, k, rows, mode, nprobe, exact, quantization)
+    return _hits(store["chunks"], order, scores)
+
+def search_many(queries: List[str], k: int = 4, store_path: str = DEFAULT_STORE_PATH,
+                nprobe: int = ann.DEFAULT_NPROBE, exact: bool = False,
+                quantization: str = quantize.QUANTIZE_MODE, filters: Dict = None,
+                mode: str = SEARCH_MODE) -> List[List[Dict]]:
+    """Top-k chunks for each query, in query order.
+
+    All queries are embedded through one batched embed_texts call. Exact
+    vector scoring is a single matrix-matrix product against the store; with
+    an ANN index or a non-vector ``mode`` each query is ranked on its own.
+    ``quantization``, ``filters`` and ``mode`` work as in search().
+    """
+    _check_mode(mode)
+    if not queries:
+        return []
+    cached = store_cache.get(store_path)
+    store, index = cached["store"], cached["index"]
+    if not store["chunks"]:
+        return [[] for _ in queries]
+    rows = cached["metadata"].rows(filters)
+    if rows is not None and len(rows) == 0:
+        return [[] for _ in queries]
+    q_embs = embed_texts(queries) if mode != "lexical" else [None] * len(queries)
+    if mode != "vector" or (cached["ann"] is not None and not exact and rows is None):
+        return [
+            _hits(store["chunks"], *_rank(cached, store_path, q, e, k, rows, mode, nprobe, exact, quantization))
+            for q, e in zip(queries, q_embs)
+        ]
+    if rows is not None:
+        orders, scores = index.search_many(q_embs, k, rows=rows)
+    elif quantize.resolve_mode(quantization) and not exact:
+        orders, scores = quantize.get_quantized(cached, quantization).search_many(q_embs, k)
+    else:
+        orders, scores = index.search_many(q_embs, k)
+    return [_hits(store["chunks"], o, s) for o, s in zip(orders, scores)]
+
+def _check_mode(mode: str) -> None:
+    if mode not in SEARCH_MODES:
+        raise ValueError(f"Unknown search mode {mode!r}; expected one of {SEARCH_MODES}")
+
+def _vector_search(cached: Dict, q_emb, k: int, rows, nprobe: int, exact: bool, quantization: str):
+    if rows is not None:
+        return cached["index"].search(q_emb, k, rows=rows)
+    if cached["ann"] is not None and not exact:
+        return cached["ann"].search(q_emb, k, nprobe=nprobe)
+    if quantize.resolve_mode(quantization) and not exact:
+        return quantize.get_quantized(cached, quantization).search(q_emb, k)
+    return cached["index"].search(q_emb, k)
+
+def _rank(cached: Dict, store_path: str, query: str, q_emb, k: int, rows, mode: str,
+          nprobe: int, exact: bool, quantization: str):
+    """``(row indices, scores)`` of the top k for one query under ``mode``."""
+    if mode == "vector":
+        return _vector_search(cached, q_emb, k, rows, nprobe, exact, quantization)
+    bm25 = lexical.get_searcher(cached, vector_store.resolve_store_dir(store_path))
+    if mode == "lexical":
+        return bm25.search(query, k, rows=rows)
+    if mode == "prefilter":
+        candidates, _ = bm25.search(query, lexical.PREFILTER_CANDIDATES, rows=rows)
+        if candidates.size:
+            return cached["index"].search(q_emb, k, rows=np.sort(candidates))
+        return _vector_search(cached, q_emb, k, rows, nprobe, exact, quantization)
+    depth = max(k, lexical.FUSION_DEPTH)
+    vector_order, _ = _vector_search(cached, q_emb, depth, rows, nprobe, exact, quantization)
+    lexical_order, _ = bm25.search(query, depth, rows=rows)
+    return lexical.reciprocal_rank_fusion([vector_order, lexical_order], k)
+
+def metadata_values(field: str, store_path: str = DEFAULT_STORE_PATH) -> List[str]:
+    """Distinct values of a metadata field (e.g. every indexed "pet_name")."""
+    return store_cache.get(store_path)["metadata"].values(field)
+
+def _hits(chunks: List[Dict], order, scores) -> List[Dict]:
+    return [
+        {"score": float(s), "text": chunks[i]["text"], "source": chunks[i]["source"],
+         "metadata": doc_metadata.chunk_metadata(chunks[i])}
+        for i, s in zip(order, scores)
+    ]
@@ -0,0 +1,95 @@
+"""Shared fixtures: a stub OpenAI client and throwaway stores and databases.
+
+The persistent caches default to files in the working directory, so they are
+pointed at a temporary directory before any repo module is imported.
+"""
+
+import hashlib
+import os
+import sys
+import tempfile
+import types
+
+import numpy as np
+import pytest
+
+_CACHE_DIR = tempfile.mkdtemp(prefix="rag-tests-")
+os.environ.setdefault("RAG_EMBED_CACHE_PATH", os.path.join(_CACHE_DIR, "embedding_cache.db"))
+os.environ.setdefault("AGENTIC_COMPLETION_CACHE_PATH", os.path.join(_CACHE_DIR, "completion_cache.db"))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import rag_utils  # noqa: E402
+from diagnostics import db  # noqa: E402
+
+EMBED_DIM = 64
+
+
+def stub_embedding(text: str) -> list:
+    """Deterministic vector; texts sharing words get similar vectors."""
+    seed = int(hashlib.sha256(text.encode("utf-8")).hexdigest()[:8], 16)
+    vector = np.random.default_rng(seed).standard_normal(EMBED_DIM) * 0.1
+    for word in text.lower().split():
+        vector[int(hashlib.sha256(word.encode("utf-8")).hexdigest()[:6], 16) % EMBED_DIM] += 1.0
+    return vector.tolist()
+
+
+class _Embeddings:
+    def __init__(self):
+        self.calls = 0
+        self.inputs = []
+
+    def create(self, model, input):
+        self.calls += 1
+        self.inputs.extend(input)
+        return types.SimpleNamespace(data=[types.SimpleNamespace(embedding=stub_embedding(t)) for t in input])
+
+
+class _Completions:
+    def __init__(self, reply):
+        self.reply = reply
+        self.calls = 0
+
+    def create(self, stream=False, **kwargs):
+        self.calls += 1
+        text = self.reply(kwargs)
+        if stream:
+            return iter([types.SimpleNamespace(choices=[types.SimpleNamespace(delta=types.SimpleNamespace(content=text))])])
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=types.SimpleNamespace(content=text))])
+
+
+class StubClient:
+    """Just enough of the OpenAI client for embeddings and chat completions."""
+
+    def __init__(self, reply=lambda kwargs: "stub answer"):
+        self.embeddings = _Embeddings()
+        self.chat = types.SimpleNamespace(completions=_Completions(reply))
+
+    def with_options(self, **kwargs):
+        return self
+
+
+@pytest.fixture
+def stub_client():
+    client = StubClient()
+    rag_utils.set_client(client)
+    yield client
+    rag_utils.set_client(None)
+
+
+@pytest.fixture
+def store_path(tmp_path):
+    path = str(tmp_path / "store")
+    yield path
+    rag_utils.store_cache.invalidate(path)
+
+
+@pytest.fixture
+def diag_db(tmp_path, monkeypatch):
+    """A seeded diagnostics database that get_db_path() points at."""
+    from diagnostics.seed import seed_database
+
+    path = str(tmp_path / "diagnostics.db")
+    monkeypatch.setattr(db, "DIAGNOSTICS_DB_PATH", path)
+    db.init_db(path)
+    seed_database()
+    return path
@@ -0,0 +1,103 @@
+import glob
+import os
+
+import numpy as np
+
+import rag_utils
+from rag import ann
+from rag import store as vector_store
+from rag.cache import store_cache
+from rag.index import VectorIndex
+
+
+def _clustered(n, dim=16, clusters=20, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim))
+    return (centers[rng.integers(0, clusters, n)] + 0.1 * rng.standard_normal((n, dim))).astype(np.float32)
+
+
+def _append(store_path, vectors, start=0):
+    chunks = [{"text": f"chunk {i}", "source": "a.md"} for i in range(start, start + len(vectors))]
+    return rag_utils.add_chunks_to_store(chunks, vectors, store_path)
+
+
+def test_probing_every_list_is_exact():
+    vectors = _clustered(500)
+    index = VectorIndex(vectors)
+    ivf = ann.IVFIndex.train(index.vectors, np.arange(500), nlist=16)
+    searcher = ann.IVFSearcher(ivf, index, np.arange(500))
+    queries = _clustered(20, seed=1)
+
+    assert len(ivf) == 500
+    assert ann.recall_at_k(searcher, queries, k=10, nprobe=16) == 1.0
+    assert ann.recall_at_k(searcher, queries, k=10, nprobe=4) >= 0.9
+
+
+def test_ivf_round_trips_through_a_file(tmp_path):
+    vectors = VectorIndex(_clustered(200)).vectors
+    ivf = ann.IVFIndex.train(vectors, np.arange(200), nlist=8)
+    ivf.build = 42
+    ivf.save(str(tmp_path / "ivf.npz"))
+
+    loaded = ann.IVFIndex.load(str(tmp_path / "ivf.npz"))
+
+    assert loaded.build == 42
+    assert np.allclose(loaded.centroids, ivf.centroids)
+    assert [list(ids) for ids in loaded.lists] == [list(ids) for ids in ivf.lists]
+
+
+def test_uploads_are_assigned_per_segment(store_path):
+    vectors = _clustered(900)
+    _append(store_path, vectors[:600])
+    stats = rag_utils.build_ann_index(store_path, nlist=16)
+    ivf_file = ann.ann_path(store_path)
+    built = os.stat(ivf_file).st_mtime_ns
+
+    _append(store_path, vectors[600:], start=600)
+    entry = store_cache.get(store_path)
+
+    assert stats == {"nlist": 16, "indexed": 600}
+    assert os.stat(ivf_file).st_mtime_ns == built
+    assert len(entry["ann"].ivf) == 900
+    assert entry["ann"].unindexed_rows.size == 0
+    assert sorted(os.path.basename(p) for p in glob.glob(os.path.join(store_path, "segments", "*.ivf.npz"))) == [
+        "seg-000000.ivf.npz", "seg-000001.ivf.npz"]
+    assert rag_utils.ann_recall(store_path, k=10, nprobe=16) == 1.0
+
+
+def test_compaction_and_rebuild_keep_every_live_chunk_indexed(store_path):
+    vectors = _clustered(400)
+    _append(store_path, vectors[:200])
+    rag_utils.build_ann_index(store_path, nlist=8)
+    _append(store_path, vectors[200:], start=200)
+    store_cache.get(store_path)
+    vector_store.delete_chunks(store_path, range(0, 400, 4))
+    rag_utils.compact_store(store_path)
+
+    entry = store_cache.get(store_path)
+    live = {c["id"] for c in entry["store"]["chunks"]}
+    assert live <= set(entry["ann"].ivf.indexed_ids().tolist())
+    assert entry["ann"].unindexed_rows.size == 0
+
+    # A rebuild changes the centroids; segment files of the old build are ignored
+    rag_utils.build_ann_index(store_path, nlist=4)
+    entry = store_cache.get(store_path)
+    assert entry["ann"].ivf.nlist == 4
+    assert sorted(entry["ann"].ivf.indexed_ids().tolist()) == sorted(live)
+    assert rag_utils.ann_recall(store_path, k=5, nprobe=4) == 1.0
+
+
+def test_chunks_unknown_to_the_index_are_scored_exactly(store_path):
+    vectors = _clustered(300)
+    _append(store_path, vectors[:200])
+    rag_utils.build_ann_index(store_path, nlist=8)
+    store = vector_store.read_store(store_path)
+    index = VectorIndex(store["embeddings"], normalized=True)
+    ivf = ann.IVFIndex.load(ann.ann_path(store_path))
+    ivf.lists = [ids[ids >= 50] for ids in ivf.lists]
+
+    searcher = ann.IVFSearcher(ivf, index, [c["id"] for c in store["chunks"]])
+
+    assert searcher.unindexed_rows.tolist() == list(range(50))
+    rows, _ = searcher.search(store["embeddings"][7], k=1, nprobe=1)
+    assert rows.tolist() == [7]
@@ -0,0 +1,73 @@
+import os
+
+import numpy as np
+
+from rag import store as vector_store
+
+
+def _append(store_path, start, n, source="a.md"):
+    chunks = [{"text": f"chunk {i}", "source": source, "doc_id": source} for i in range(start, start + n)]
+    vectors = np.random.default_rng(start).standard_normal((n, 4)).astype(np.float32)
+    return vector_store.append_chunks(store_path, chunks, vectors)
+
+
+def _segment_files(store_path):
+    return sorted(os.listdir(os.path.join(store_path, vector_store.SEGMENTS_DIR)))
+
+
+def test_delete_only_records_ids(store_path):
+    _append(store_path, 0, 4)
+    files = _segment_files(store_path)
+
+    assert vector_store.delete_chunks(store_path, [1, 2]) == 2
+    assert vector_store.delete_chunks(store_path, [2]) == 0
+
+    manifest = vector_store.read_manifest(store_path)
+    assert manifest["deleted"] == [1, 2]
+    assert manifest["count"] == 2
+    assert _segment_files(store_path) == files
+    assert [c["id"] for c in vector_store.list_chunks(store_path)] == [0, 3]
+
+
+def test_compaction_drops_deleted_rows_and_keeps_ids(store_path):
+    _append(store_path, 0, 3, source="a.md")
+    _append(store_path, 3, 3, source="b.md")
+    loaded = vector_store.read_store(store_path)
+    before = {c["id"]: np.asarray(row) for c, row in zip(loaded["chunks"], loaded["embeddings"])}
+    # A per-segment index file is removed together with its segment
+    open(os.path.join(store_path, vector_store.SEGMENTS_DIR, "seg-000000.bm25.npz"), "wb").close()
+    assert vector_store.delete_document(store_path, "a.md") == 3
+
+    assert vector_store.compact_store(store_path, force=True)
+
+    manifest = vector_store.read_manifest(store_path)
+    assert manifest["deleted"] == []
+    assert [s["rows"] for s in manifest["segments"]] == [3]
+    assert _segment_files(store_path) == ["seg-000002.f32", "seg-000002.jsonl"]
+    store = vector_store.read_store(store_path)
+    assert [c["id"] for c in store["chunks"]] == [3, 4, 5]
+    for c, row in zip(store["chunks"], store["embeddings"]):
+        assert np.allclose(row, before[c["id"]])
+    assert _append(store_path, 6, 1) == [6]
+
+
+def test_compaction_policy(store_path, monkeypatch):
+    monkeypatch.setattr(vector_store, "MAX_SEGMENTS", 2)
+    monkeypatch.setattr(vector_store, "SMALL_SEGMENT_ROWS", 3)
+    _append(store_path, 0, 5)
+    _append(store_path, 5, 2)
+    assert not vector_store.needs_compaction(vector_store.read_manifest(store_path))
+    assert not vector_store.compact_store(store_path)
+
+    _append(store_path, 7, 2)
+    assert vector_store.needs_compaction(vector_store.read_manifest(store_path))
+    assert vector_store.compact_store(store_path)
+    # Only the small segments were folded; the large one is untouched
+    assert [s["rows"] for s in vector_store.read_manifest(store_path)["segments"]] == [5, 4]
+
+    vector_store.delete_chunks(store_path, [0, 1])
+    assert vector_store.needs_compaction(vector_store.read_manifest(store_path))
+    assert vector_store.compact_store(store_path)
+    manifest = vector_store.read_manifest(store_path)
+    assert manifest["deleted"] == []
+    assert manifest["count"] == 7
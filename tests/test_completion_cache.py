@@ -0,0 +1,63 @@
+from agentic.completion_cache import CachedChat, CompletionCache, completion_key
+from conftest import StubClient
+
+MESSAGES = [{"role": "user", "content": "What is Daisy's ALT?"}]
+
+
+def _chat(tmp_path, replies, **kwargs):
+    replies = iter(replies)
+    client = StubClient(reply=lambda request: next(replies))
+    return client, CachedChat(client, CompletionCache(str(tmp_path / "completions.db"), **kwargs))
+
+
+def test_key_ignores_whitespace_but_not_settings():
+    spaced = [{"role": "user", "content": "  What is\nDaisy's   ALT? "}]
+
+    assert completion_key("m", MESSAGES, 0.2, 100) == completion_key("m", spaced, 0.2, 100)
+    assert completion_key("m", MESSAGES, 0.2, 100) != completion_key("m", MESSAGES, 0.3, 100)
+    assert completion_key("m", MESSAGES) != completion_key("m", [{"role": "system", "content": MESSAGES[0]["content"]}])
+
+
+def test_repeated_request_is_served_from_the_cache(tmp_path):
+    client, chat = _chat(tmp_path, ["first", "second"])
+
+    assert chat.complete("planner", model="m", messages=MESSAGES) == "first"
+    assert chat.complete("planner", model="m", messages=MESSAGES) == "first"
+    assert "".join(chat.stream("planner", model="m", messages=MESSAGES)) == "first"
+    assert client.chat.completions.calls == 1
+    assert chat.cache.stats()["steps"] == {"planner": {"hits": 2, "misses": 1}}
+
+
+def test_empty_completions_are_not_cached(tmp_path):
+    client, chat = _chat(tmp_path, ["  ", "answer"])
+
+    assert chat.complete("planner", model="m", messages=MESSAGES) == "  "
+    assert chat.complete("planner", model="m", messages=MESSAGES) == "answer"
+    assert client.chat.completions.calls == 2
+
+
+def test_refinement_retries_always_call_the_model(tmp_path):
+    client, chat = _chat(tmp_path, ["SELECT 1", "SELECT 2"])
+
+    assert chat.complete("sql_refine", model="m", messages=MESSAGES) == "SELECT 1"
+    assert chat.complete("sql_refine", model="m", messages=MESSAGES) == "SELECT 2"
+    assert chat.cache.stats()["entries"] == 0
+
+
+def test_entries_expire_after_ttl(tmp_path):
+    cache = CompletionCache(str(tmp_path / "completions.db"), ttl=-1)
+    cache.put("k", "planner", "m", "text")
+
+    assert cache.get("k", "planner") is None
+    assert cache.stats()["expired"] >= 1
+
+
+def test_least_recently_used_are_evicted(tmp_path):
+    cache = CompletionCache(str(tmp_path / "completions.db"), max_entries=2)
+    cache.put("a", "planner", "m", "A")
+    cache.put("b", "planner", "m", "B")
+    cache.get("a", "planner")
+    cache.put("c", "planner", "m", "C")
+
+    assert [cache.get(k, "planner") for k in "abc"] == ["A", None, "C"]
+    assert cache.stats()["evictions"] == 1
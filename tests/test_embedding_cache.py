@@ -0,0 +1,46 @@
+import uuid
+
+import numpy as np
+
+import rag_utils
+from rag.embedding_cache import EmbeddingCache
+
+
+def test_vectors_are_keyed_by_model_and_text(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "cache.db"))
+    cache.put_many("small", ["a", "b"], [[1.0, 2.0], [3.0, 4.0]])
+
+    assert cache.get_many("small", ["b", "c", "a", "b"]) == [[3.0, 4.0], None, [1.0, 2.0], [3.0, 4.0]]
+    assert cache.get_many("large", ["a"]) == [None]
+    assert (cache.stats()["hits"], cache.stats()["misses"]) == (3, 2)
+
+
+def test_entries_survive_reopening(tmp_path):
+    path = str(tmp_path / "cache.db")
+    EmbeddingCache(path).put_many("small", ["a"], np.ones((1, 3), dtype=np.float32))
+
+    assert EmbeddingCache(path).get_many("small", ["a"]) == [[1.0, 1.0, 1.0]]
+
+
+def test_least_recently_used_are_evicted(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "cache.db"), max_entries=2)
+    cache.put_many("small", ["a"], [[1.0]])
+    cache.put_many("small", ["b"], [[2.0]])
+    cache.get_many("small", ["a"])
+    cache.put_many("small", ["c"], [[3.0]])
+
+    assert cache.get_many("small", ["a", "b", "c"]) == [[1.0], None, [3.0]]
+    assert cache.stats()["evictions"] == 1
+    assert cache.stats()["entries"] == 2
+
+
+def test_embed_texts_only_sends_misses(stub_client):
+    seen, new = f"seen {uuid.uuid4()}", f"new {uuid.uuid4()}"
+    first = rag_utils.embed_texts([seen])
+    stub_client.embeddings.inputs.clear()
+
+    vectors = rag_utils.embed_texts([new, seen, new])
+
+    assert stub_client.embeddings.inputs == [new]
+    assert np.allclose(vectors[1], first[0])
+    assert np.allclose(vectors[0], vectors[2])
@@ -0,0 +1,87 @@
+import json
+import os
+
+from rag import store as vector_store
+from rag.ingest import Checkpoint, document_id, ingest_directory
+
+
+def _write(path, text):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text, encoding="utf-8")
+
+
+def _ingest(root, store_path, **kwargs):
+    return ingest_directory(str(root), store_path=store_path, workers=1, report=lambda *a: None, **kwargs)
+
+
+def _docs(store_path):
+    ids = {}
+    for c in vector_store.list_chunks(store_path):
+        ids.setdefault(vector_store.chunk_doc_id(c), []).append(c["text"])
+    return ids
+
+
+def test_document_id_is_relative_to_the_root(tmp_path):
+    assert document_id(str(tmp_path / "a.md"), str(tmp_path)) == "a.md"
+    assert document_id(str(tmp_path / "visits" / "a.md"), str(tmp_path)) == "visits/a.md"
+
+
+def test_rerun_skips_finished_files(stub_client, store_path, tmp_path):
+    root = tmp_path / "docs"
+    _write(root / "a.md", "# A\n\nalpha text")
+    _write(root / "visits" / "a.md", "# B\n\nbeta text")
+    _write(root / "skip.pdf", "not a transcript")
+
+    stats = _ingest(root, store_path)
+    calls = stub_client.embeddings.calls
+    again = _ingest(root, store_path)
+
+    assert (stats["files"], stats["skipped"]) == (2, 0)
+    assert (again["files"], again["skipped"]) == (0, 2)
+    assert stub_client.embeddings.calls == calls
+    assert sorted(_docs(store_path)) == ["a.md", "visits/a.md"]
+
+
+def test_changed_file_is_reingested(stub_client, store_path, tmp_path):
+    root = tmp_path / "docs"
+    _write(root / "a.md", "# A\n\nalpha text\n\n# B\n\nbeta text")
+    _ingest(root, store_path)
+
+    _write(root / "a.md", "# A\n\nalpha text\n\n# B\n\ngamma text, longer now")
+    stats = _ingest(root, store_path)
+
+    assert (stats["files"], stats["chunks"], stats["unchanged"], stats["removed"]) == (1, 1, 1, 1)
+    assert sorted(_docs(store_path)["a.md"]) == ["# A\n\nalpha text", "# B\n\ngamma text, longer now"]
+
+
+def test_in_flight_batch_is_replaced_on_resume(stub_client, store_path, tmp_path):
+    root = tmp_path / "docs"
+    _write(root / "a.md", "# A\n\nalpha text")
+    _write(root / "b.md", "# B\n\nbeta text")
+    _ingest(root, store_path)
+
+    # Simulate a run that stopped after appending b.md but before committing it
+    checkpoint_path = vector_store.resolve_store_dir(store_path) + ".ingest.json"
+    checkpoint = Checkpoint(checkpoint_path)
+    checkpoint.done.pop(os.path.abspath(root / "b.md"))
+    checkpoint.begin([str(root / "b.md")])
+
+    stats = _ingest(root, store_path)
+
+    assert (stats["files"], stats["skipped"]) == (1, 1)
+    assert _docs(store_path) == {"a.md": ["# A\n\nalpha text"], "b.md": ["# B\n\nbeta text"]}
+    with open(checkpoint_path, encoding="utf-8") as f:
+        saved = json.load(f)
+    assert saved["in_flight"] == []
+    assert sorted(saved["done"]) == sorted(os.path.abspath(root / name) for name in ("a.md", "b.md"))
+
+
+def test_restart_ignores_the_checkpoint(stub_client, store_path, tmp_path):
+    root = tmp_path / "docs"
+    _write(root / "a.md", "# A\n\nalpha text")
+    _ingest(root, store_path)
+
+    stats = _ingest(root, store_path, restart=True)
+
+    assert (stats["files"], stats["skipped"], stats["unchanged"]) == (1, 0, 1)
+    assert vector_store.count_chunks(store_path) == 1
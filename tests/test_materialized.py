@@ -0,0 +1,103 @@
+import os
+import sqlite3
+
+import pytest
+
+from diagnostics import db
+
+LIVE = "SELECT * FROM v_results_live ORDER BY result_id"
+MATERIALIZED = "SELECT * FROM mv_results ORDER BY result_id"
+
+
+@pytest.fixture
+def conn(diag_db):
+    connection = sqlite3.connect(diag_db)
+    yield connection
+    connection.close()
+
+
+def _view_source(conn):
+    sql = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'view' AND name = 'v_results'").fetchone()[0]
+    return sql.rstrip().rstrip(";").split()[-1]
+
+
+def _in_sync(conn):
+    return conn.execute(LIVE).fetchall() == conn.execute(MATERIALIZED).fetchall()
+
+
+def test_seeded_database_is_materialized(conn):
+    assert len(conn.execute(MATERIALIZED).fetchall()) == 18
+    assert _in_sync(conn)
+    assert _view_source(conn) == "mv_results"
+
+
+@pytest.mark.parametrize("statement", [
+    "UPDATE test_results SET value_num = 99.5, flag = 'H' WHERE result_id = 'RESULT010'",
+    "DELETE FROM test_results WHERE result_id = 'RESULT001'",
+    "UPDATE tests SET test_name = 'Complete Blood Count' WHERE test_id = 'TEST001'",
+    "UPDATE visits SET visit_datetime = '2024-01-01T09:00:00' WHERE visit_id = 'VISIT001'",
+    "UPDATE pets SET name = 'Daisy Mae' WHERE pet_id = 'PET001'",
+    "UPDATE analytes SET analyte_name = 'ALT (SGPT)' WHERE analyte_code = 'ALT'",
+    "DELETE FROM tests WHERE test_id = 'TEST002'",
+])
+def test_triggers_keep_mv_results_in_sync(conn, statement):
+    with conn:
+        conn.execute(statement)
+
+    assert _in_sync(conn)
+
+
+def test_new_result_appears_in_v_results(conn):
+    with conn:
+        conn.execute("INSERT INTO test_results (result_id, test_id, analyte_id, value_num, unit, flag) "
+                     "VALUES ('RESULT999', 'TEST002', 'ANALYTE010', 120.0, 'U/L', 'H')")
+
+    rows = conn.execute("SELECT pet_name, analyte_code, value_num FROM v_results WHERE value_num = 120.0").fetchall()
+    assert rows == [("Daisy", "ALT", 120.0)]
+
+
+def test_materialized_choice_is_stored_in_the_database(conn, diag_db, monkeypatch):
+    db.set_materialized_results(False, diag_db)
+    assert _view_source(conn) == "v_results_live"
+
+    # Reopening with a different default does not switch a current database back
+    monkeypatch.setattr(db, "MATERIALIZED_RESULTS", True)
+    monkeypatch.setattr(db, "_initialized", {})
+    db.init_db(diag_db)
+    assert _view_source(conn) == "v_results_live"
+
+    db.set_materialized_results(True, diag_db)
+    assert _view_source(conn) == "mv_results"
+
+
+def test_init_does_not_write_a_current_database(diag_db, monkeypatch):
+    before = os.stat(diag_db).st_mtime_ns
+    monkeypatch.setattr(db, "_initialized", {})
+
+    db.init_db(diag_db)
+
+    assert os.stat(diag_db).st_mtime_ns == before
+
+
+def test_older_database_is_migrated(conn, diag_db, monkeypatch):
+    with conn:
+        conn.execute("DROP TRIGGER trg_test_results_mv_update")
+        conn.execute("DELETE FROM mv_results")
+        conn.execute("PRAGMA user_version = 0")
+    monkeypatch.setattr(db, "_initialized", {})
+
+    db.init_db(diag_db)
+
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == db.SCHEMA_VERSION
+    assert _in_sync(conn)
+    with conn:
+        conn.execute("UPDATE test_results SET value_num = 1.0 WHERE result_id = 'RESULT001'")
+    assert _in_sync(conn)
+
+
+def test_rebuild_returns_the_row_count(conn, diag_db):
+    with conn:
+        conn.execute("DELETE FROM mv_results")
+
+    assert db.rebuild_materialized_results(diag_db) == 18
+    assert _in_sync(conn)
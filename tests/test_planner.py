@@ -0,0 +1,38 @@
+import json
+
+import pytest
+
+from agentic.agentic import _parse_plan
+
+
+def test_proceed_plan_with_sql():
+    raw = json.dumps({"action": "proceed", "tools": "sql_only", "sql": "```sql\nSELECT * FROM v_latest_results;\n```",
+                      "reason": "lab values"})
+
+    assert _parse_plan(raw) == {"action": "proceed", "tools": "SQL_ONLY", "reason": "lab values",
+                                "sql": "SELECT * FROM v_latest_results"}
+
+
+def test_code_fenced_json_is_accepted():
+    raw = '```json\n{"action": "proceed", "tools": "DOCS_ONLY", "sql": "SELECT 1", "reason": ""}\n```'
+
+    # DOCS_ONLY plans never carry SQL
+    assert _parse_plan(raw) == {"action": "proceed", "tools": "DOCS_ONLY", "reason": ""}
+
+
+def test_clarify_needs_a_question():
+    assert _parse_plan('{"action": "clarify", "question": " Which pet? ", "tools": null}') == {
+        "action": "clarify", "question": "Which pet?", "reason": ""}
+    assert _parse_plan('{"action": "clarify", "question": null}') is None
+
+
+@pytest.mark.parametrize("raw", [
+    "",
+    "PROCEED with SQL_ONLY",
+    "[1, 2]",
+    '{"action": "proceed", "tools": "EVERYTHING"}',
+    '{"action": "proceed"}',
+    '{"action": "maybe", "tools": "BOTH"}',
+])
+def test_unusable_plans_fall_back(raw):
+    assert _parse_plan(raw) is None
@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+import rag_utils
+from rag import quantize
+from rag import store as vector_store
+from rag.index import VectorIndex
+
+
+def _vectors(n, dim=32, seed=0):
+    return np.random.default_rng(seed).standard_normal((n, dim)).astype(np.float32)
+
+
+@pytest.mark.parametrize("mode", quantize.MODES)
+def test_rescoring_returns_exact_scores(mode):
+    index = VectorIndex(_vectors(2000))
+    quantized = quantize.QuantizedIndex(index, mode)
+    queries = _vectors(10, seed=1)
+
+    for q in queries:
+        rows, scores = quantized.search(q, 5)
+        assert np.allclose(scores, index.scores(q)[rows], atol=1e-6)
+        assert list(scores) == sorted(scores, reverse=True)
+    assert quantize.recall_at_k(quantized, queries, k=5) >= 0.95
+    rows, scores = quantized.search_many(queries, 5)
+    assert rows.shape == (10, 5)
+    assert np.array_equal(rows[0], quantized.search(queries[0], 5)[0])
+
+
+def test_codes_are_smaller_than_float32():
+    index = VectorIndex(_vectors(1000))
+    half = quantize.QuantizedIndex(index, "float16")
+    quarter = quantize.QuantizedIndex(index, "int8")
+
+    assert half.float32_nbytes == 1000 * 32 * 4
+    assert half.nbytes == half.float32_nbytes // 2
+    assert quarter.nbytes == 1000 * 32 + 1000 * 4
+
+
+def test_resident_bytes_count_heap_float32_only(store_path):
+    vectors = _vectors(300)
+    vector_store.write_store({"chunks": [{"text": str(i), "source": "a"} for i in range(100)],
+                              "embeddings": vectors[:100]}, store_path)
+    vector_store.append_chunks(store_path, [{"text": str(i), "source": "b"} for i in range(100, 300)], vectors[100:])
+    vector_store.delete_chunks(store_path, [3, 150])
+    mapped = VectorIndex(vector_store.read_store(store_path)["embeddings"], normalized=True)
+    in_heap = VectorIndex(vectors)
+
+    assert quantize.heap_nbytes(mapped.vectors) == 0
+    codes_only = quantize.QuantizedIndex(mapped, "int8")
+    assert codes_only.resident_nbytes == codes_only.nbytes
+    heap = quantize.QuantizedIndex(in_heap, "int8")
+    assert heap.resident_nbytes == heap.nbytes + in_heap.vectors.nbytes
+
+
+def test_quantization_report(stub_client, store_path):
+    vectors = _vectors(500)
+    rag_utils.add_chunks_to_store([{"text": f"chunk {i}", "source": "a.md"} for i in range(500)], vectors, store_path)
+
+    report = rag_utils.quantization_report(store_path, k=5, sample=20)
+
+    assert [row["mode"] for row in report] == list(quantize.MODES)
+    for row in report:
+        assert row["resident_bytes"] == row["bytes"]
+        assert row["saved_bytes"] == row["float32_bytes"] - row["resident_bytes"] > 0
+        assert 0.0 <= row["recall"] <= 1.0
+
+
+def test_unknown_mode_is_rejected():
+    assert quantize.resolve_mode("none") is None
+    with pytest.raises(ValueError):
+        quantize.resolve_mode("int4")
@@ -0,0 +1,73 @@
+import numpy as np
+
+import rag_utils
+from rag import store as vector_store
+
+DOC = "**Patient:** Daisy\n\n# History\n\nDaisy ate a sock.\n\n# Plan\n\nRecheck in two weeks."
+
+
+def _texts(store_path, doc_id=None):
+    return sorted(c["text"] for c in vector_store.list_chunks(store_path)
+                  if doc_id is None or vector_store.chunk_doc_id(c) == doc_id)
+
+
+def test_unchanged_document_embeds_nothing(stub_client, store_path):
+    first = rag_utils.reindex_document("notes.md", [DOC], store_path=store_path)
+    embedded = len(stub_client.embeddings.inputs)
+
+    again = rag_utils.reindex_document("notes.md", [DOC], store_path=store_path)
+
+    assert first["added"] == first["chunks"] > 0
+    assert again == {"chunks": first["chunks"], "added": 0, "unchanged": first["chunks"],
+                     "removed": 0, "rewritten": 0}
+    assert len(stub_client.embeddings.inputs) == embedded
+    assert vector_store.count_chunks(store_path) == first["chunks"]
+
+
+def test_edited_chunk_is_replaced(stub_client, store_path):
+    rag_utils.reindex_document("notes.md", [DOC], store_path=store_path)
+    stub_client.embeddings.inputs.clear()
+
+    edited = DOC.replace("two weeks", "three days")
+    result = rag_utils.reindex_document("notes.md", [edited], store_path=store_path)
+
+    assert (result["added"], result["removed"], result["rewritten"]) == (1, 1, 0)
+    assert stub_client.embeddings.inputs == [c for c in rag_utils.iter_chunks([edited]) if "three days" in c]
+    assert any("three days" in t for t in _texts(store_path))
+    assert not any("two weeks" in t for t in _texts(store_path))
+
+
+def test_metadata_change_rewrites_stored_vectors(stub_client, store_path):
+    rag_utils.reindex_document("notes.md", [DOC], store_path=store_path)
+    store = vector_store.read_store(store_path)
+    vectors = {c["text"]: np.asarray(row) for c, row in zip(store["chunks"], store["embeddings"])}
+    stub_client.embeddings.inputs.clear()
+
+    result = rag_utils.reindex_document("notes.md", [DOC.replace("Daisy", "Max")], store_path=store_path)
+
+    # Only the header and history chunks changed text; the plan chunk is re-written with its old vector
+    assert result["rewritten"] == 1
+    assert not any("Recheck" in t for t in stub_client.embeddings.inputs)
+    store = vector_store.read_store(store_path)
+    assert {c.get("pet_name") for c in store["chunks"]} == {"Max"}
+    for c, row in zip(store["chunks"], store["embeddings"]):
+        if c["text"] in vectors:
+            assert np.allclose(row, vectors[c["text"]])
+
+
+def test_repeated_chunks_are_stored_once(stub_client, store_path):
+    text = "# A\n\nsame words\n\n# A\n\nsame words"
+    result = rag_utils.reindex_document("dup.md", [text], store_path=store_path)
+    assert result["chunks"] == vector_store.count_chunks(store_path) == len(set(rag_utils.iter_chunks([text])))
+
+
+def test_upload_reuses_the_id_of_an_ingested_document(stub_client, store_path):
+    rag_utils.reindex_document("notes.md", [DOC], store_path=store_path, doc_id="visits/notes.md")
+
+    rag_utils.reindex_document("notes.md", [DOC.replace("two weeks", "a month")], store_path=store_path)
+
+    assert {vector_store.chunk_doc_id(c) for c in vector_store.list_chunks(store_path)} == {"visits/notes.md"}
+    stored = vector_store.count_chunks(store_path)
+    assert rag_utils.remove_document_from_store("notes.md", store_path) == 0
+    assert rag_utils.remove_document_from_store("visits/notes.md", store_path) == stored
+    assert vector_store.count_chunks(store_path) == 0
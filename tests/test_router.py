@@ -0,0 +1,44 @@
+from agentic.router import route
+
+
+def test_single_generic_words_do_not_route(diag_db):
+    for question in ("Show Daisy's results", "Is anything low for Daisy?", "Daisy plan"):
+        routed = route(question, diag_db)
+        assert routed["tools"] is not None
+        assert routed["confidence"] <= 0.6
+        assert not routed["hit"]
+
+
+def test_analyte_and_pet_route_to_sql(diag_db):
+    routed = route("What is Daisy's ALT?", diag_db)
+
+    assert routed["hit"]
+    assert routed["tools"] == "SQL_ONLY"
+    assert routed["pets"] == ["Daisy"]
+    assert routed["analytes"] == ["ALT"]
+
+
+def test_analyte_codes_are_case_sensitive_and_names_are_not(diag_db):
+    assert route("what's the alt text for this?", diag_db)["analytes"] == []
+    assert route("Daisy's white blood cell count", diag_db)["analytes"] == ["WBC"]
+
+
+def test_intent_phrases_pick_the_tools(diag_db):
+    docs = route("What did the vet say about Daisy?", diag_db)
+    both = route("Do Daisy's lab results support the vet's assessment?", diag_db)
+
+    assert (docs["tools"], docs["hit"]) == ("DOCS_ONLY", True)
+    assert (both["tools"], both["hit"]) == ("BOTH", True)
+
+
+def test_min_confidence_is_the_threshold(diag_db):
+    routed = route("most recent lab results", diag_db)
+
+    assert routed["confidence"] == 0.7
+    assert route("most recent lab results", diag_db, min_confidence=0.7)["hit"]
+    assert not route("most recent lab results", diag_db, min_confidence=0.8)["hit"]
+
+
+def test_unknown_question_has_no_tools(diag_db):
+    assert route("hello there", diag_db) == {"tools": None, "confidence": 0.0, "hit": False, "pets": [],
+                                             "analytes": [], "tests": [], "signals": []}
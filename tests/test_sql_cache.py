@@ -0,0 +1,74 @@
+import sqlite3
+
+from agentic import tools
+from agentic.sql_cache import ResultCache, normalize_sql, result_cache
+
+
+def _result(n):
+    return {"columns": ["n"], "rows": [{"n": i} for i in range(n)], "row_count": n}
+
+
+def _fill(cache, db_path, sql, version, n=1, max_rows=50):
+    """Miss then store, the way query_diagnostics uses the cache."""
+    assert cache.get(db_path, sql, max_rows, version) is None
+    cache.put(db_path, sql, max_rows, version, _result(n))
+
+
+def test_equivalent_spellings_share_a_key():
+    assert normalize_sql("SELECT  a , b\nFROM t WHERE x = 'Daisy';") == normalize_sql("select a,b from T where x='Daisy'")
+    assert normalize_sql("SELECT * FROM t WHERE x = 'Daisy'") != normalize_sql("SELECT * FROM t WHERE x = 'daisy'")
+
+
+def test_hit_returns_a_copy():
+    cache = ResultCache()
+    _fill(cache, "a.db", "SELECT 1", ("v", 1), n=2)
+
+    first = cache.get("a.db", "select 1;", 50, ("v", 1))
+    first["rows"].append({"n": 99})
+
+    assert cache.get("a.db", "SELECT 1", 50, ("v", 1)) == _result(2)
+    assert cache.get("a.db", "SELECT 1", 10, ("v", 1)) is None
+    assert (cache.stats()["hits"], cache.stats()["misses"]) == (2, 2)
+
+
+def test_new_data_version_empties_the_database_entries():
+    cache = ResultCache()
+    _fill(cache, "a.db", "SELECT 1", ("v", 1))
+    _fill(cache, "b.db", "SELECT 1", ("w", 1))
+
+    assert cache.get("a.db", "SELECT 1", 50, ("v", 2)) is None
+    assert cache.get("b.db", "SELECT 1", 50, ("w", 1)) is not None
+    # A result computed under the old version is not stored under the new one
+    cache.put("a.db", "SELECT 1", 50, ("v", 1), _result(1))
+    assert cache.stats()["entries"] == 1
+    assert cache.stats()["invalidations"] == 1
+
+
+def test_lru_eviction_by_count_and_bytes():
+    cache = ResultCache(max_entries=2)
+    for sql in ("SELECT 1", "SELECT 2", "SELECT 3"):
+        _fill(cache, "a.db", sql, 1)
+
+    assert cache.get("a.db", "SELECT 1", 50, 1) is None
+    assert cache.get("a.db", "SELECT 3", 50, 1) is not None
+    assert cache.stats()["evictions"] == 1
+
+    small = ResultCache(max_bytes=1000)
+    _fill(small, "a.db", "SELECT big", 1, n=100)
+    assert small.stats()["entries"] == small.stats()["bytes"] == 0
+
+
+def test_query_diagnostics_sees_writes(diag_db):
+    result_cache.clear()
+    sql = "SELECT COUNT(*) AS n FROM pets"
+
+    first = tools.query_diagnostics(sql)
+    second = tools.query_diagnostics(sql)
+    conn = sqlite3.connect(diag_db)
+    with conn:
+        conn.execute("INSERT INTO pets (pet_id, owner_id, name, species) VALUES ('PET002', 'OWNER001', 'Max', 'Dog')")
+    conn.close()
+    third = tools.query_diagnostics(sql)
+
+    assert (first["cached"], second["cached"], third["cached"]) == (False, True, False)
+    assert (first["rows"][0]["n"], third["rows"][0]["n"]) == (1, 2)
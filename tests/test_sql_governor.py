@@ -0,0 +1,79 @@
+import sqlite3
+
+import pytest
+
+from agentic import sql_governor
+from agentic.sql_governor import QueryRejected, check_plan, run_governed
+
+
+@pytest.fixture
+def conn(diag_db):
+    connection = sqlite3.connect(diag_db)
+    yield connection
+    connection.close()
+
+
+def test_aliases_come_from_every_from_list():
+    sql = ("SELECT * FROM test_results r, tests AS t JOIN visits v ON v.visit_id = t.visit_id "
+           "WHERE r.test_id IN (SELECT test_id FROM tests x) LIMIT 5")
+
+    aliases = sql_governor._sources(sql)
+
+    assert (aliases["r"], aliases["t"], aliases["v"], aliases["x"]) == ("test_results", "tests", "visits", "tests")
+    assert "where" not in aliases and "limit" not in aliases
+
+
+def test_subqueries_and_ctes_are_not_tables():
+    sql = ("WITH recent AS (SELECT * FROM visits) "
+           "SELECT * FROM recent JOIN (SELECT * FROM tests) AS t ON t.visit_id = recent.visit_id")
+
+    aliases = sql_governor._sources(sql)
+
+    assert aliases["recent"] == aliases["t"] == ""
+
+
+def test_view_aliases_are_resolved(conn):
+    aliases = sql_governor._aliases(conn, "SELECT * FROM v_results_live")
+
+    assert {alias: aliases[alias] for alias in "rtvpa"} == {
+        "r": "test_results", "t": "tests", "v": "visits", "p": "pets", "a": "analytes"}
+
+
+def test_cartesian_join_is_rejected(conn, diag_db):
+    with pytest.raises(QueryRejected) as rejected:
+        check_plan(conn, "SELECT * FROM test_results r, analytes a", diag_db, max_scan_rows=100)
+
+    assert "cartesian or unindexed join" in rejected.value.reason
+    assert "test_results (~18 rows)" in rejected.value.reason
+    assert rejected.value.plan
+
+
+def test_indexed_lookup_is_accepted(conn, diag_db):
+    sql = ("SELECT r.value_num FROM test_results r JOIN analytes a ON a.analyte_id = r.analyte_id "
+           "WHERE r.test_id = 'TEST001'")
+
+    checked = check_plan(conn, sql, diag_db, max_scan_rows=10)
+
+    assert checked["estimated_rows"] <= 10
+
+
+def test_full_scan_over_the_limit_is_rejected(conn, diag_db):
+    with pytest.raises(QueryRejected, match="full scan of test_results"):
+        check_plan(conn, "SELECT * FROM test_results WHERE comment IS NULL", diag_db, max_scan_rows=10)
+    # Without a filter the scan stops after LIMIT rows
+    assert check_plan(conn, "SELECT * FROM test_results LIMIT 5", diag_db, max_scan_rows=10)["estimated_rows"] == 5
+
+
+def test_row_estimates_follow_writes(conn, diag_db):
+    assert sql_governor._table_rows(conn, diag_db)["pets"] == 1
+    with conn:
+        conn.execute("INSERT INTO pets (pet_id, owner_id, name, species) VALUES ('PET002', 'OWNER001', 'Max', 'Dog')")
+
+    assert sql_governor._table_rows(conn, diag_db)["pets"] == 2
+
+
+def test_run_governed_truncates(diag_db):
+    result = run_governed("SELECT * FROM test_results LIMIT 10", max_rows=3, db_path=diag_db)
+
+    assert (result["row_count"], result["truncated"]) == (3, True)
+    assert result["plan"]
@@ -0,0 +1,102 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from rag import store as vector_store
+from rag.index import SegmentedMatrix, VectorIndex, normalize_rows
+
+
+def _chunks(n, start=0, source="a.md"):
+    return [{"text": f"chunk {i}", "source": source} for i in range(start, start + n)]
+
+
+def _vectors(n, dim=8, seed=0):
+    return np.random.default_rng(seed).standard_normal((n, dim)).astype(np.float32)
+
+
+def test_write_store_layout(store_path):
+    embeddings = _vectors(5)
+    vector_store.write_store({"chunks": _chunks(5), "embeddings": embeddings}, store_path)
+
+    manifest = vector_store.read_manifest(store_path)
+    assert manifest["version"] == vector_store.STORE_VERSION
+    assert (manifest["dim"], manifest["count"], manifest["deleted"]) == (8, 5, [])
+    [segment] = manifest["segments"]
+    matrix = np.fromfile(os.path.join(store_path, "segments", segment["name"] + ".f32"), dtype=np.float32)
+    assert np.allclose(matrix.reshape(5, 8), normalize_rows(embeddings))
+
+    store = vector_store.read_store(store_path)
+    assert isinstance(store["embeddings"], np.memmap)
+    assert [c["id"] for c in store["chunks"]] == [0, 1, 2, 3, 4]
+    assert store["normalized"]
+
+
+def test_append_writes_one_segment_per_call(store_path):
+    vector_store.write_store({"chunks": _chunks(3), "embeddings": _vectors(3)}, store_path)
+    before = os.path.getmtime(os.path.join(store_path, "segments", "seg-000000.f32"))
+    ids = vector_store.append_chunks(store_path, _chunks(2, start=3), _vectors(2, seed=1))
+
+    assert ids == [3, 4]
+    manifest = vector_store.read_manifest(store_path)
+    assert [s["rows"] for s in manifest["segments"]] == [3, 2]
+    assert os.path.getmtime(os.path.join(store_path, "segments", "seg-000000.f32")) == before
+    with pytest.raises(ValueError):
+        vector_store.append_chunks(store_path, _chunks(1), _vectors(1, dim=4))
+
+
+def test_legacy_json_store_is_migrated(tmp_path):
+    legacy = {"chunks": [
+        {"text": "first", "source": "a.md", "embedding": [3.0, 4.0]},
+        {"text": "second", "source": "b.md", "embedding": [0.0, 2.0]},
+    ]}
+    json_path = tmp_path / "rag_store.json"
+    json_path.write_text(json.dumps(legacy))
+
+    store = vector_store.read_store(str(json_path))
+
+    assert os.path.isfile(tmp_path / "rag_store" / vector_store.MANIFEST_FILE)
+    assert [(c["text"], c["source"]) for c in store["chunks"]] == [("first", "a.md"), ("second", "b.md")]
+    assert np.allclose(np.asarray(store["embeddings"]), [[0.6, 0.8], [0.0, 1.0]])
+    assert vector_store.count_chunks(str(json_path)) == 2
+
+
+def test_multi_segment_store_is_not_concatenated(store_path):
+    embeddings = _vectors(30)
+    vector_store.write_store({"chunks": _chunks(10), "embeddings": embeddings[:10]}, store_path)
+    vector_store.append_chunks(store_path, _chunks(10, start=10), embeddings[10:20])
+    vector_store.append_chunks(store_path, _chunks(10, start=20), embeddings[20:])
+    vector_store.delete_chunks(store_path, [2, 15, 29])
+
+    store = vector_store.read_store(store_path)
+    matrix = store["embeddings"]
+    assert isinstance(matrix, SegmentedMatrix)
+    assert all(isinstance(part, np.memmap) for part, _rows in matrix.parts)
+
+    live = [int(c["text"].split()[1]) for c in store["chunks"]]
+    dense = normalize_rows(embeddings[live])
+    assert matrix.shape == dense.shape
+    assert np.allclose(np.asarray(matrix), dense)
+    assert np.allclose(matrix[5:20], dense[5:20])
+    assert np.allclose(matrix[[20, 3, 3, -1]], dense[[20, 3, 3, -1]])
+    assert np.allclose(matrix[-2], dense[-2])
+
+    queries = _vectors(3, seed=7)
+    segmented, exact = VectorIndex(matrix, normalized=True), VectorIndex(dense, normalized=True)
+    assert segmented.vectors is matrix
+    for q in queries:
+        assert np.array_equal(segmented.search(q, 5)[0], exact.search(q, 5)[0])
+    assert np.array_equal(segmented.search_many(queries, 4)[0], exact.search_many(queries, 4)[0])
+
+
+def test_read_embeddings_returns_rows_in_requested_order(store_path):
+    embeddings = _vectors(6)
+    vector_store.write_store({"chunks": _chunks(3), "embeddings": embeddings[:3]}, store_path)
+    vector_store.append_chunks(store_path, _chunks(3, start=3), embeddings[3:])
+
+    rows = vector_store.read_embeddings(store_path, [4, 1])
+
+    assert np.allclose(rows, normalize_rows(embeddings[[4, 1]]))
+    with pytest.raises(KeyError):
+        vector_store.read_embeddings(store_path, [99])